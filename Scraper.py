@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
 
-import contextlib
 import logging
 import os
 import re
 import mimetypes
+import threading
 from csv import writer
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
 from re import split, compile
+from time import sleep
 
-import certifi
-import pandas as pd
-import selenium.webdriver as webdriver
-import urllib3
-from bs4 import BeautifulSoup
+from assets import AssetStore
+from browsers import BrowserPool
+from deadletter import DeadLetterStore
+from downloader import DownloadStage, create_pool, stream_to_file
+from journal import Journal
+from metrics import Metrics
+from profiling import Profiler
+from refresh import plan_refresh
+from runlog import LOGGER_NAME, RunLog
+from storage import (DATAFRAME_COLUMNS, BackgroundWriter, CITATION_FILES, CsvAppender, count_citations,
+                     remove_citations, sync_files, write_atomic)
 
 
 class Scraper:
@@ -23,53 +28,162 @@ class Scraper:
     It stores a list of Patent objects as well as all the html pages
     """
 
-    # creates a logging file
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    # logger of every run, its handlers are attached by RunLog
+    logger = logging.getLogger(LOGGER_NAME)
 
-    def __init__(self, csv_file, save_directory, interface, options):
+    def __init__(self, csv_file, save_directory, interface, options, browsers=None):
+        """
+        :param csv_file: DataFrame of the Google Patents csv file,
+                         None when the links are given one by one with add_link, see engine.run_streaming
+        :param save_directory: output path
+        :param interface: object receiving the progress, the ScraperApplication or an engine.ProgressListener
+        :param options: dictionary of options, see scrape
+        :param browsers: BrowserPool rendering the pages, usually started while the input file was read,
+                         None to launch the browsers on demand
+        """
         self.csv_file = csv_file
-        self.links = self.csv_file['result link'].tolist()  # creates a list from our links
+        self.links = []
+        self.csv_data = {}  # {column: {row label: value}}
+        self.rows = {}  # {url: label of its row in the csv file, the key of csv_data}
+        if csv_file is not None:
+            self.links = self.csv_file['result link'].tolist()  # creates a list from our links
+            self.csv_data = self.csv_file.to_dict()
+            # labels rather than positions: a filtered DataFrame keeps the labels of the original one
+            for label, link in zip(self.csv_file.index, self.links):
+                self.rows.setdefault(link, label)
+        self.extra_rows = {}  # {url: {column: value}}, links added after the csv file, see add_link
         self.html_pages = {}  # {url: html_page}
         self.path = save_directory  # path chosen by the user
         self.interface = interface
         self.options = options  # dictionary containing our options for scraping
         self.index = 1  # index of the current patent
         self.patent_list = []  # our list of patent
-        self.failed_url = []
-
-        os.makedirs(os.path.dirname(self.path + "/log/"), exist_ok=True)
-        formatter = logging.Formatter('%(asctime)s :: %(levelname)s :: %(message)s')
-        file_handler = RotatingFileHandler(self.path + '/log/' +
-                                           datetime.now().strftime('scraper_%H_%M_%S_%d_%m_%Y-debug.log'), mode='w')
-        file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(formatter)
-        self.logger.addHandler(file_handler)
+        self.metrics = Metrics()  # time spent in every stage, see write_metrics
+        self.cancelled = False  # set by cancel, the remaining links and downloads are skipped
+        self.http = None  # connection pool shared by the download threads, see _get_http
+        self.http_lock = threading.Lock()
+
+        # downloads start as soon as a link is scraped, on their own threads
+        self.downloads = None
+        if self.options.get('download_pdf') or self.options.get('download_figures'):
+            self.downloads = DownloadStage(self.options.get('download_threads', 10), self.logger)
+        self.scraping_finished = False  # the progress bar shows the downloads once the scraping is finished
+
+        # written by a background thread, replaces the log of the previous run, see finish
+        self.run_log = RunLog.from_options(self.path + '/log/', self.options).start()
+        self.logger.info('Options: %s', self.options)
+
+        # skips the assets already downloaded by a previous run and resumes the partial ones
+        self.assets = None
+        if self.downloads is not None and self.options.get('asset_store', True):
+            self.assets = AssetStore(self.path, self.logger)
+
+        # lines already in the citation files, the ones of the patents scraped again are replaced by save
+        self.previous_citations = count_citations(self.path + '/CSV/')
+        self.rewritten_ids = set()  # patents written by this run which may have citations of a previous run
+
+        # records every patent written, to resume the scraping after a crash
+        keep_journal = self.options.get('resume', False) or self.options.get('refresh', False)
+        self.journal = Journal(self.path, keep_journal, self.options.get('writer_fsync') in ('batch', 'always'))
+        self.previous_rows = []  # lines of dataFrame.csv written by a previous run
+        if self.options.get('resume'):
+            completed = self.journal.completed_urls()
+            self.previous_rows = [entry.get('row') for entry in self.journal.entries.values() if entry.get('row')]
+            self.links = [link for link in self.links if link not in completed]
+            self.logger.info('Resuming: %d patents already done, %d left', len(completed), len(self.links))
+        elif self.options.get('refresh'):
+            # scrapes again only the patents which may have changed since the previous run
+            self.links, self.previous_rows = plan_refresh(self.path, self.links, self.options, logger=self.logger)
+
+        # persists every patent as soon as it is scraped instead of waiting for the end of the scraping
+        self.writer = None
+        if self.options.get('background_writer', True):
+            fsync = self.options.get('writer_fsync', 'never')  # 'never', 'batch' or 'always'
+            self.writer = BackgroundWriter(self.persist,
+                                           sync=self.sync_outputs if fsync in ('batch', 'always') else None,
+                                           queue_size=self.options.get('writer_queue_size', 100),
+                                           batch_size=self.options.get('writer_batch_size', 10),
+                                           logger=self.logger)
+            self.writer.start()
+
+        # without keep_patents, the patents are only on the disk: their lines of dataFrame.csv are written by persist
+        self.keep_patents = self.options.get('keep_patents', True) or self.writer is None
+        self.data_frame_file = None
+        if not self.keep_patents:
+            self.data_frame_file = CsvAppender(self.path + '/CSV/dataFrame.csv', DATAFRAME_COLUMNS,
+                                               self.options.get('csv_delimiter'), self.previous_rows)
+            self.previous_rows = []  # already written
+
+        # function called by persist with every patent before it is written, see engine.run_crawl
+        self.on_persist = None
+
+        # browser sessions reused from a page to the next one, closed by close_browsers
+        self.browsers = browsers
+        if self.browsers is None:
+            self.browsers = BrowserPool(self.options.get('browser_sessions') or 1,
+                                        max_pages=self.options.get('browser_max_pages', 100), logger=self.logger)
+        self.browsers.metrics = self.metrics
+
+        # links which failed, retried in parallel at the end of the scraping, see retry_failed
+        keep_failed = keep_journal or self.options.get('retry_failed', False)
+        self.dead_letters = DeadLetterStore(self.path, self.options.get('max_attempts', 3), keep_failed)
+
+        # optional full-text index of the patents, updated by every run, see search.py
+        self.search_index = None
+        if self.options.get('search_index'):
+            from search import SearchIndex
+
+            self.search_index = SearchIndex(self.path, keep_failed)
+
+        # optional MinHash signatures of the patents, clustered into CSV/near_duplicates.csv by save
+        self.near_duplicates = None
+        if self.options.get('near_duplicates'):
+            from neardup import NearDuplicates
+
+            self.near_duplicates = NearDuplicates(self.options.get('near_duplicate_threshold', 0.8))
+
+        # live metrics for Prometheus, stopped by finish
+        self.exporter = None
+        if self.options.get('metrics_port') or self.options.get('metrics_textfile'):
+            from exporter import MetricsExporter  # http.server is only loaded when the metrics are exported
+
+            self.exporter = MetricsExporter(self, self.options.get('metrics_port'),
+                                            self.options.get('metrics_textfile'),
+                                            self.options.get('metrics_interval', 15)).start()
+
+        # opt-in profiling of the stages and of a sample of the patents, written by finish
+        self.profiler = Profiler.from_options(self.path + '/log/', self.options)
+        if self.profiler is not None:
+            self.metrics.profiler = self.profiler
+            self.profiler.checkpoint('start')
 
     def __get_all_data(self):
         """
         Iterates over all our patents and extract a DataFrame containing all their data
         :return: DataFrame Object containing all the patents' data
         """
-        data = pd.DataFrame()
+        import pandas as pd
+
+        rows = [patent.get_row() for patent in self.patent_list]
 
-        for patent in self.patent_list:
-            data = data.append(patent.get_dataframe())
+        # lines of a previous run, unless the patent has been scraped again
+        scraped = set(patent.patent_id for patent in self.patent_list)
+        rows += [row for row in self.previous_rows if str(row.get('id')) not in scraped]
 
-        return data
+        # built at once: appending the patents one by one copies the whole frame every time
+        return pd.DataFrame(rows, columns=DATAFRAME_COLUMNS)
 
     def _write_csv_file(self):
         """
         Writes all the data returned by __get_all_data function into a csv file
         """
+        import pandas as pd
+
         dataframe = self.__get_all_data()
         df = pd.DataFrame(data=dataframe)
 
         # reodering our columns
-        df = df[
-            ["id", "title", "assignee", "inventor/author", "priority date", "filing/creation date", "publication date",
-             "grant date", "link", "patent office", "type", "status", "nb_received_citations", "nb_given_citations",
-             'nb_non_patent_citations', "abstract", "description", "claims"]]
+        df = df[DATAFRAME_COLUMNS]
 
         # uses the delimiter given by the user or a comma by default
         separator = self.options.get('csv_delimiter')
@@ -77,15 +191,32 @@ class Scraper:
         df.to_csv(self.path + '/CSV/' + 'dataFrame.csv', encoding='utf-8', index=False, sep=separator)
 
     def scrape(self, url):
+        """
+        Scrapes a patent, see _scrape
+        When profiling, a sample of the patents is profiled from the rendering to the extraction
+        :param url: url to the patent
+        """
+        if self.profiler is not None and self.profiler.sample():
+            with self.profiler.profile('patent'):
+                patent = self._scrape(url)
+        else:
+            patent = self._scrape(url)
+
+        # outside of the profiled block: waiting for room in the writer queue is not part of the patent
+        if patent is not None and self.writer is not None:
+            self.writer.put(patent)  # its files are written in the background
+
+    def _scrape(self, url):
 
         """
         Main function used to scrape the data
         :param url: url to the patent
+        :return: the Patent object, None if the page failed or the scraping was cancelled
 
         First it renders the page by calling the render function which stores the html into the dictionary 'html_pages'
         Then, using the 'options' dictionary, it scrapes only the wanted data
         Finally it creates a Patent object, feeding it the scraped data
-        It then appends this patent to the list 'patent_list'
+        It then appends this patent to the list 'patent_list', unless 'keep_patents' is False
         And increases the progress on the progress bar
 
         options =
@@ -111,18 +242,64 @@ class Scraper:
             },
             'download_pdf': BOOLEAN,
             'download_figures': BOOLEAN,
-            'csv_delimiter': CHAR
+            'csv_delimiter': CHAR,
+            'download_threads': INTEGER, optional, number of threads downloading PDF and figures,
+            'download_connections': INTEGER, optional, size of the download connection pool,
+            'download_attempts': INTEGER, optional, tries of a PDF or figure before giving up, 3 by default,
+            'asset_store': BOOLEAN, optional, True by default, see AssetStore,
+            'background_writer': BOOLEAN, optional, True by default,
+            'writer_queue_size': INTEGER, optional,
+            'writer_batch_size': INTEGER, optional,
+            'writer_fsync': TEXT, optional, 'never', 'batch' or 'always',
+            'resume': BOOLEAN, optional, skips the links found in the journal of the previous run,
+            'refresh': BOOLEAN, optional, scrapes again only the outdated patents of the previous run, see RefreshPolicy,
+            'refresh_max_age_days': INTEGER, optional,
+            'refresh_final_max_age_days': INTEGER, optional,
+            'keep_text': BOOLEAN, optional, True by default, False to free the texts once written,
+            'keep_patents': BOOLEAN, optional, True by default, False to write dataFrame.csv line by line
+                            instead of keeping every Patent in patent_list, needs the background writer,
+            'near_duplicates': BOOLEAN, optional, clusters the patents with almost the same abstract and claims,
+            'near_duplicate_threshold': FLOAT, optional, similarity of two near-duplicates, 0.8 by default,
+            'search_index': BOOLEAN, optional, indexes the text of the patents into search.sqlite, see search.py,
+            'max_attempts': INTEGER, optional, number of times a failing link is scraped, 3 by default,
+            'browser_sessions': INTEGER, optional, browsers launched on demand when none is given, see BrowserPool,
+            'browser_max_pages': INTEGER, optional, pages rendered by a browser before it is replaced, 100 by default,
+            'retry_failed': BOOLEAN, optional, keeps the failed links of the previous run, see engine.run_failed,
+            'metrics_port': INTEGER, optional, serves the Prometheus metrics on http://127.0.0.1:<port>/metrics,
+            'metrics_textfile': TEXT, optional, .prom file rewritten for the node_exporter textfile collector,
+            'metrics_interval': INTEGER, optional, seconds between two writes of the .prom file,
+            'log_level': TEXT, optional, 'DEBUG', 'INFO' (default), 'WARNING' or 'ERROR',
+            'log_format': TEXT, optional, 'json' (default) or 'text',
+            'log_max_bytes': INTEGER, optional, size of a log file before it rotates,
+            'profile_stages': LIST or TEXT, optional, stages profiled with cProfile, see Profiler,
+            'profile_sample_rate': FLOAT, optional, part of the patents profiled,
+            'profile_top': INTEGER, optional, number of hotspots in the profile summaries,
+            'profile_memory': BOOLEAN, optional, tracemalloc snapshots at the checkpoints
         }
         """
 
-        print('link: \t' + url)
+        if self.cancelled:
+            return
 
-        self.render(url)  # renders our html page using the url
+        current_ID = ''
 
         try:
-            soup = BeautifulSoup(self.html_pages.get(url), 'html.parser')  # creates a Soup object with our html page
+            self.metrics.increment('renders_in_flight')
+            try:
+                with self.metrics.timer('render'):
+                    self.render(url)  # renders our html page using the url
+            finally:
+                self.metrics.increment('renders_in_flight', -1)
+
+            if url not in self.html_pages:  # cancelled while rendering
+                return
+
+            from bs4 import BeautifulSoup
+
+            # creates a Soup object with our html page, which is not needed anymore once parsed
+            with self.metrics.timer('parse'):
+                soup = BeautifulSoup(self.html_pages.pop(url), 'html.parser')
             data = {}  # dictionary contaning all of our data
-            temp = self.csv_file.to_dict()
 
             """Initialize data dictionary with our patent value
             This looks into the csv file for all the data that doesnt need to be scraped
@@ -130,42 +307,41 @@ class Scraper:
             """
 
             try:
-                for key, value in temp.items():
-                    value = str(value.get(self.links.index(url)))
+                if url in self.rows:
+                    values = {key: value.get(self.rows[url]) for key, value in self.csv_data.items()}
+                else:
+                    values = self.extra_rows.get(url, {})
+
+                for key, value in values.items():
+                    value = str(value)
                     if key == 'id':
                         data[key] = value.replace('-', '')
                     else:
                         data[key] = value
 
             except Exception as msg:
-                self.logger.exception(str(msg))
-                print('Not found :' + str(msg))
+                self.logger.exception('Values of %s not found in the csv file: %s', url, msg)
 
             try:
                 current_ID = data['id']
             except:
                 current_ID = data['Id']
 
-            print('Patent ID: ' + current_ID)
+            self.logger.debug('Scraping patent %s', current_ID, extra={'url': url})
 
             # boolean, defines the language when need to scrape
             english = self.options.get('language')
-            self.logger.info(url + " English option=" + str(english))
 
             """ below is all the optional stuff """
 
             # PDF download
-            self.logger.info('Patent ID: ' + current_ID + " PDF Download=" + str(self.options.get('download_pdf')))
-
             if self.options.get('download_pdf'):
-                data['pdf link'] = self.__get_pdf_link(soup, current_ID)
+                data['pdf link'] = self.metrics.time('extract.pdf_link', self.__get_pdf_link, soup, current_ID)
 
             # ABSTRACT
-            self.logger.info(
-                'Patent ID: ' + current_ID + " Scrape abstract=" + str(self.options.get('scrape_abstract')))
-
             if self.options.get('scrape_abstract') or self.options.get('separate_files'):
-                data['abstract'] = self.__get_abstract(soup, english, current_ID)
+                data['abstract'] = self.metrics.time('extract.abstract', self.__get_abstract,
+                                                     soup, english, current_ID)
             else:
                 data['abstract'] = ''
 
@@ -177,11 +353,9 @@ class Scraper:
                 data['ABSTRACT'] = 'Y'
 
             # DESCRIPTION
-            self.logger.info(
-                'Patent ID: ' + current_ID + " Scrape description=" + str(self.options.get('scrape_description')))
-
             if self.options.get('scrape_description') or self.options.get('separate_files'):
-                data['description'] = self.__get_description(soup, english, current_ID)
+                data['description'] = self.metrics.time('extract.description', self.__get_description,
+                                                        soup, english, current_ID)
             else:
                 data['description'] = ''
 
@@ -191,10 +365,9 @@ class Scraper:
                 data['DESCRIPTION'] = 'Y'
 
             # CLAIMS
-            self.logger.info('Patent ID: ' + current_ID + " Scrape claims=" + str(self.options.get('scrape_claims')))
-
             if self.options.get('scrape_claims') or self.options.get('separate_files'):
-                data['claims'] = self.__get_claims(soup, english, current_ID)
+                data['claims'] = self.metrics.time('extract.claims', self.__get_claims,
+                                                   soup, english, current_ID)
             else:
                 data['claims'] = ''
 
@@ -204,31 +377,26 @@ class Scraper:
                 data['CLAIMS'] = 'Y'
 
             # CLASSIFICATIONS
-            self.logger.info(
-                'Patent ID: ' + current_ID + ", Scrape classifications=" + str(
-                    self.options.get('scrape_classifications')))
-
             if self.options.get('scrape_classifications'):
-                data['classifications'] = self.__get_classifications(soup, current_ID)
+                data['classifications'] = self.metrics.time('extract.classifications', self.__get_classifications,
+                                                            soup, current_ID)
 
             # LEGAL EVENTS
-            self.logger.info(
-                'Patent ID: ' + current_ID + ", Scrape legal events=" + str(self.options.get('scrape_legal')))
-
             if self.options.get('scrape_legal'):
-                data['legal_events'] = self.__get_legal_events(soup, current_ID)
+                data['legal_events'] = self.metrics.time('extract.legal_events', self.__get_legal_events,
+                                                         soup, current_ID)
 
             # TYPE OF PATENT
-            data['type'] = self.__get_type(soup)
+            data['type'] = self.metrics.time('extract.type', self.__get_type, soup)
 
             # STATUS OF PATENT
-            data['status'] = self.__get_status(soup, current_ID)
+            data['status'] = self.metrics.time('extract.status', self.__get_status, soup, current_ID)
 
             # INVENTOR
-            data['inventor/author'] = self.__get_inventor(soup, current_ID)
+            data['inventor/author'] = self.metrics.time('extract.inventor', self.__get_inventor, soup, current_ID)
 
             # ASSIGNEE
-            data['assignee'] = self.__get_assignee(soup, current_ID)
+            data['assignee'] = self.metrics.time('extract.assignee', self.__get_assignee, soup, current_ID)
 
             """Creates our Patent object with all our data"""
             patent = Patent(data, self.logger)
@@ -236,45 +404,78 @@ class Scraper:
             # CITATIONS
             # always calls the scraping for the citations, just to get the number of citations per patent
             option = self.options.get('scrape_citations')
-            self.logger.info('Patent ID: ' + current_ID + ', Scraper citations= ' + str(option))
-            patent.citations.get_given_citations(soup, option)
+            self.metrics.time('extract.given_citations', patent.citations.get_given_citations, soup, option)
             patent.nb_given_citations = patent.citations.nb_given
-            self.logger.info(
-                'Patent ID: ' + current_ID + ', number of citations found: ' + str(patent.nb_given_citations))
+            self.logger.debug('Patent ID: %s, number of citations found: %s',
+                              current_ID, patent.nb_given_citations)
 
             option = self.options.get('scrape_cited')
-            self.logger.info('Patent ID: ' + current_ID + ', Scrape cited= ' + str(option))
-            patent.citations.get_received_citations(soup, option)
+            self.metrics.time('extract.received_citations', patent.citations.get_received_citations, soup, option)
             patent.nb_received_citations = patent.citations.nb_received
-            self.logger.info('Patent ID: ' + current_ID + ', number of cited patents found: '
-                             + str(patent.nb_received_citations))
+            self.logger.debug('Patent ID: %s, number of cited patents found: %s',
+                              current_ID, patent.nb_received_citations)
 
             option = self.options.get('scrape_nonpatent')
             if option:
-                self.logger.info('Patent ID: ' + current_ID + ', Scrape Non-patent citations= ' + str(option))
-                patent.citations.get_nonpatent_citations(soup)
+                self.metrics.time('extract.nonpatent_citations', patent.citations.get_nonpatent_citations, soup)
                 patent.nb_non_patent_citations = patent.citations.nb_non_patent
 
             # SIMILAR DOCUMENTS
-            self.logger.info('Patent ID: ' + current_ID +
-                             ' Scrape similar documents=' + str(self.options.get('scrape_similar')))
-
             if self.options.get('scrape_similar'):
-                patent.citations.get_similar_documents(soup)
-
-            self.patent_list.append(patent)  # adding the patent to the list
+                self.metrics.time('extract.similar_documents', patent.citations.get_similar_documents, soup)
+
+            self.schedule_downloads(patent)
+            self.extra_rows.pop(url, None)
+            if self.keep_patents:
+                self.patent_list.append(patent)  # adding the patent to the list
+            self.dead_letters.resolve(url)
+            self.metrics.increment('pages_scraped')
             text = 'Scraping... ({}/{})'.format(self.interface.nb_scraped, self.interface.MAX_LEN)
             self.interface.add_increment(text)
 
-        except TypeError as msg:
-            print("Exception: " + str(msg))
+            return patent
 
         except Exception as msg:
-            self.failed_url.append(url)
-            self.logger.error(
-                'URL "{}", ID {} ERROR: {}'.format(url, current_ID, str(msg)))
-            print('The url "{}" failed to scrape, trying again... \n ERROR: {}'.format(url, msg))
-            self.scrape(url)
+            attempts = self.dead_letters.record(url, msg)
+            self.metrics.increment('pages_failed')
+            self.logger.warning('URL "%s", ID %s ERROR (attempt %d): %s', url, current_ID, attempts, msg,
+                                extra={'url': url, 'error_class': type(msg).__name__})
+
+    def retry_failed(self, pool=None):
+        """
+        Scrapes again the links which failed, until they are scraped or failed 'max_attempts' times
+        The links still failing stay in the dead letter file, see DeadLetterStore
+        :param pool: ThreadPool scraping the links in parallel, None to scrape them one by one
+        """
+        links = self.dead_letters.retryable()
+
+        while links and not self.cancelled:
+            self.logger.info('Retrying %d failed links', len(links))
+            self.metrics.increment('retries', len(links))
+            if pool is None:
+                for link in links:
+                    self.scrape(link)
+            else:
+                pool.map(self.scrape, links)
+            links = self.dead_letters.retryable()
+
+    def add_link(self, url, values):
+        """
+        Gives the values of a link which is not in the csv file given to __init__,
+        for example a patent found in the citations or a line of a streamed csv file
+        The link is not added to 'links': the caller schedules it
+        :param url: link to the patent
+        :param values: dictionary replacing the line of the csv file: {'id': ..., 'title': ..., 'result link': ...}
+        """
+        self.extra_rows[url] = values
+
+    def cancel(self):
+        """
+        Stops the scraping: the links and downloads not started yet are skipped
+        and the ones in progress are not retried
+        """
+        self.cancelled = True
+        self.logger.info('Scraping cancelled')
 
     def render(self, url):
         """
@@ -288,117 +489,281 @@ class Scraper:
 
         :param url: url to the patent
         """
+        if self.cancelled:
+            return
+
         content = None
-        chrome_options = webdriver.ChromeOptions()
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.set_headless(headless=True)
 
         try:
-            with contextlib.closing(webdriver.Chrome(chrome_options=chrome_options)) as driver:
+            driver = self.browsers.acquire()
+            broken = True  # a session failing in the middle of a page is replaced
+            try:
                 while content is None:
                     driver.get(url)
                     content = driver.page_source
+                broken = False
+            finally:
+                self.browsers.release(driver, broken)
 
             # content returned if there is no response from the server
             if content == '<html xmlns="http://www.w3.org/1999/xhtml"><head></head><body></body></html>':
-                driver.quit()
                 raise ConnectionError('Page is empty. Please check your internet connection')
 
-            driver.quit()
-
             self.html_pages.update({url: content})
 
         except Exception as e:
-            self.logger.exception(str(e) + "\n URL :" + url)
-            print('Error while rendering page : \n' + str(e))
-            print('Trying again...')
-            self.render(url)
+            self.logger.debug('Error while rendering %s', url, exc_info=True)
+            raise  # the link is retried by retry_failed
+
+    def persist(self, patent):
+        """
+        Writes the txt files and the citations of a single patent
+        :param patent: Patent object
+        """
+        if self.on_persist is not None:
+            self.on_persist(patent)
+
+        concatenated = self.options.get('concatenate')
+        separated = self.options.get('separate_files')
+        fsync = self.options.get('writer_fsync') == 'always'
+        outputs = self.metrics.time('write.txt', patent.write_txt_files,
+                                    self.path + '/TXT/', concatenated, separated, fsync)
+        outputs += self.metrics.time('write.citations', patent.write_citations, self.path)
+        if self.previous_citations:
+            self.rewritten_ids.add(patent.patent_id)
+        row = patent.get_row()
+        with self.metrics.timer('write.journal'):
+            self.journal.record(patent.patent_id, patent.link, outputs, row)
+        if self.data_frame_file is not None:
+            self.metrics.time('write.dataframe', self.data_frame_file.write, row)
+        if self.search_index is not None:
+            self.metrics.time('write.index', self.search_index.add_patent, patent)
+        if self.near_duplicates is not None:
+            self.metrics.time('minhash', self.near_duplicates.add_patent, patent)
+
+        if not self.options.get('keep_text', True):
+            patent.release_text()  # written to the disk, only the short data is kept for dataFrame.csv
+
+    def sync_outputs(self):
+        """Flushes the csv files to the disk, called by the background writer after every batch"""
+        names = list(CITATION_FILES)
+        if self.data_frame_file is not None:
+            names.append('dataFrame.csv')
+        sync_files([self.path + '/CSV/' + name for name in names])
 
     def save(self):
         """
         Calls every method used to save data: txt files and csv files
+        When the background writer is used, waits for it to write the remaining patents
+        and writes again the ones it failed to write
         """
         try:
-            self.interface.label_status.setText('Saving files...')
+            self.interface.set_status('Saving files...')
+            if self.profiler is not None:
+                self.profiler.checkpoint('scraped')
+
+            if self.writer is not None:
+                self.writer.close()
+                failed, self.writer.failed = self.writer.failed, []
 
-            for patent in self.patent_list:
-                concatenated = self.options.get('concatenate')
-                separated = self.options.get('separate_files')
-                patent.write_txt_files(self.path + '/TXT/', concatenated, separated)
-                patent.write_citations(self.path)
+                for patent, msg in failed:
+                    self.persist(patent)
+            else:
+                for patent in self.patent_list:
+                    self.persist(patent)
+
+            if self.rewritten_ids:
+                # the patents scraped again replace their old citations, the ones which failed keep them
+                self.metrics.time('write.citations', remove_citations, self.path + '/CSV/', self.rewritten_ids,
+                                  self.previous_citations)
 
-            self._write_csv_file()
+            if self.data_frame_file is not None:
+                self.data_frame_file.close()  # already written line by line
+            else:
+                self.metrics.time('write.dataframe', self._write_csv_file)
+            if self.near_duplicates is not None:
+                self._write_near_duplicates()
+            self.journal.close()
+            if self.search_index is not None:
+                self.search_index.close()
+            self.dead_letters.close()
+            if self.dead_letters.entries:
+                self.logger.warning('%d links failed, see %s', len(self.dead_letters.entries),
+                                    self.dead_letters.file_path)
         except Exception as msg:
-            print(msg)
+            self.logger.exception('Cannot save the files: %s', msg)
+            raise
+
+    def _write_near_duplicates(self):
+        """
+        Writes the clusters of near-duplicate patents into CSV/near_duplicates.csv
+        The patents kept from a previous run are read from their text files
+        """
+        self.metrics.time('minhash', self.near_duplicates.add_outputs, self.path, self.journal.entries.values())
+        nb_patents = self.metrics.time('write.near_duplicates', self.near_duplicates.write_report, self.path)
+        self.logger.info('%d near-duplicate patents, see CSV/%s', nb_patents, self.near_duplicates.REPORT_NAME)
+
+    def write_metrics(self):
+        """
+        Writes the latency and throughput of every stage into log/timings.csv and the log
+        :return: list of dictionaries, one per stage, see Metrics.summary
+        """
+        rows = self.metrics.write_report(self.path + '/log/timings.csv')
+        self.logger.info('Timings of the stages (seconds):\n%s', self.metrics.format_summary())
+
+        return rows
+
+    def close_browsers(self):
+        """Quits the browsers once every page is rendered, so they do not use memory during the downloads"""
+        self.browsers.close()
+
+    def finish(self):
+        """
+        Ends the run once the scraping and the downloads are finished:
+        closes the browsers, writes the metrics, stops their exporter and closes the log
+        """
+        self.close_browsers()
+        self.write_metrics()
+
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.profiler is not None:
+            self.profiler.checkpoint('finished')
+            for file_path in self.profiler.write():
+                self.logger.info('Profile written: %s', file_path)
+            self.profiler.stop()
+        self.run_log.stop()
+
+    def _get_http(self):
+        """
+        Returns the connection pool shared by every download, creating it on first use
+        'download_connections' in the options sets the number of connections kept alive
+        """
+        with self.http_lock:
+            if self.http is None:
+                self.http = create_pool(self.options.get('download_connections', 32))
+            return self.http
+
+    def schedule_downloads(self, patent):
+        """
+        Submits the PDF and figure of a patent to the download threads, if the user wants them
+        :param patent: Patent object
+        """
+        if self.downloads is None:
+            return
+
+        if self.options.get('download_pdf') and patent.pdf_link:
+            self.interface.pdf_list.append(patent.pdf_link)
+            self.downloads.submit(self.download_pdf, patent.pdf_link)
+
+        if self.options.get('download_figures') and patent.figure_link:
+            id_url = patent.patent_id + '#' + patent.figure_link
+            self.interface.figures_list.append(id_url)
+            self.downloads.submit(self.download_figures, id_url)
+
+    def wait_downloads(self):
+        """Waits for the downloads submitted while scraping"""
+        self.scraping_finished = True
+        if self.downloads is not None:
+            self.downloads.join()
+
+    def _download(self, url, file_path):
+        """
+        Downloads a file through the asset store if used, otherwise streams it directly
+        :return: number of bytes downloaded, None if the file is not available
+        """
+        if self.assets is not None:
+            return self.assets.fetch(self._get_http(), url, file_path)
+
+        return stream_to_file(self._get_http(), url, file_path)
+
+    def _download_with_retries(self, stage, url, file_path):
+        """
+        Downloads a file in up to 'download_attempts' attempts, waiting 1, 2, 4... seconds between two of them
+        :param stage: name of the stage timing every attempt
+        :return: number of bytes downloaded, None if the file is not available
+        :exception: the error of the last attempt
+        """
+        attempts = max(1, self.options.get('download_attempts', 3))
+
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.metrics.timer(stage):
+                    return self._download(url, file_path)
+            except Exception as msg:
+                if attempt == attempts or self.cancelled:
+                    raise
+                delay = 2 ** (attempt - 1)
+                self.logger.warning('Cannot download %s (attempt %d), trying again in %d seconds: %s',
+                                    url, attempt, delay, msg)
+                sleep(delay)
 
     def download_pdf(self, url):
         """
         Creates our download folder if not already existing
-        Downloads the pdf file
+        Downloads the pdf file, streaming it to the disk
         :param url: link to a url from our initial csv file
         """
+        if self.cancelled:
+            return
+
         try:
-            self.logger.info('Downloading PDF: ' + url)
+            self.logger.debug('Downloading PDF: %s', url)
 
             dirpath = self.path + '/PDF/'
-            os.makedirs(os.path.dirname(dirpath), exist_ok=True)  # creates our destination folder
-
-            connection_pool = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
-            resp = connection_pool.request('GET', url)
+            size = self._download_with_retries('download.pdf', url, dirpath + split('/', url)[-1])
+            self.metrics.increment('bytes_downloaded', size or 0)
 
-            with open(dirpath + split('/', url)[-1], 'wb') as f:
-                f.write(resp.data)
-                f.close()
-            resp.release_conn()
-
-            self.interface.nb_pdf += 1
-            text = 'Downloading PDF... ({}/{})'.format(self.interface.nb_pdf, len(self.interface.pdf_list))
-            print('Downloading :' + url)
-            self.interface.add_increment(text)
+            if size is None:
+                self.logger.info('PDF not available: %s', url)
 
         except Exception as msg:
-            self.logger.exception('Cannot download PDF: ' + url + str(msg))
-            print('Cannot download PDF: ' + url)
-            print(msg)
-            print('Trying again...')
-            self.download_pdf(url)
+            self.logger.error('Cannot download PDF %s: %s', url, msg)
+            self.dead_letters.record(url, msg, 'pdf')
+
+        self.interface.nb_pdf += 1
+        text = 'Downloading PDF... ({}/{})'.format(self.interface.nb_pdf, len(self.interface.pdf_list))
+        self._download_progress(text)
 
     def download_figures(self, id_url):
         """
         Creates our download folder if not already existing
-        Downloads the pdf file
+        Downloads the figure, streaming it to the disk
         :param id_url: string containing the id and url of patent : ID#URL
         """
+        if self.cancelled:
+            return
 
         id = id_url.split('#')[0]
         url = id_url.split('#')[1]
 
         try:
-            self.logger.info('Downloading figure: ' + url)
+            self.logger.debug('Downloading figure: %s', url)
 
             dirpath = self.path + '/FIGURES/'
-            os.makedirs(os.path.dirname(dirpath), exist_ok=True)  # creates our destination folder
+            size = self._download_with_retries('download.figure', url, dirpath + id + '.png')
+            self.metrics.increment('bytes_downloaded', size or 0)
 
-            connection_pool = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
-            resp = connection_pool.request('GET', url)
+            if size is None:
+                self.logger.info('Figure not available: %s', url)
 
-            if resp.status == 200:
-                with open(dirpath + id + '.png', 'wb') as f:
-                    f.write(resp.data)
-                    f.close()
-                resp.release_conn()
+        except Exception as msg:
+            self.logger.error('Cannot download figure %s: %s', url, msg)
+            self.dead_letters.record(url, msg, 'figure')
 
-            self.interface.nb_figures += 1
-            text = 'Downloading figures... ({}/{})'.format(self.interface.nb_figures, len(self.interface.figures_list))
-            print('Downloading :' + url)
-            self.interface.add_increment(text)
+        self.interface.nb_figures += 1
+        text = 'Downloading figures... ({}/{})'.format(self.interface.nb_figures, len(self.interface.figures_list))
+        self._download_progress(text)
 
-        except Exception as msg:
-            self.logger.exception('Cannot download figure: ' + url + str(msg))
-            print('Cannot download figure: ' + url)
-            print(msg)
-            print('Trying again...')
-            self.download_figures(url)
+    def _download_progress(self, text):
+        """
+        Shows the progress of a download
+        While the scraping is still running, the progress bar belongs to the scraping: the text is only logged
+        """
+        if self.downloads is not None and not self.scraping_finished:
+            self.logger.debug(text)
+        else:
+            self.interface.add_increment(text)
 
     def __get_pdf_link(self, soup, id):
         """
@@ -414,12 +779,11 @@ class Scraper:
                 url = pdf_link[-1]
 
             if url is not None:
-                self.logger.info("Patent ID: " + id + ", PDF link: " + url)
+                self.logger.debug('Patent ID: %s, PDF link: %s', id, url)
                 return url
 
         except Exception as msg:
-            self.logger.info("Patent ID: " + id + ", no PDF link found \n")
-            print('No PDF link found')
+            self.logger.debug('Patent ID: %s, no PDF link found', id)
 
     def __get_abstract(self, soup, english, id):
         """
@@ -461,11 +825,10 @@ class Scraper:
                 found_abstract = True
 
         if found_abstract is False:
-            self.logger.info("Patent ID: " + id + ', no Abstract found')
-            print('No abstract found')
+            self.logger.debug('Patent ID: %s, no Abstract found', id)
             return ""
         else:
-            self.logger.info("Patent ID: " + id + ', Abstract found')
+            self.logger.debug('Patent ID: %s, Abstract found', id)
             return out_abstract
 
     def __get_description(self, soup, english, id):
@@ -505,11 +868,10 @@ class Scraper:
                 found_description = True
 
         if found_description is False:
-            self.logger.info('Patent ID: ' + id + ', no Description found')
-            print('No description found')
+            self.logger.debug('Patent ID: %s, no Description found', id)
             return ""
         else:
-            self.logger.info('Patent ID: ' + id + ', Description found')
+            self.logger.debug('Patent ID: %s, Description found', id)
             return out_description
 
     def __get_claims(self, soup, english, id):
@@ -549,11 +911,10 @@ class Scraper:
                 found_claims = True
 
         if found_claims is False:
-            self.logger.info('Patent ID: ' + id + ', no Claims found')
-            print('No claims found')
+            self.logger.debug('Patent ID: %s, no Claims found', id)
             return ""
         else:
-            self.logger.info('Patent ID:' + id + ', Claims found')
+            self.logger.debug('Patent ID: %s, Claims found', id)
             return out_claims
 
     def __get_type(self, soup):
@@ -564,8 +925,7 @@ class Scraper:
             return soup.find(class_='tagline style-scope patent-result').text
 
         except TypeError as msg:
-            self.logger.exception(str(msg))
-            print(msg)
+            self.logger.debug('No type found: %s', msg)
             return ''
 
     def __get_status(self, soup, id):
@@ -576,14 +936,13 @@ class Scraper:
 
             """Sometimes there are multiple statuses, we only want the last one, if empty, the first one"""
             if status:
-                self.logger.info('Patent ID: ' + id + ', Status found')
+                self.logger.debug('Patent ID: %s, Status found', id)
                 return status
             else:
-                self.logger.info('Patent ID: ' + id + ', Status found')
+                self.logger.debug('Patent ID: %s, Status found', id)
                 return status[0]
         except:
-            self.logger.info('Patent ID: ' + id + ', no Status found')
-            print('No status found')
+            self.logger.debug('Patent ID: %s, no Status found', id)
             return ''
 
     def __get_classifications(self, soup, id):
@@ -599,11 +958,10 @@ class Scraper:
                 txt = x.get_text()
                 out_classifications += re.sub('\n+', '\n', txt)  # gets rid of the unecessary \n in the text
 
-            self.logger.info('Patent ID: ' + id + ', Classifications found')
+            self.logger.debug('Patent ID: %s, Classifications found', id)
             return out_classifications
         except AttributeError:
-            self.logger.info('Patent ID: ' + id + ', no Classifications found')
-            print('No classification found')
+            self.logger.debug('Patent ID: %s, no Classifications found', id)
             return ''
 
     def __get_legal_events(self, soup, id):
@@ -622,12 +980,11 @@ class Scraper:
                 for x in events.find_all(class_='tr style-scope patent-result'):
                     out_legal_events += x.get_text()
 
-            self.logger.info('Patent ID: ' + id + ', Legal Events found')
+            self.logger.debug('Patent ID: %s, Legal Events found', id)
             return out_legal_events
 
         except AttributeError:
-            self.logger.info('Patent ID: ' + id + ', no Legal Events found')
-            print('No legal events found')
+            self.logger.debug('Patent ID: %s, no Legal Events found', id)
             return ''
 
     def __get_inventor(self, soup, id):
@@ -636,12 +993,11 @@ class Scraper:
 
             for x in soup.find_all(attrs={'data-inventor': compile(r".*")}, class_='style-scope patent-result'):
                 inventor.append(x['data-inventor'])
-                self.logger.info('Patent ID: ' + id + ', Inventor found')
+                self.logger.debug('Patent ID: %s, Inventor found', id)
                 return inventor[-1]
 
         except Exception as msg:
-            self.logger.info('Patent ID: ' + id + ', no Inventor found')
-            print("No inventor found")
+            self.logger.debug('Patent ID: %s, no Inventor found', id)
             return ''
 
     def __get_assignee(self, soup, id):
@@ -650,12 +1006,11 @@ class Scraper:
 
             for x in soup.find_all(attrs={'data-assignee': compile(r".*")}, class_='style-scope patent-result'):
                 inventor.append(x['data-assignee'])
-                self.logger.info('Patent ID: ' + id + ', Assignee found')
+                self.logger.debug('Patent ID: %s, Assignee found', id)
                 return inventor[-1]
 
         except Exception as msg:
-            self.logger.info('Patent ID: ' + id + ', no Assignee found')
-            print("No assignee found")
+            self.logger.debug('Patent ID: %s, no Assignee found', id)
             return ''
 
 
@@ -730,8 +1085,7 @@ class Citations:
                     self.given.update({self.patent_id: out_givencitations})
 
         except AttributeError:  # if there is no citations 'find_all' will raise an AttributeError exception
-            self.logger.info('Patent ID: ' + self.patent_id + ', no Cited Patents found')
-            print('No cited patents found')
+            self.logger.debug('Patent ID: %s, no Cited Patents found', self.patent_id)
             return None
 
     def get_received_citations(self, soup, option):
@@ -789,8 +1143,7 @@ class Citations:
                     self.received.update({self.patent_id: out_receivedcitations})
 
         except AttributeError:
-            self.logger.info('Patent ID: ' + self.patent_id + ', no Citing Patents found')
-            print('No citations found')
+            self.logger.debug('Patent ID: %s, no Citing Patents found', self.patent_id)
             return None
 
     def get_nonpatent_citations(self, soup):
@@ -818,11 +1171,10 @@ class Citations:
                     self.nb_non_patent += 1
 
                 self.non_patent.update({self.patent_id: out_nonpatentcitations})
-                self.logger.info('Patent ID: ' + self.patent_id + ', Non-Patent citations found')
+                self.logger.debug('Patent ID: %s, Non-Patent citations found', self.patent_id)
 
         except AttributeError:
-            self.logger.info('Patent ID: ' + self.patent_id + ', no Non-Patent citations found')
-            print('No Non-Patent citations found')
+            self.logger.debug('Patent ID: %s, no Non-Patent citations found', self.patent_id)
             return None
 
     def get_similar_documents(self, soup):
@@ -858,12 +1210,11 @@ class Citations:
                 out_similar_documents.update({'ids': ids, 'dates': dates, 'titles': titles})
 
                 # storing the result into the dictionary
-                self.logger.info('Patent ID: ' + self.patent_id + ', Similar documents found')
+                self.logger.debug('Patent ID: %s, Similar documents found', self.patent_id)
                 self.similar_documents.update({self.patent_id: out_similar_documents})
 
         except AttributeError:
-            self.logger.info('Patent ID: ' + self.patent_id + ', no Similar documents found')
-            print('No similar documents found')
+            self.logger.debug('Patent ID: %s, no Similar documents found', self.patent_id)
             return None
 
     def given_items(self):
@@ -889,7 +1240,6 @@ class Patent:
             self.figure_link = data['representative figure link']
         except:
             self.figure_link = None
-            print('No representative figure link found')
 
         self.logger = logger
 
@@ -905,7 +1255,7 @@ class Patent:
 
         self.priority_date = data['priority date']
         self.publication_date = data['publication date']
-        self.creation_date = data['filing/creation date'],
+        self.creation_date = data['filing/creation date']
         self.grant_date = data['grant date']
 
         try:
@@ -950,6 +1300,18 @@ class Patent:
     def abstract(self):
         return self.abstract
 
+    def release_text(self):
+        """
+        Frees the memory used by the texts and citations once they have been written
+        The Y/N columns of dataFrame.csv and the number of citations are kept
+        """
+        self.abstract = ''
+        self.description = ''
+        self.claims = ''
+        self.classifications = ''
+        self.legal_events = ''
+        self.citations = Citations(self.patent_id, self.logger)
+
     def all_text(self):
         """
         Creates a dictionary containing our abstract, description, claims, classifications, legal events, title
@@ -968,70 +1330,84 @@ class Patent:
         """
         Gets every 'short' info about a patent and returns a Pandas DataFrame Object
         """
-        return pd.DataFrame(
-            {
-                'id': self.patent_id,
-                'title': self.title,
-                'assignee': self.assignee,
-                'inventor/author': self.inventor,
-                'priority date': self.priority_date,
-                'filing/creation date': self.creation_date,
-                'publication date': self.publication_date,
-                'grant date': self.grant_date,
-                'link': self.link,
-                'pdf link': self.pdf_link,
-                'type': self.type,
-                'status': self.status,
-                'patent office': self.patent_id[:2],
-                'nb_received_citations': self.nb_received_citations,
-                'nb_given_citations': self.nb_given_citations,
-                'nb_non_patent_citations': self.nb_non_patent_citations,
-                'abstract': self.found_abstract,
-                'description': self.found_description,
-                'claims': self.found_claims
-            }
-        )
-
-    def write_txt_files(self, filepath, concatenated, separated):
+        import pandas as pd
+
+        return pd.DataFrame([self.get_row()])
+
+    def get_row(self):
+        """
+        Gets every 'short' info about a patent, its line of dataFrame.csv
+        :return: dictionary {column: value}
+        """
+        return {
+            'id': self.patent_id,
+            'title': self.title,
+            'assignee': self.assignee,
+            'inventor/author': self.inventor,
+            'priority date': self.priority_date,
+            'filing/creation date': self.creation_date,
+            'publication date': self.publication_date,
+            'grant date': self.grant_date,
+            'link': self.link,
+            'pdf link': self.pdf_link,
+            'type': self.type,
+            'status': self.status,
+            'patent office': self.patent_id[:2],
+            'nb_received_citations': self.nb_received_citations,
+            'nb_given_citations': self.nb_given_citations,
+            'nb_non_patent_citations': self.nb_non_patent_citations,
+            'abstract': self.found_abstract,
+            'description': self.found_description,
+            'claims': self.found_claims
+        }
+
+    def write_txt_files(self, filepath, concatenated, separated, fsync=False):
         """
         Writes our text contained into a Patent into txt files
+        Every file is built in memory then written at once, so running the scraper twice
+        gives the same files instead of appending the content again
+        Files which already have the same content are left untouched
         :param  filepath: Output path
         :param  concatenated: dictionary : {'ABSTRACT': boolean, 'DESCRIPTION': boolean, 'CLAIMS': boolean,
                                             'TITLE': boolean}
                                             Puts all TRUE keys into a single file for each patent
                 separated:  True: folders for abstract, description and claims
                             False: a single text file with all content in it
+                fsync: flushes every written file to the disk
+        :return: list of the files of this patent, written or already up to date
         """
         text = self.all_text()
+        concatenated_content = ''  # content of CONCATENATED_ITEMS/<id>.txt
+        single_content = ''  # content of <id>.txt when the items are not separated
+        files = {}  # {file path: content}
 
         for name, content in text.items():
 
             if content:
+                item = '\n' + name + '\n' + content + '\n'
+
                 if concatenated.get(name) is True:
-                    # creates a folder if it doesnt exist
-                    os.makedirs(os.path.dirname(str(filepath) + 'CONCATENATED_ITEMS/'), exist_ok=True)
+                    concatenated_content += item
+
+                if separated is True and name != 'TITLE':
+                    files[filepath + str(name) + '/' + str(self.patent_id) + '.txt'] = item
 
-                    with open(str(filepath) + 'CONCATENATED_ITEMS' + '/' + str(self.patent_id) + '.txt',
-                              'at', encoding='utf-8') as txt_file:
-                        txt_file.write('\n' + name + '\n' + content + '\n')
-                        txt_file.close()
+                elif name != 'TITLE':
+                    single_content += item
 
-                if separated is True and name is not 'TITLE':
-                    # creates a folder if it doesnt exist
-                    os.makedirs(os.path.dirname(filepath + str(name) + '/'), exist_ok=True)
+        if concatenated_content:
+            files[str(filepath) + 'CONCATENATED_ITEMS/' + str(self.patent_id) + '.txt'] = concatenated_content
 
-                    with open(filepath + str(name) + '/' + str(self.patent_id) + '.txt',
-                              'wt', encoding='utf-8') as txt_file:
-                        txt_file.write(str('\n' + name + '\n' + content + '\n'))
-                        txt_file.close()
+        if single_content:
+            files[filepath + str(self.patent_id) + '.txt'] = single_content
 
-                elif name is not 'TITLE':
-                    # creates a folder if it doesnt exist
-                    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        nb_written = 0
+        for file_path, content in files.items():
+            if write_atomic(file_path, content, fsync=fsync):
+                nb_written += 1
 
-                    with open(filepath + str(self.patent_id) + '.txt', 'at', encoding='utf-8') as txt_file:
-                        txt_file.write(str('\n' + name + '\n' + content + '\n'))
-                        txt_file.close()
+        self.logger.debug('Patent ID: %s, %d text files written', self.patent_id, nb_written)
+        return list(files.keys())
 
     def write_given_citations(self, dirpath):
         """
@@ -1175,8 +1551,17 @@ class Patent:
             nonpatent_file.close()
 
     def write_citations(self, dirpath):
+        """
+        Writes every kind of citation into its csv file
+        :return: list of the csv files containing citations of this patent
+        """
         dirpath += '/CSV/'
         self.write_given_citations(dirpath)
         self.write_received_citations(dirpath)
         self.write_similar_documents(dirpath)
         self.write_nonpatent_citations(dirpath)
+
+        written = [('given_citations.csv', self.citations.given), ('received_citations.csv', self.citations.received),
+                   ('similar_documents.csv', self.citations.similar_documents),
+                   ('nonpatent_citations.csv', self.citations.non_patent)]
+        return [dirpath + name for name, citations in written if len(citations.keys()) != 1]
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+
+from downloader import CHUNK_SIZE
+from storage import file_hash, link_or_copy
+
+
+class AssetStore:
+    """
+    Content-addressed store for the downloaded PDF and figures
+
+    Every file is stored once under ASSETS/objects/<sha256[:2]>/<sha256>
+    and hard-linked to its usual place (PDF/, FIGURES/), so duplicates only take space once
+    A manifest (ASSETS/manifest.jsonl) records for every url its size, hash and ETag:
+        - complete assets are never downloaded again
+        - partial downloads are resumed with an HTTP Range request
+    The manifest is an append-only file of json lines, the last line of a url wins
+    """
+
+    def __init__(self, path, logger=None):
+        """
+        :param path: output path chosen by the user, the store is created in path/ASSETS/
+        :param logger: Logger object
+        """
+        self.root = os.path.join(path, 'ASSETS')
+        self.objects = os.path.join(self.root, 'objects')
+        self.partial = os.path.join(self.root, 'partial')
+        self.manifest_path = os.path.join(self.root, 'manifest.jsonl')
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.manifest = {}  # {url: {'size': int, 'sha256': str, 'etag': str, 'complete': bool}}
+        self.url_locks = {}  # {url: Lock}, a url is downloaded by a single thread at a time
+
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.partial, exist_ok=True)
+        self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return
+
+        with open(self.manifest_path, encoding='utf-8') as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # last line of a crashed run
+                self.manifest[entry.pop('url')] = entry
+
+    def _record(self, url, **entry):
+        """Updates the manifest entry of a url and appends it to the manifest file"""
+        with self.lock:
+            self.manifest[url] = entry
+            with open(self.manifest_path, 'at', encoding='utf-8') as manifest:
+                manifest.write(json.dumps(dict(entry, url=url)) + '\n')
+
+    def object_path(self, sha256):
+        """Returns the path of the stored file having this hash"""
+        return os.path.join(self.objects, sha256[:2], sha256)
+
+    def _partial_path(self, url):
+        return os.path.join(self.partial, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.part')
+
+    def is_complete(self, url):
+        """Returns True if the asset of this url has already been fully downloaded"""
+        entry = self.manifest.get(url)
+        if not entry or not entry.get('complete'):
+            return False
+
+        blob = self.object_path(entry.get('sha256'))
+        return os.path.isfile(blob) and os.path.getsize(blob) == entry.get('size')
+
+    def fetch(self, http, url, file_path):
+        """
+        Puts the asset of a url at file_path, downloading only what is missing
+        :param http: urllib3.PoolManager
+        :param url: link to the asset
+        :param file_path: where the asset should appear
+        :return: -number of bytes downloaded (0 if the asset was already complete)
+                 -None if the server did not answer with the asset
+        """
+        with self.lock:
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+
+        with url_lock:
+            return self._fetch(http, url, file_path)
+
+    def _fetch(self, http, url, file_path):
+        if self.is_complete(url):
+            link_or_copy(self.object_path(self.manifest[url].get('sha256')), file_path)
+            return 0
+
+        part = self._partial_path(url)
+        entry = self.manifest.get(url) or {}
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        headers = {}
+
+        # resumes only when we can make sure the file did not change on the server
+        if offset and entry.get('etag'):
+            headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': entry.get('etag')}
+
+        resp = http.request('GET', url, preload_content=False, headers=headers)
+        downloaded = 0
+
+        try:
+            if resp.status == 206:
+                mode = 'ab'
+            elif resp.status == 200:
+                mode = 'wb'  # no resume: the server sent the whole file
+            else:
+                if self.logger is not None:
+                    self.logger.info('Asset not available (%s): %s', resp.status, url)
+                return None
+
+            etag = resp.headers.get('ETag')
+            self._record(url, etag=etag, size=None, sha256=None, complete=False)
+
+            with open(part, mode) as f:
+                for chunk in resp.stream(CHUNK_SIZE):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+        finally:
+            resp.release_conn()
+
+        sha256 = file_hash(part)
+        size = os.path.getsize(part)
+        blob = self.object_path(sha256)
+
+        with self.lock:
+            if os.path.isfile(blob):
+                os.remove(part)  # duplicate of an asset we already have
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(part, blob)
+
+        self._record(url, etag=etag, size=size, sha256=sha256, complete=True)
+        link_or_copy(blob, file_path)
+
+        return downloaded
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmarks of the scraper: no Chrome, no network
+    - parse throughput of BeautifulSoup and of every extractor, on a corpus of patent pages
+    - cost of save() and _write_csv_file() for 1k, 10k and 100k patents
+    - peak memory of every benchmark, measured in a second run under tracemalloc
+    - import time of the headless modules, against the budgets of IMPORT_BUDGETS
+
+The corpus is a folder of .html pages: pages saved from Google Patents, or synthetic pages
+written by fixtures.write_corpus (the default, with tiny, typical and huge pages)
+The results are written as json, so two versions can be compared:
+    python benchmark.py --output results.json
+It exits with an error when an import is over its budget or loads a heavy dependency
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+import fixtures
+
+# extractors of Scraper and Citations: (name, function(scraper, soup, patent id))
+EXTRACTORS = [
+    ('extract.pdf_link', lambda scraper, soup, pid: scraper._Scraper__get_pdf_link(soup, pid)),
+    ('extract.abstract', lambda scraper, soup, pid: scraper._Scraper__get_abstract(soup, True, pid)),
+    ('extract.description', lambda scraper, soup, pid: scraper._Scraper__get_description(soup, True, pid)),
+    ('extract.claims', lambda scraper, soup, pid: scraper._Scraper__get_claims(soup, True, pid)),
+    ('extract.type', lambda scraper, soup, pid: scraper._Scraper__get_type(soup)),
+    ('extract.status', lambda scraper, soup, pid: scraper._Scraper__get_status(soup, pid)),
+    ('extract.classifications', lambda scraper, soup, pid: scraper._Scraper__get_classifications(soup, pid)),
+    ('extract.legal_events', lambda scraper, soup, pid: scraper._Scraper__get_legal_events(soup, pid)),
+    ('extract.inventor', lambda scraper, soup, pid: scraper._Scraper__get_inventor(soup, pid)),
+    ('extract.assignee', lambda scraper, soup, pid: scraper._Scraper__get_assignee(soup, pid)),
+    ('extract.given_citations', lambda scraper, soup, pid: _citations(scraper, pid).get_given_citations(soup, True)),
+    ('extract.received_citations',
+     lambda scraper, soup, pid: _citations(scraper, pid).get_received_citations(soup, True)),
+    ('extract.nonpatent_citations', lambda scraper, soup, pid: _citations(scraper, pid).get_nonpatent_citations(soup)),
+    ('extract.similar_documents', lambda scraper, soup, pid: _citations(scraper, pid).get_similar_documents(soup)),
+]
+
+BENCHMARK_OPTIONS = {'download_pdf': False, 'download_figures': False, 'background_writer': False,
+                     'separate_files': True, 'language': True, 'csv_delimiter': ',', 'log_level': 'WARNING',
+                     'concatenate': {'TITLE': True, 'ABSTRACT': True, 'DESCRIPTION': True, 'CLAIMS': True}}
+
+
+# seconds allowed to import the modules of the headless path, from a fresh interpreter
+IMPORT_BUDGETS = {'cli': 0.03, 'engine': 0.1}
+
+# dependencies loaded only by the stage needing them, never by importing the headless modules
+HEAVY_MODULES = ('pandas', 'bs4', 'selenium', 'urllib3', 'certifi', 'PyQt5')
+
+
+def _citations(scraper, patent_id):
+    from Scraper import Citations
+    return Citations(patent_id, scraper.logger)
+
+
+def _measure(function, repeat, memory):
+    """
+    Runs a function 'repeat' times and returns its best time,
+    then runs it once more under tracemalloc for its peak memory, so tracing does not slow the timed runs
+    :return: (best seconds, peak bytes or None)
+    """
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        function()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return best, peak
+
+
+def _new_scraper(directory):
+    from engine import ProgressListener
+    from Scraper import Scraper
+    return Scraper(None, directory, ProgressListener(lambda text: None), dict(BENCHMARK_OPTIONS))
+
+
+def bench_extractors(pages, repeat=3, memory=True):
+    """
+    Measures the parsing and every extractor on every profile of page (tiny, typical, huge, recorded)
+    :param pages: list of (manifest entry, html), see fixtures.load_corpus
+    :return: list of results
+    """
+    from bs4 import BeautifulSoup
+
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    scraper = _new_scraper(directory)
+    results = []
+
+    try:
+        profiles = {}
+        for entry, html in pages:
+            profiles.setdefault(entry['profile'], []).append((entry['id'], html))
+
+        for profile, profile_pages in sorted(profiles.items()):
+            nb_bytes = sum(len(html.encode('utf-8')) for patent_id, html in profile_pages)
+
+            def parse():
+                return [(patent_id, BeautifulSoup(html, 'html.parser')) for patent_id, html in profile_pages]
+
+            seconds, peak = _measure(parse, repeat, memory)
+            results.append(_result('parse', profile, len(profile_pages), nb_bytes, seconds, peak))
+            soups = parse()
+
+            for name, extractor in EXTRACTORS:
+                def extract():
+                    for patent_id, soup in soups:
+                        extractor(scraper, soup, patent_id)
+
+                seconds, peak = _measure(extract, repeat, memory)
+                results.append(_result(name, profile, len(profile_pages), nb_bytes, seconds, peak))
+    finally:
+        scraper.run_log.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return results
+
+
+def _import_time(module):
+    """
+    Imports a module in a new interpreter, with -X importtime
+    :return: (seconds, heavy modules it loaded)
+    """
+    code = 'import sys, {}; print(",".join(m for m in {!r} if m in sys.modules))'.format(module, HEAVY_MODULES)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # lines of -X importtime: 'import time: self [us] | cumulative | name'
+    microseconds = 0
+    for line in process.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            microseconds = int(fields[1])
+
+    return microseconds / 1e6, [name for name in process.stdout.strip().split(',') if name]
+
+
+def bench_imports(budgets=None, repeat=5):
+    """
+    Measures the import time of the headless modules, so short runs and worker processes start quickly
+    The best of 'repeat' imports is compared with the budget of the module
+    :param budgets: dictionary {module: seconds}, IMPORT_BUDGETS by default
+    :return: list of results
+    """
+    results = []
+
+    for module, budget in sorted((budgets or IMPORT_BUDGETS).items()):
+        measures = [_import_time(module) for i in range(repeat)]
+        seconds = min(seconds for seconds, heavy in measures)
+        heavy = sorted(set(name for seconds, heavy in measures for name in heavy))
+
+        result = _result('import.' + module, 'cold', 1, None, seconds, None)
+        result.update({'budget_seconds': budget, 'heavy_modules': heavy,
+                       'within_budget': seconds <= budget and not heavy})
+        results.append(result)
+
+    return results
+
+
+def _synthetic_patents(count, logger):
+    """Returns 'count' Patent objects with texts and citations of a typical size, without parsing any page"""
+    from Scraper import Patent
+
+    patents = []
+    for index in range(count):
+        patent_id = fixtures.patent_id(index)
+        text = 'Text of the patent {}. '.format(patent_id) * 20
+        patent = Patent({'id': patent_id, 'result link': fixtures.patent_link(patent_id), 'title': 'Title',
+                         'assignee': 'Assignee', 'inventor/author': 'Inventor', 'priority date': '2010-01-01',
+                         'publication date': '2012-01-01', 'filing/creation date': '2010-06-01',
+                         'grant date': '2013-01-01', 'type': 'Patent', 'status': 'Active',
+                         'abstract': text, 'ABSTRACT': 'Y', 'description': text * 10, 'DESCRIPTION': 'Y',
+                         'claims': text * 3, 'CLAIMS': 'Y', 'classifications': 'H01L21/00', 'legal_events': ''},
+                        logger)
+        cited = [fixtures.patent_id(index + i + 1) for i in range(5)]
+        patent.citations.given[patent_id] = {'ids': cited, 'priority_dates': ['2000-01-01'] * 5,
+                                             'publication_dates': ['2001-01-01'] * 5,
+                                             'assignees': ['Assignee'] * 5, 'titles': ['Title'] * 5}
+        patent.nb_given_citations = 5
+        patents.append(patent)
+
+    return patents
+
+
+def bench_save(sizes, memory=True):
+    """
+    Measures save() (text files, citations, journal and dataFrame.csv) and _write_csv_file() alone
+    Every run starts from an empty output folder
+    :param sizes: list of numbers of patents
+    :return: list of results
+    """
+    results = []
+
+    for size in sizes:
+        for name in ('write.dataframe', 'save'):
+            seconds, peak = _run_save(name, size, False), None
+            if memory:
+                peak = _run_save(name, size, True)
+            results.append(_result(name, str(size), size, None, seconds, peak))
+
+    return results
+
+
+def _run_save(name, size, traced):
+    """Saves 'size' patents into a new folder, returns the seconds taken or the peak memory if traced"""
+    directory = tempfile.mkdtemp(prefix='benchmark_')
+    scraper = _new_scraper(directory)
+    try:
+        scraper.patent_list = _synthetic_patents(size, scraper.logger)
+        function = scraper.save if name == 'save' else scraper._write_csv_file
+
+        if traced:
+            tracemalloc.start()
+            try:
+                function()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        start = perf_counter()
+        function()
+        return perf_counter() - start
+    finally:
+        scraper.run_log.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _result(benchmark, profile, items, nb_bytes, seconds, peak):
+    result = {'benchmark': benchmark,
+              'profile': profile,
+              'items': items,
+              'seconds': round(seconds, 6),
+              'items_per_second': round(items / seconds, 3) if seconds else None,
+              'peak_memory_bytes': peak}
+    if nb_bytes is not None:
+        result['mb_per_second'] = round(nb_bytes / 1e6 / seconds, 3) if seconds else None
+
+    return result
+
+
+def environment():
+    """Describes the machine and the version benchmarked, so results can be compared"""
+    description = {'time': datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'processor': platform.processor()}
+
+    for module in ('bs4', 'pandas'):
+        try:
+            description[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            description[module] = None
+
+    try:
+        description['commit'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                                        cwd=os.path.dirname(os.path.abspath(__file__))
+                                                        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        description['commit'] = None
+
+    return description
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the patent scraper')
+    parser.add_argument('--corpus', help='folder of .html patent pages, synthetic pages by default')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='numbers of patents saved by the save benchmarks, separated by commas')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every extractor benchmark, the best is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skips the peak memory measures')
+    parser.add_argument('--skip-save', action='store_true', help='skips the save benchmarks')
+    parser.add_argument('--imports-only', action='store_true', help='only checks the import time budgets')
+    parser.add_argument('--output', default='benchmark_results.json', help='json file of the results')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    memory = not args.no_memory
+
+    results = bench_imports()
+    if not args.imports_only:
+        corpus = args.corpus
+        if corpus is None:
+            corpus = tempfile.mkdtemp(prefix='corpus_')
+            fixtures.write_corpus(corpus)
+
+        results += bench_extractors(fixtures.load_corpus(corpus), args.repeat, memory)
+        if not args.skip_save:
+            results += bench_save([int(size) for size in args.sizes.split(',') if size.strip()], memory)
+
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump({'environment': environment(), 'corpus': args.corpus or 'synthetic', 'results': results},
+                  output, indent=1)
+
+    print('{:<30}{:>10}{:>8}{:>12}{:>14}{:>12}'.format('benchmark', 'profile', 'items', 'seconds', 'items/s',
+                                                       'peak MB'))
+    for result in results:
+        peak = result['peak_memory_bytes']
+        print('{:<30}{:>10}{:>8}{:>12.4f}{:>14}{:>12}'.format(
+            result['benchmark'], result['profile'], result['items'], result['seconds'],
+            result['items_per_second'], '-' if peak is None else round(peak / 1e6, 1)))
+    print('Results written to ' + args.output)
+
+    over_budget = [result for result in results if result.get('within_budget') is False]
+    for result in over_budget:
+        print('{} took {:.3f}s for a budget of {}s{}'.format(
+            result['benchmark'], result['seconds'], result['budget_seconds'],
+            ', loading ' + ', '.join(result['heavy_modules']) if result['heavy_modules'] else ''))
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
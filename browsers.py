@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import queue
+import threading
+from time import perf_counter
+
+WARM_URL = 'about:blank'  # first page loaded by a new session, starts its renderer process
+MAX_PAGES = 100  # pages rendered by a session before it is replaced, Chrome grows with every page
+
+
+def chrome_session():
+    """
+    Launches a headless Chrome controlled by chromedriver, which has to be in PATH
+    :return: selenium WebDriver
+    """
+    import selenium.webdriver as webdriver
+
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.set_headless(headless=True)
+
+    return webdriver.Chrome(chrome_options=chrome_options)
+
+
+class BrowserPool:
+    """
+    Browser sessions shared by the scraping threads, so a page does not pay for the start of Chrome
+    start launches the sessions in the background, while the input file is still being read:
+    the first pages are rendered as soon as the scraping starts
+    A thread takes a ready session with acquire and gives it back with release,
+    a session is replaced after max_pages pages or once broken, keeping 'size' sessions ready
+
+    Without start, the sessions are launched on demand by acquire, then reused the same way
+    """
+
+    def __init__(self, size, factory=chrome_session, max_pages=MAX_PAGES, warm_url=WARM_URL, logger=None):
+        """
+        :param size: number of sessions, the number of scraping threads
+        :param factory: function returning a new session
+        :param max_pages: pages rendered by a session before it is replaced, 0 for no limit
+        :param warm_url: page loaded by every new session before it is ready, None to skip it
+        :param logger: logger of the launch errors
+        """
+        self.size = max(1, size)
+        self.factory = factory
+        self.max_pages = max_pages
+        self.warm_url = warm_url
+        self.logger = logger or logging.getLogger(__name__)
+        self.metrics = None  # Metrics object timing the launches, set by the Scraper
+        self.ready = queue.Queue()  # sessions waiting for a page, None when a launch failed
+        self.pages = {}  # {id of a session: pages rendered}
+        self.lock = threading.Lock()
+        self.nb_sessions = 0  # sessions ready, in use or being launched
+        self.nb_launched = 0
+        self.closed = False
+
+    def start(self):
+        """Launches the sessions in the background, returns the pool"""
+        for i in range(self.size):
+            self._launch_later()
+
+        return self
+
+    def _reserve(self):
+        """Counts a new session if the pool is not full, returns False otherwise"""
+        with self.lock:
+            if self.closed or self.nb_sessions >= self.size:
+                return False
+            self.nb_sessions += 1
+            return True
+
+    def _launch_later(self):
+        if self._reserve():
+            threading.Thread(target=self._warm, name='browser-launch', daemon=True).start()
+
+    def _warm(self):
+        """Launches a session on its own thread and makes it ready"""
+        try:
+            session = self._launch()
+        except Exception:
+            self.logger.warning('Could not launch a browser in the background', exc_info=True)
+            self.ready.put(None)  # a waiting thread launches one itself, and gets the error if it fails again
+            return
+
+        with self.lock:
+            closed = self.closed
+        if closed:
+            self._quit(session)
+        else:
+            self.ready.put(session)
+
+    def _launch(self):
+        """Launches and warms a session, the pool's count must already include it"""
+        start = perf_counter()
+        try:
+            session = self.factory()
+            if self.warm_url:
+                session.get(self.warm_url)
+        except BaseException:
+            with self.lock:
+                self.nb_sessions -= 1
+            raise
+
+        if self.metrics is not None:
+            self.metrics.observe('browser.launch', perf_counter() - start)
+        with self.lock:
+            self.pages[id(session)] = 0
+            self.nb_launched += 1
+        self.logger.debug('Browser launched in %.2f seconds', perf_counter() - start)
+
+        return session
+
+    def acquire(self):
+        """
+        Returns a ready session, launching one in this thread if none is ready nor being launched
+        :exception: the error of the launch, if the browser cannot be started
+        """
+        while True:
+            if self.closed:
+                raise RuntimeError('The browsers have been closed')
+            try:
+                session = self.ready.get_nowait()
+            except queue.Empty:
+                if self._reserve():
+                    return self._launch()
+                session = self.ready.get()
+
+            if session is not None:
+                return session
+            if self._reserve():  # a background launch failed, this thread tries again
+                return self._launch()
+
+    def release(self, session, broken=False):
+        """
+        Gives a session back to the pool
+        :param broken: True if the session failed, it is replaced by a new one
+        """
+        with self.lock:
+            self.pages[id(session)] = self.pages.get(id(session), 0) + 1
+            worn = self.max_pages and self.pages[id(session)] >= self.max_pages
+            closed = self.closed
+
+        if broken or worn or closed:
+            self._quit(session)
+            self._launch_later()
+        else:
+            self.ready.put(session)
+
+    def _quit(self, session):
+        with self.lock:
+            self.pages.pop(id(session), None)
+            self.nb_sessions -= 1
+        try:
+            session.quit()
+        except Exception:
+            self.logger.debug('Error while closing a browser', exc_info=True)
+
+    def close(self):
+        """Quits the ready sessions, the ones in use are quit when released"""
+        with self.lock:
+            self.closed = True
+
+        while True:
+            try:
+                session = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if session is not None:
+                self._quit(session)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import os
+import re
+
+from storage import write_atomic
+
+PATENT_URL = 'https://patents.google.com/patent/{}/en'
+
+# https://patents.google.com/patent/US7654321B2/en, patent/US-7654321-B2, ...
+_PATENT_PATH = re.compile(r'patents\.google\.[a-z.]+/patent/([^/?#]+)', re.IGNORECASE)
+
+
+def canonical_id(patent_id):
+    """Returns the id used everywhere in the outputs: without dashes nor spaces, in upper case"""
+    return str(patent_id).replace('-', '').replace(' ', '').strip().upper()
+
+
+def canonical_link(link, patent_id=None):
+    """
+    Returns the link of a patent in a single format: https://patents.google.com/patent/<ID>/en
+    whatever the scheme, language, trailing slash or parameters of the original link
+    Links which are not Google Patents links (a local server, see patent_server.py) are returned stripped
+    :param link: link to the patent
+    :param patent_id: id of the patent, used if the link is empty
+    """
+    match = _PATENT_PATH.search(str(link))
+
+    if match:
+        return PATENT_URL.format(canonical_id(match.group(1)))
+    link = str(link).strip()
+    if not link and patent_id:
+        return PATENT_URL.format(canonical_id(patent_id))
+    return link
+
+
+def family_key(values):
+    """
+    Returns a key shared by the members of a family, None if it cannot be guessed:
+    same priority date and same title
+    """
+    priority_date = str(values.get('priority date', '')).strip()
+    title = ' '.join(str(values.get('title', '')).lower().split())
+
+    if not priority_date or not title:
+        return None
+    return priority_date, title
+
+
+class Deduplicator:
+    """
+    Removes the duplicated patents of the input before they are scheduled
+    Links and ids are canonicalized first, so 'US-123-B2' and
+    'http://patents.google.com/patent/US123B2/' are found to be the same patent
+    Optionally, the members of a family (same priority date and title) are collapsed into the first one
+    Every duplicate is reported, see write_report
+    """
+
+    REPORT_NAME = 'duplicates.csv'
+
+    def __init__(self, collapse_family=False):
+        self.collapse_family = collapse_family
+        self.seen_ids = {}  # {canonical id: link kept}
+        self.seen_families = {}  # {family key: link kept}
+        self.duplicates = []  # [(link, id, link kept, reason)]
+
+    def check(self, link, values):
+        """
+        Canonicalizes a line of the input and tells if it has to be scraped
+        :param link: 'result link' of the line
+        :param values: dictionary {column: value} of the line, its 'id' and 'result link' are canonicalized
+        :return: the canonical link, None if the patent is a duplicate
+        """
+        patent_id = canonical_id(values.get('id', '')) if values.get('id') else ''
+        link = canonical_link(link, patent_id)
+        if not patent_id:
+            patent_id = canonical_id(link.rstrip('/').split('/')[-2]) if '/patent/' in link else link
+
+        values['id'] = patent_id
+        values['result link'] = link
+
+        if patent_id in self.seen_ids:
+            self.duplicates.append((link, patent_id, self.seen_ids[patent_id], 'same id'))
+            return None
+
+        key = family_key(values) if self.collapse_family else None
+        if key is not None and key in self.seen_families:
+            self.duplicates.append((link, patent_id, self.seen_families[key], 'same family'))
+            return None
+
+        self.seen_ids[patent_id] = link
+        if key is not None:
+            self.seen_families[key] = link
+        return link
+
+    def deduplicate(self, data_frame):
+        """
+        Returns a copy of a DataFrame from ReadFile without its duplicated patents
+        """
+        rows = [values for values in data_frame.to_dict('records') if self.check(values.get('result link'), values)]
+        return data_frame.__class__(rows, columns=data_frame.columns)
+
+    def write_report(self, path):
+        """
+        Writes the duplicates found into path/CSV/duplicates.csv
+        :return: number of duplicates
+        """
+        if self.duplicates:
+            content = io.StringIO(newline='')
+            report = csv.writer(content)
+            report.writerow(['link', 'id', 'duplicate of', 'reason'])
+            report.writerows(self.duplicates)
+            write_atomic(os.path.join(path, 'CSV', self.REPORT_NAME), content.getvalue())
+
+        return len(self.duplicates)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import sys
+
+ITEMS = ('TITLE', 'ABSTRACT', 'DESCRIPTION', 'CLAIMS')
+SCRAPED = ('citations', 'cited', 'similar', 'legal', 'classifications', 'nonpatent')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Scrapes the patents of a Google Patents csv file, without interface')
+    parser.add_argument('csv_file', nargs='+',
+                        help='csv file downloaded from Google Patents, several files or patterns with --stream')
+    parser.add_argument('save_directory', help='output folder')
+    parser.add_argument('-t', '--threads', default='auto',
+                        help="number of pages scraped at the same time, 'auto' by default")
+    parser.add_argument('-d', '--delimiter', default=',', help="delimiter of the output csv files, ',' by default")
+    parser.add_argument('--original-language', action='store_true',
+                        help='keeps the original text instead of the English translation')
+    parser.add_argument('--single-file', action='store_true',
+                        help='writes every text of a patent in a single file instead of one folder per item')
+    parser.add_argument('--concatenate', default=','.join(ITEMS),
+                        help='items concatenated into CONCATENATED_ITEMS, among {}'.format(','.join(ITEMS)))
+    parser.add_argument('--resume', action='store_true',
+                        help='scrapes only the links missing from the journal of a previous run in the same folder')
+    parser.add_argument('--refresh', action='store_true',
+                        help='scrapes again only the patents of a previous run in the same folder which may have changed')
+    parser.add_argument('--max-age', type=int, default=7,
+                        help='with --refresh, number of days after which a patent is scraped again, 7 by default')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='scrapes only the links which failed in a previous run in the same folder')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='number of times a failing link is scraped before giving up, 3 by default')
+    parser.add_argument('--index', action='store_true',
+                        help='indexes the text of the patents into search.sqlite, for search.py')
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help='writes the clusters of patents with almost the same abstract and claims '
+                             'into CSV/near_duplicates.csv')
+    parser.add_argument('--near-duplicate-threshold', type=float, default=0.8,
+                        help='similarity from which two patents are near-duplicates, 0.8 by default')
+    parser.add_argument('--no-pdf', action='store_true', help='does not download the PDF files')
+    parser.add_argument('--no-figures', action='store_true', help='does not download the figures')
+
+    for item in SCRAPED:
+        parser.add_argument('--no-' + item, action='store_true', help='does not scrape the {}'.format(item))
+
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help='scrapes the duplicated patents of the input instead of skipping them')
+    parser.add_argument('--collapse-family', action='store_true',
+                        help='scrapes a single patent per family (same priority date and title)')
+    parser.add_argument('--stream', action='store_true',
+                        help='reads the csv files by chunks, for exports too big to be loaded at once')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='number of processes, each scraping a shard of the links with its own threads')
+    parser.add_argument('--browser-sessions', type=int,
+                        help='number of Chrome sessions kept ready, one per thread by default')
+    parser.add_argument('--pages-per-browser', type=int, default=100,
+                        help='pages rendered by a Chrome session before it is replaced, 100 by default')
+    parser.add_argument('--no-prewarm', action='store_true',
+                        help='launches Chrome with the first pages instead of while the csv file is read')
+
+    monitoring = parser.add_argument_group('monitoring', 'log and Prometheus metrics of the run')
+    monitoring.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                            help='minimum level written into the log, INFO by default, DEBUG for every patent')
+    monitoring.add_argument('--log-format', default='json', choices=('json', 'text'),
+                            help='json lines (default) or plain text')
+    monitoring.add_argument('--metrics-port', type=int,
+                            help='serves the metrics on http://127.0.0.1:<port>/metrics while scraping')
+    monitoring.add_argument('--metrics-textfile',
+                            help='.prom file for the textfile collector of node_exporter, rewritten every 15 seconds')
+
+    profiling = parser.add_argument_group('profiling', 'profiles written into the log folder')
+    profiling.add_argument('--profile', metavar='STAGES',
+                           help="stages profiled with cProfile, separated by commas: render, parse, "
+                                "extract. (every extractor), write.txt... or 'all'")
+    profiling.add_argument('--profile-sample', type=float, default=0.0, metavar='RATE',
+                           help='part of the patents profiled as a whole, 0.01 for one patent in a hundred')
+    profiling.add_argument('--profile-memory', action='store_true',
+                           help='traces the memory and reports the top allocations at every checkpoint')
+
+    crawl = parser.add_argument_group('crawl mode', 'follows the citations of the patents of the csv file')
+    crawl.add_argument('--crawl-depth', type=int, default=0,
+                       help='number of citation levels followed, 0 (default) scrapes only the csv file')
+    crawl.add_argument('--crawl-budget', type=int, help='maximum number of patents scraped while crawling')
+    crawl.add_argument('--crawl-direction', choices=('given', 'received', 'both'), default='both',
+                       help='follows the patents cited (given), citing (received) or both')
+
+    distributed = parser.add_argument_group('distributed mode', 'several workers sharing a queue of links')
+    distributed.add_argument('--queue', metavar='DB', help='SQLite file of the queue, on a volume shared by the workers')
+    distributed.add_argument('--worker-id', help='id of this worker, hostname-pid by default')
+    distributed.add_argument('--batch-size', type=int, default=10, help='number of links leased at once')
+    distributed.add_argument('--lease', type=int, default=300,
+                             help='seconds after which the links of a silent worker are given to another one')
+    distributed.add_argument('--merge', action='store_true',
+                             help='merges the results of the workers into the output folder, without scraping')
+
+    return parser.parse_args(argv)
+
+
+def get_options(args):
+    """Returns the dictionary of scraping options from the command line arguments"""
+    concatenated = [item.strip().upper() for item in args.concatenate.split(',') if item.strip()]
+
+    options = {
+        'save_directory': args.save_directory,
+        'separate_files': not args.single_file,
+        'language': not args.original_language,
+        'concatenate': {item: item in concatenated for item in ITEMS},
+        'download_pdf': not args.no_pdf,
+        'download_figures': not args.no_figures,
+        'csv_delimiter': args.delimiter,
+        'resume': args.resume,
+        'refresh': args.refresh,
+        'refresh_max_age_days': args.max_age,
+        'deduplicate': not args.keep_duplicates,
+        'collapse_family': args.collapse_family,
+        'max_attempts': args.max_attempts,
+        'search_index': args.index,
+        'near_duplicates': args.near_duplicates,
+        'near_duplicate_threshold': args.near_duplicate_threshold,
+        'browser_sessions': args.browser_sessions,
+        'browser_max_pages': args.pages_per_browser,
+        'prewarm_browsers': not args.no_prewarm,
+        'metrics_port': args.metrics_port,
+        'metrics_textfile': args.metrics_textfile,
+        'log_level': args.log_level,
+        'log_format': args.log_format,
+        'profile_stages': args.profile,
+        'profile_sample_rate': args.profile_sample,
+        'profile_memory': args.profile_memory
+    }
+    for item in ITEMS:
+        options['scrape_' + item.lower()] = item in concatenated
+    for item in SCRAPED:
+        options['scrape_' + item] = not getattr(args, 'no_' + item)
+
+    return options
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if len(args.csv_file) > 1 and not args.stream:
+        print('Several csv files can only be scraped with --stream')
+        return 2
+    csv_file = args.csv_file[0]
+    import engine  # imported here so '--help' works even without the scraping dependencies
+
+    nb_threads = engine.auto_nb_threads() if args.threads == 'auto' else int(args.threads)
+
+    if args.retry_failed:
+        engine.run_failed(csv_file, args.save_directory, get_options(args), nb_threads)
+    elif args.stream:
+        engine.run_streaming(args.csv_file, args.save_directory, get_options(args), nb_threads)
+    elif args.queue and args.merge:
+        nb_merged = engine.merge_queue_results(csv_file, args.save_directory, args.queue, args.delimiter,
+                                               get_options(args))
+        print('{} patents merged'.format(nb_merged))
+    elif args.queue:
+        engine.run_queue_worker(csv_file, args.save_directory, args.queue, get_options(args), nb_threads,
+                                args.worker_id, args.batch_size, args.lease)
+    elif args.crawl_depth > 0:
+        engine.run_crawl(csv_file, args.save_directory, args.crawl_depth, args.crawl_budget,
+                         args.crawl_direction, get_options(args), nb_threads)
+    elif args.processes > 1:
+        nb_merged = engine.run_sharded(csv_file, args.save_directory, args.processes, get_options(args),
+                                       nb_threads)
+        print('{} patents merged'.format(nb_merged))
+    else:
+        engine.run(csv_file, args.save_directory, get_options(args), nb_threads)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
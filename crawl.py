@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import math
+
+from canonical import PATENT_URL, canonical_id
+
+# values of the input csv file needed by a Patent, for the patents found while crawling
+CRAWLED_COLUMNS = ('id', 'title', 'assignee', 'inventor/author', 'priority date', 'filing/creation date',
+                   'publication date', 'grant date', 'result link', 'representative figure link')
+
+
+class BloomFilter:
+    """
+    Compact set of strings: about 1.8 MB for a million ids with 0.1% of false positives
+    An id can be wrongly seen as already added (false positive), never the opposite
+    Once more ids than 'capacity' are added, the false positives become more frequent
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        """
+        :param capacity: number of strings expected
+        :param error_rate: probability of false positives when 'capacity' strings have been added
+        """
+        self.nb_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.nb_hashes = max(1, int(round(self.nb_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.nb_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # double hashing: two 64 bits hashes give every position
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        for i in range(self.nb_hashes):
+            yield (first + i * second) % self.nb_bits
+
+    def add(self, value):
+        """
+        Adds a string
+        :return: True if it was not in the filter yet
+        """
+        added = False
+
+        for position in self._positions(value):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def __len__(self):
+        return self.count
+
+
+class Frontier:
+    """
+    Breadth-first frontier of a crawl along the citations
+    Every patent id is visited once, the visited ids are kept in a BloomFilter
+    so millions of patents only take a few megabytes
+    """
+
+    DIRECTIONS = ('given', 'received', 'both')
+
+    def __init__(self, direction='both', max_nodes=None, capacity=None):
+        """
+        :param direction: 'given' to follow the patents cited, 'received' for the citing ones, 'both' for both
+        :param max_nodes: maximum number of patents of the crawl, None for no limit
+        :param capacity: expected number of patents, sets the size of the BloomFilter
+        """
+        if direction not in self.DIRECTIONS:
+            raise ValueError('direction must be one of ' + ', '.join(self.DIRECTIONS))
+
+        self.direction = direction
+        self.max_nodes = max_nodes
+        self.visited = BloomFilter(capacity or max_nodes or 1000000)
+
+    def is_full(self):
+        """Returns True when the node budget is reached"""
+        return self.max_nodes is not None and len(self.visited) >= self.max_nodes
+
+    def visit(self, patent_id):
+        """
+        Marks a patent as visited
+        :return: True if the patent has to be scraped, False if already visited or if the budget is reached
+        """
+        if self.is_full():
+            return False
+        return self.visited.add(canonical_id(patent_id))
+
+    def expand(self, patent):
+        """
+        Returns the patents cited by and/or citing a scraped patent which have not been visited yet
+        :param patent: Patent object, scraped with its citations
+        :return: list of (url, values) where values are the csv values known from the citation
+        """
+        tables = []
+        if self.direction in ('given', 'both'):
+            tables.append(patent.citations.given)
+        if self.direction in ('received', 'both'):
+            tables.append(patent.citations.received)
+
+        found = []
+        for table in tables:
+            for source, value in table.items():
+                if source == 'SOURCE':
+                    continue
+
+                for index, cited in enumerate(value.get('ids', [])):
+                    patent_id = canonical_id(cited)
+                    if not self.visit(patent_id):
+                        continue
+
+                    url = PATENT_URL.format(patent_id)
+                    values = dict.fromkeys(CRAWLED_COLUMNS, '')
+                    values.update({'id': patent_id,
+                                   'result link': url,
+                                   'title': _get(value, 'titles', index),
+                                   'assignee': _get(value, 'assignees', index),
+                                   'priority date': _get(value, 'priority_dates', index),
+                                   'publication date': _get(value, 'publication_dates', index)})
+                    found.append((url, values))
+
+        return found
+
+
+def _get(value, key, index):
+    items = value.get(key) or []
+    return items[index] if index < len(items) else ''
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+from datetime import datetime
+
+from storage import write_atomic
+
+
+class DeadLetterStore:
+    """
+    Links which could not be scraped, with the class and message of their last error
+    and their number of attempts
+    It is stored in path/failed.jsonl, an append-only file of json lines, the last line of a url wins:
+        {'url', 'kind', 'error_class', 'error', 'attempts', 'time'}, or {'url', 'resolved': True} once scraped
+    kind is 'page' for a patent page, 'pdf' or 'figure' for a download which failed every attempt
+    A run can be started again on its failed links only, see engine.run_failed
+    """
+
+    FILE_NAME = 'failed.jsonl'
+
+    def __init__(self, path, max_attempts=3, keep=False):
+        """
+        :param path: output path chosen by the user
+        :param max_attempts: number of times a link is scraped during a run before giving up
+        :param keep: True to keep the failed links of the previous run, False to start a new file
+        """
+        self.file_path = os.path.join(path, self.FILE_NAME)
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.entries = {}  # {url: entry}
+        self.run_attempts = {}  # {url: number of attempts during this run}
+
+        os.makedirs(path, exist_ok=True)
+
+        if keep:
+            self.entries = self.load(self.file_path)
+        else:
+            write_atomic(self.file_path, '')
+
+    @staticmethod
+    def load(file_path):
+        """
+        Reads a dead letter file
+        :return: dictionary {url: entry} of the links still failing, in the order they first failed
+        """
+        entries = {}
+
+        if not os.path.isfile(file_path):
+            return entries
+
+        with open(file_path, encoding='utf-8') as dead_letters:
+            for line in dead_letters:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line cut by a crash
+                if entry.get('resolved'):
+                    entries.pop(entry.get('url'), None)
+                else:
+                    entries[entry.get('url')] = entry
+
+        return entries
+
+    def _append(self, entry):
+        with open(self.file_path, 'at', encoding='utf-8') as dead_letters:
+            dead_letters.write(json.dumps(entry, default=str) + '\n')
+
+    def record(self, url, error, kind='page'):
+        """
+        Adds a failed attempt of a link
+        :param url: link which failed
+        :param error: exception raised while scraping it
+        :param kind: 'page', 'pdf' or 'figure', only the pages are scraped again by retry_failed
+        :return: number of attempts of the link during this run
+        """
+        with self.lock:
+            attempts = self.run_attempts.get(url, 0) + 1
+            self.run_attempts[url] = attempts
+            entry = {'url': url,
+                     'kind': kind,
+                     'error_class': type(error).__name__,
+                     'error': str(error),
+                     'attempts': self.entries.get(url, {}).get('attempts', 0) + 1,
+                     'time': datetime.now().isoformat()}
+            self.entries[url] = entry
+            self._append(entry)
+
+        return attempts
+
+    def resolve(self, url):
+        """Removes a link which has finally been scraped"""
+        with self.lock:
+            if self.entries.pop(url, None) is not None:
+                self._append({'url': url, 'resolved': True})
+
+    def retryable(self):
+        """Returns the pages which failed during this run and can still be tried again"""
+        with self.lock:
+            return [url for url, entry in self.entries.items()
+                    if entry.get('kind', 'page') == 'page' and 0 < self.run_attempts.get(url, 0) < self.max_attempts]
+
+    def urls(self):
+        """Returns every link still failing"""
+        with self.lock:
+            return list(self.entries)
+
+    def close(self):
+        """Rewrites the file with a single line per link still failing"""
+        with self.lock:
+            write_atomic(self.file_path, ''.join(json.dumps(entry, default=str) + '\n'
+                                                 for entry in self.entries.values()))
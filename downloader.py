@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import threading
+from multiprocessing.dummy import Pool as ThreadPool
+
+from storage import set_file_mode
+
+CHUNK_SIZE = 64 * 1024  # number of bytes written at once when streaming a download
+
+
+def create_pool(maxsize=10):
+    """
+    Creates the connection pool shared by every download thread
+    Connections are kept alive and reused, so each file does not cost a new TLS handshake
+    :param maxsize: number of connections kept per host, should match the number of download threads
+    :return: urllib3.PoolManager
+    """
+    import certifi
+    import urllib3
+
+    return urllib3.PoolManager(maxsize=maxsize, cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+
+
+def stream_to_file(http, url, file_path, chunk_size=CHUNK_SIZE, headers=None):
+    """
+    Downloads a file by chunks, so the whole body is never kept in memory
+    The data goes into a temporary file renamed into place once complete
+    :param http: urllib3.PoolManager, returned by create_pool
+    :param url: link to the file
+    :param file_path: destination of the file
+    :param chunk_size: number of bytes read at once
+    :param headers: dictionary of additional request headers
+    :return: -number of bytes written
+             -None if the server did not answer with a 200 status, nothing is written
+    """
+    resp = http.request('GET', url, preload_content=False, headers=headers)
+
+    try:
+        if resp.status != 200:
+            return None
+
+        directory = os.path.dirname(file_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.part')
+        size = 0
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in resp.stream(chunk_size):
+                    f.write(chunk)
+                    size += len(chunk)
+            set_file_mode(temp_path, file_path)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return size
+    finally:
+        resp.release_conn()
+
+
+class DownloadStage:
+    """
+    Runs downloads on its own ThreadPool while the scraping goes on
+    Downloads are submitted as soon as their link is known, the number of threads
+    is the concurrency budget of the downloads, independent from the scraping threads
+    """
+
+    def __init__(self, nb_threads, logger=None):
+        self.pool = ThreadPool(max(1, int(nb_threads)))
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.nb_submitted = 0
+        self.nb_done = 0
+
+    def submit(self, function, argument):
+        """
+        Schedules function(argument) on the download threads
+        :param function: download function, it should handle its own errors
+        :param argument: argument given to the function
+        """
+        with self.lock:
+            self.nb_submitted += 1
+        self.pool.apply_async(function, (argument,), callback=self._done, error_callback=self._failed)
+
+    def _done(self, result):
+        with self.lock:
+            self.nb_done += 1
+
+    def _failed(self, error):
+        if self.logger is not None:
+            self.logger.error('Download failed: %s', error)
+        self._done(None)
+
+    def pending(self):
+        """Returns the number of downloads not finished yet"""
+        with self.lock:
+            return self.nb_submitted - self.nb_done
+
+    def join(self):
+        """Waits for every submitted download, no download can be submitted afterwards"""
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        """Stops the downloads without waiting for them"""
+        self.pool.terminate()
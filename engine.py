@@ -0,0 +1,585 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+from multiprocessing import Process, cpu_count
+from multiprocessing.dummy import Pool as ThreadPool
+from time import sleep, time
+
+from browsers import MAX_PAGES, BrowserPool
+from canonical import Deduplicator, canonical_id
+from crawl import Frontier
+from deadletter import DeadLetterStore
+from merge import merge_outputs
+from reader import ReadFile, StreamReader
+from Scraper import Scraper
+from workqueue import WorkQueue, default_worker_id
+
+# options used when the caller does not give them, see Scraper.scrape for their meaning
+DEFAULT_OPTIONS = {
+    'scrape_abstract': True,
+    'scrape_title': True,
+    'scrape_description': True,
+    'scrape_claims': True,
+    'scrape_citations': True,
+    'scrape_cited': True,
+    'scrape_similar': True,
+    'scrape_legal': True,
+    'scrape_classifications': True,
+    'scrape_nonpatent': True,
+    'separate_files': True,
+    'language': True,
+    'concatenate': {'TITLE': True, 'ABSTRACT': True, 'DESCRIPTION': True, 'CLAIMS': True},
+    'download_pdf': True,
+    'download_figures': True,
+    'csv_delimiter': ',',
+    'background_writer': True,
+    'writer_fsync': 'batch',
+    'deduplicate': True,
+    'collapse_family': False,
+    'max_attempts': 3,
+    'prewarm_browsers': True
+}
+
+
+def load_input(csv_path, options=None):
+    """
+    Reads a csv file and removes its duplicated patents, unless the 'deduplicate' option is False
+    :return: (DataFrame, Deduplicator or None)
+    """
+    options = options or {}
+    data_frame = ReadFile(csv_path).data_frame
+
+    if not options.get('deduplicate', True):
+        return data_frame, None
+
+    deduplicator = Deduplicator(options.get('collapse_family', False))
+    return deduplicator.deduplicate(data_frame), deduplicator
+
+
+def start_browsers(nb_threads, options=None):
+    """
+    Starts launching a browser per thread in the background, to be called before reading the input file
+    so Chrome starts while the file is read, see BrowserPool
+    With the 'prewarm_browsers' option False, the browsers are only launched by the first pages
+    :return: BrowserPool
+    """
+    options = options or {}
+    browsers = BrowserPool(options.get('browser_sessions') or nb_threads,
+                           max_pages=options.get('browser_max_pages', MAX_PAGES), logger=Scraper.logger)
+    if options.get('prewarm_browsers', DEFAULT_OPTIONS['prewarm_browsers']):
+        browsers.start()
+
+    return browsers
+
+
+def load_while_launching(load, nb_threads, options=None):
+    """
+    Calls load(), reading the input, while the browsers start
+    :return: (result of load, BrowserPool)
+    """
+    browsers = start_browsers(nb_threads, options)
+    try:
+        return load(), browsers
+    except BaseException:
+        browsers.close()
+        raise
+
+
+def report_duplicates(deduplicator, save_directory):
+    """Writes the duplicates found in the input and logs their number"""
+    if deduplicator is not None and deduplicator.duplicates:
+        nb_duplicates = deduplicator.write_report(save_directory)
+        Scraper.logger.info('%d duplicated patents skipped, see CSV/%s', nb_duplicates, Deduplicator.REPORT_NAME)
+        print('{} duplicated patents skipped'.format(nb_duplicates))
+
+
+def auto_nb_threads():
+    """Returns 2x the number of cores, limited to 8, like the 'auto' option of the interface"""
+    nb_threads = cpu_count() * 2
+    return 8 if nb_threads > 8 else int(nb_threads)
+
+
+class ProgressListener:
+    """
+    Receives the progress of a scraping without any window
+    The Scraper only talks to this object, so the same engine runs with the interface or headless:
+        - give a callback, called with the status text each time the progress changes
+        - or subclass it and override on_progress
+    """
+
+    def __init__(self, callback=None):
+        """
+        :param callback: function(text), None to print the progress
+        """
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.nb_scraped = 1
+        self.nb_pdf = 1
+        self.nb_figures = 1
+        self.MAX_LEN = 0
+        self.pdf_list = []
+        self.figures_list = []
+
+    def add_increment(self, text):
+        """Called every time a patent, a PDF or a figure is done"""
+        with self.lock:
+            self.nb_scraped += 1
+        self.on_progress(text)
+
+    def set_status(self, text):
+        """Called when the scraping goes to a new step"""
+        self.on_progress(text)
+
+    def set_maximum(self, maximum, value=0):
+        """Called when a step with a new number of items starts"""
+        pass
+
+    def on_progress(self, text):
+        if self.callback is not None:
+            self.callback(text)
+        else:
+            print(text)
+
+
+class ScrapingJob:
+    """
+    A complete scraping: the patents of a csv file, then the files and downloads
+    Used by the interface as well as by the command line
+    """
+
+    def __init__(self, data_frame, save_directory, options=None, nb_threads=1, listener=None, browsers=None):
+        """
+        :param data_frame: DataFrame of the Google Patents csv file, see ReadFile
+        :param save_directory: output path
+        :param options: dictionary of options, the missing ones are taken from DEFAULT_OPTIONS
+        :param nb_threads: number of pages scraped at the same time
+        :param listener: ProgressListener, or any object with the same methods and attributes
+        :param browsers: BrowserPool started while the input was read, see start_browsers,
+                         None to launch the browsers with the first pages
+        """
+        self.options = dict(DEFAULT_OPTIONS)
+        self.options.update(options or {})
+        self.options.setdefault('download_threads', 1 if nb_threads == 1 else nb_threads * 10)
+        self.options.setdefault('download_connections', self.options.get('download_threads'))
+        if not self.options.get('browser_sessions'):
+            self.options['browser_sessions'] = nb_threads
+        self.nb_threads = nb_threads
+        self.listener = listener if listener is not None else ProgressListener()
+        self.pool = None
+        self.stopped = False
+
+        self.listener.nb_scraped = 1
+        self.listener.nb_pdf = 1
+        self.listener.nb_figures = 1
+        self.listener.pdf_list = []
+        self.listener.figures_list = []
+
+        # the duplicated patents are removed before anything is scheduled
+        deduplicator = None
+        if self.options.get('deduplicate'):
+            deduplicator = Deduplicator(self.options.get('collapse_family'))
+            data_frame = deduplicator.deduplicate(data_frame)
+
+        try:
+            self.scraper = Scraper(data_frame, save_directory, self.listener, self.options, browsers)
+        except BaseException:
+            if browsers is not None:
+                browsers.close()
+            raise
+        self.listener.MAX_LEN = len(self.scraper.links)
+        report_duplicates(deduplicator, save_directory)
+
+    def run(self):
+        """
+        Scrapes every link, saves the files and waits for the downloads
+        :return: number of seconds the job took
+        """
+        start_time = time()
+        scraper = self.scraper
+
+        self.listener.set_maximum(self.listener.MAX_LEN)
+        self.listener.set_status('Scraping... ({}/{})'.format(self.listener.nb_scraped, self.listener.MAX_LEN))
+        self.pool = ThreadPool(self.nb_threads)
+        try:
+            self.pool.map(scraper.scrape, scraper.links)
+            scraper.retry_failed(self.pool)  # the failed links are retried in parallel as well
+        finally:
+            self.pool.close()
+            self.pool.join()
+            scraper.close_browsers()
+
+        # the patents have already been written by the background writer while scraping
+        scraper.save()
+
+        if self.stopped:
+            scraper.wait_downloads()  # the downloads left are skipped
+            scraper.logger.info('STOPPED')
+            scraper.finish()
+            self.listener.set_status('Stopped.')
+            return round(time() - start_time)
+
+        # the downloads started while scraping, we only wait for the remaining ones
+        if scraper.downloads is not None:
+            total = len(self.listener.pdf_list) + len(self.listener.figures_list)
+            self.listener.set_maximum(total, total - scraper.downloads.pending())
+            self.listener.set_status('Downloading PDF and figures... ({}/{})'.format(
+                total - scraper.downloads.pending(), total))
+        scraper.wait_downloads()
+        scraper.logger.info('DONE')
+        scraper.finish()
+        self.listener.set_status('Done.')
+
+        return round(time() - start_time)
+
+    def stop(self):
+        """
+        Stops the scraping and the downloads, can be called from any thread
+        The pages being rendered are finished, the patents already scraped are saved
+        """
+        self.stopped = True
+        self.scraper.cancel()
+
+
+def run(csv_path, save_directory, options=None, nb_threads=None, callback=None):
+    """
+    Scrapes every patent of a Google Patents csv file, without any window
+    :param csv_path: path to the csv file downloaded from Google Patents
+    :param save_directory: output path
+    :param options: dictionary of options, the missing ones are taken from DEFAULT_OPTIONS
+    :param nb_threads: number of pages scraped at the same time, None for automatic
+    :param callback: function(text) called with the progress, None to print it
+    :return: the Scraper object, containing the list of Patent objects
+    """
+    nb_threads = nb_threads or auto_nb_threads()
+    data_frame, browsers = load_while_launching(lambda: ReadFile(csv_path).data_frame, nb_threads, options)
+    job = ScrapingJob(data_frame, save_directory, options, nb_threads, ProgressListener(callback), browsers)
+    done = job.run()
+    print("Process finished in {} seconds".format(done))
+
+    return job.scraper
+
+
+def run_failed(csv_path, save_directory, options=None, nb_threads=None, callback=None):
+    """
+    Scrapes again only the links which failed in a previous run, read from save_directory/failed.jsonl
+    The patents of the previous run are kept: dataFrame.csv is written again with the old and new patents
+    :param csv_path: path to the csv file of the previous run
+    :param save_directory: output path of the previous run
+    :return: the Scraper object, None if no link failed
+    """
+    entries = DeadLetterStore.load(os.path.join(save_directory, DeadLetterStore.FILE_NAME))
+    # the failed downloads are only reported
+    failed = [url for url, entry in entries.items() if entry.get('kind', 'page') == 'page']
+    if not failed:
+        print('No failed link to scrape again')
+        return None
+
+    retry_options = dict(options or {})
+    retry_options.update({'resume': True, 'refresh': False, 'retry_failed': True})
+    nb_threads = min(nb_threads or auto_nb_threads(), len(failed))
+
+    (data_frame, deduplicator), browsers = load_while_launching(lambda: load_input(csv_path, options), nb_threads,
+                                                                retry_options)
+    data_frame = data_frame[data_frame['result link'].isin(failed)].reset_index(drop=True)
+    job = ScrapingJob(data_frame, save_directory, retry_options, nb_threads, ProgressListener(callback), browsers)
+    done = job.run()
+    print("Process finished in {} seconds, {} links still failing".format(done, len(job.scraper.dead_letters.entries)))
+
+    return job.scraper
+
+
+def run_queue_worker(csv_path, save_directory, db_path, options=None, nb_threads=None, worker_id=None,
+                     batch_size=10, lease_seconds=300, callback=None):
+    """
+    Scrapes links leased from a shared WorkQueue until there is none left
+    Any number of workers, on any number of machines, can run with the same arguments:
+    each one writes into save_directory/workers/<worker_id>/, see merge_queue_results for the final result
+    :param csv_path: path to the csv file downloaded from Google Patents, the same for every worker
+    :param save_directory: output path, shared by the workers
+    :param db_path: path to the SQLite file of the queue, shared by the workers
+    :param options: dictionary of options, the missing ones are taken from DEFAULT_OPTIONS
+    :param nb_threads: number of pages scraped at the same time by this worker, None for automatic
+    :param worker_id: id of this worker, hostname-pid by default
+    :param batch_size: number of links leased at once
+    :param lease_seconds: time after which the links of a silent worker are given to another one
+    :param callback: function(text) called with the progress, None to print it
+    :return: the Scraper object of this worker
+    """
+    worker_id = worker_id or default_worker_id()
+    worker_options = dict(DEFAULT_OPTIONS)
+    worker_options.update(options or {})
+    worker_options.update({'resume': True,  # a restarted worker keeps what it already did
+                           'refresh': False,
+                           'background_writer': True})
+    nb_threads = nb_threads or auto_nb_threads()
+    worker_options.setdefault('download_threads', 1 if nb_threads == 1 else nb_threads * 10)
+
+    queue = WorkQueue(db_path, lease_seconds)
+    (data_frame, deduplicator), browsers = load_while_launching(lambda: load_input(csv_path, options), nb_threads,
+                                                                worker_options)
+    listener = ProgressListener(callback)
+    try:
+        queue.add(data_frame['result link'].tolist())
+        scraper = Scraper(data_frame, os.path.join(save_directory, 'workers', worker_id), listener, worker_options,
+                          browsers)
+    except BaseException:
+        browsers.close()
+        raise
+
+    # keeps our leases alive while we work on them
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(lease_seconds / 3.0):
+            queue.heartbeat(worker_id)
+
+    heart = threading.Thread(target=heartbeat, name='heartbeat', daemon=True)
+    heart.start()
+    pool = ThreadPool(nb_threads)
+
+    try:
+        while True:
+            batch = queue.lease(worker_id, batch_size)
+
+            if not batch:
+                if queue.is_finished():
+                    break
+                sleep(min(lease_seconds, 10))  # waits for the leases of the other workers to expire
+                continue
+
+            pool.map(scraper.scrape, [link for link in batch if link not in scraper.journal.entries])
+            scraper.writer.flush()  # the journal is written by the background writer
+
+            for link in batch:
+                if link in scraper.journal.entries:
+                    published = queue.complete(link, worker_id)
+                else:
+                    published = queue.fail(link, worker_id, 'not scraped')
+                if not published:
+                    scraper.logger.warning('Lease of %s expired, the link belongs to another worker', link)
+
+            listener.set_status('Worker {}: {}'.format(worker_id, queue.counts()))
+    finally:
+        stopped.set()
+        pool.close()
+        pool.join()
+        scraper.close_browsers()
+
+    scraper.save()
+    scraper.wait_downloads()
+    scraper.finish()
+    listener.set_status('Worker {} done.'.format(worker_id))
+
+    return scraper
+
+
+def merge_queue_results(csv_path, save_directory, db_path, delimiter=',', options=None):
+    """
+    Merges the outputs of every queue worker into save_directory
+    Every patent is taken from the worker which completed it, in the order of the input csv file
+    :param options: the options given to the workers, for the removal of the duplicated patents
+    :return: number of patents merged
+    """
+    queue = WorkQueue(db_path)
+    data_frame, deduplicator = load_input(csv_path, options)
+    report_duplicates(deduplicator, save_directory)
+    links = data_frame['result link'].tolist()
+    workers = os.path.join(save_directory, 'workers')
+    owners = {link: os.path.join(workers, worker) for link, worker in queue.done_links()}
+    sources = [os.path.join(workers, name) for name in os.listdir(workers)] if os.path.isdir(workers) else []
+
+    return merge_outputs(sources, save_directory, links, owners, delimiter, Scraper.logger)
+
+
+def _run_shard(csv_path, shard_directory, options, nb_threads, shard, nb_shards):
+    """Scrapes one shard of the input file, run in its own process by run_sharded"""
+    (data_frame, deduplicator), browsers = load_while_launching(lambda: load_input(csv_path, options), nb_threads,
+                                                                options)
+    data_frame = data_frame.iloc[shard::nb_shards].reset_index(drop=True)
+
+    # every shard publishes its own metrics: port + shard number, one .prom file per shard
+    options = dict(options or {})
+    if options.get('metrics_port'):
+        options['metrics_port'] += shard
+    if options.get('metrics_textfile'):
+        root, extension = os.path.splitext(options['metrics_textfile'])
+        options['metrics_textfile'] = '{}_shard{}{}'.format(root, shard, extension)
+    job = ScrapingJob(data_frame, shard_directory, options, nb_threads,
+                      ProgressListener(lambda text: print('[shard {}] {}'.format(shard, text))), browsers)
+    job.run()
+
+
+def run_sharded(csv_path, save_directory, nb_processes=None, options=None, nb_threads=None):
+    """
+    Splits the links of the input file into shards, each scraped by its own process
+    so parsing and writing use every core instead of a single one
+    Every process has its own threads and writes into save_directory/shards/<number>/,
+    the shards are then merged into save_directory
+    :param csv_path: path to the csv file downloaded from Google Patents
+    :param save_directory: output path
+    :param nb_processes: number of shards and processes, the number of cores by default
+    :param options: dictionary of options, the missing ones are taken from DEFAULT_OPTIONS
+    :param nb_threads: number of pages scraped at the same time by every process, None for automatic
+    :return: number of patents merged
+    """
+    nb_processes = nb_processes or cpu_count()
+    nb_threads = nb_threads or auto_nb_threads()
+    shard_options = dict(options or {})
+    shard_options['background_writer'] = True  # the merge reads the journals of the shards
+    directories = [os.path.join(save_directory, 'shards', str(shard)) for shard in range(nb_processes)]
+
+    processes = [Process(target=_run_shard, name='shard-{}'.format(shard),
+                         args=(csv_path, directories[shard], shard_options, nb_threads, shard, nb_processes))
+                 for shard in range(nb_processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        if process.exitcode != 0:
+            Scraper.logger.error('%s ended with the code %s', process.name, process.exitcode)
+
+    data_frame, deduplicator = load_input(csv_path, shard_options)
+    report_duplicates(deduplicator, save_directory)
+    links = data_frame['result link'].tolist()
+    return merge_outputs(directories, save_directory, links, None, shard_options.get('csv_delimiter', ','),
+                         Scraper.logger)
+
+
+def run_crawl(csv_path, save_directory, max_depth=1, max_nodes=None, direction='both', options=None,
+              nb_threads=None, callback=None):
+    """
+    Scrapes the patents of the csv file, then the patents they cite and/or are cited by, breadth-first
+    Every patent is scraped once, even when it is found several times
+    :param csv_path: path to the csv file downloaded from Google Patents, the starting patents
+    :param save_directory: output path
+    :param max_depth: number of citation levels followed from the starting patents
+    :param max_nodes: maximum number of patents scraped, None for no limit
+    :param direction: 'given', 'received' or 'both', see Frontier
+    :param options: dictionary of options, the missing ones are taken from DEFAULT_OPTIONS
+    :param nb_threads: number of pages scraped at the same time, None for automatic
+    :param callback: function(text) called with the progress, None to print it
+    :return: the Scraper object
+    """
+    frontier = Frontier(direction, max_nodes)
+    crawl_options = dict(options or {})
+    # the citations are needed to find the next patents
+    crawl_options['scrape_citations'] = crawl_options.get('scrape_citations', True) or direction != 'received'
+    crawl_options['scrape_cited'] = crawl_options.get('scrape_cited', True) or direction != 'given'
+    # the next patents are found while writing, then the texts and citations are freed
+    crawl_options['background_writer'] = True
+    crawl_options.setdefault('keep_text', False)
+
+    nb_threads = nb_threads or auto_nb_threads()
+    data_frame, browsers = load_while_launching(lambda: ReadFile(csv_path).data_frame, nb_threads, crawl_options)
+    job = ScrapingJob(data_frame, save_directory, crawl_options, nb_threads, ProgressListener(callback), browsers)
+    scraper = job.scraper
+
+    # every patent of the csv file is visited, only the ones left to scrape are scheduled
+    ids = scraper.csv_data.get('id', {})
+    seeds = set(link for link, label in scraper.rows.items() if frontier.visit(canonical_id(ids.get(label, link))))
+    level = [link for link in scraper.links if link in seeds]
+    found = []  # (url, values) of the next level, filled by the background writer
+
+    def expand(patent):
+        found.extend(frontier.expand(patent))
+
+    scraper.on_persist = expand
+    job.listener.MAX_LEN = len(level)
+    pool = ThreadPool(job.nb_threads)
+
+    try:
+        for depth in range(max_depth + 1):
+            job.listener.set_status('Crawling depth {}: {} patents'.format(depth, len(level)))
+            if depth == max_depth:
+                scraper.on_persist = None  # the last level is not expanded
+            pool.map(scraper.scrape, level)
+
+            if depth == max_depth or frontier.is_full():
+                break
+
+            scraper.writer.flush()  # every patent of this level has been expanded
+            level = []
+            for url, values in found:
+                scraper.add_link(url, values)
+                level.append(url)
+            del found[:]
+
+            if not level:
+                break
+            job.listener.MAX_LEN += len(level)
+            job.listener.set_maximum(job.listener.MAX_LEN, job.listener.nb_scraped)
+
+        scraper.on_persist = None
+        scraper.retry_failed(pool)
+    finally:
+        pool.close()
+        pool.join()
+        scraper.close_browsers()
+    scraper.save()
+    scraper.wait_downloads()
+    scraper.finish()
+    job.listener.set_status('Done: {} patents crawled.'.format(len(frontier.visited)))
+
+    return scraper
+
+
+def run_streaming(patterns, save_directory, options=None, nb_threads=None, chunk_size=10000, callback=None):
+    """
+    Scrapes one or several csv files read by chunks: the scraping starts with the first lines
+    and the memory stays the same whatever the size of the files
+    At most a few links per thread are read ahead of the scraping, and the texts are freed once written
+    :param patterns: list of csv files or glob patterns
+    :param save_directory: output path
+    :param options: dictionary of options, the missing ones are taken from DEFAULT_OPTIONS
+    :param nb_threads: number of pages scraped at the same time, None for automatic
+    :param chunk_size: number of lines read at once
+    :param callback: function(text) called with the progress, None to print it
+    :return: the Scraper object
+    """
+    nb_threads = nb_threads or auto_nb_threads()
+    stream_options = dict(DEFAULT_OPTIONS)
+    stream_options.update(options or {})
+    stream_options.setdefault('keep_text', False)
+    stream_options.setdefault('keep_patents', False)
+    stream_options.setdefault('download_threads', 1 if nb_threads == 1 else nb_threads * 10)
+    listener = ProgressListener(callback)
+    # the first chunk is read while the browsers start
+    scraper = Scraper(None, save_directory, listener, stream_options, start_browsers(nb_threads, stream_options))
+    completed = scraper.journal.completed_urls() if stream_options.get('resume') else set()
+    slots = threading.BoundedSemaphore(nb_threads * 4)  # links read ahead of the scraping
+    deduplicator = Deduplicator(stream_options.get('collapse_family')) if stream_options.get('deduplicate') else None
+
+    def links():
+        for link, values in StreamReader(patterns, chunk_size):
+            if deduplicator is not None:
+                link = deduplicator.check(link, values)
+            if link is None or link in completed:
+                continue
+            slots.acquire()
+            scraper.add_link(link, values)
+            listener.MAX_LEN += 1
+            yield link
+
+    def scrape(link):
+        try:
+            scraper.scrape(link)
+        finally:
+            slots.release()
+
+    pool = ThreadPool(nb_threads)
+    try:
+        for i in pool.imap_unordered(scrape, links()):
+            pass
+        scraper.retry_failed(pool)
+    finally:
+        pool.close()
+        pool.join()
+        scraper.close_browsers()
+    scraper.save()
+    scraper.wait_downloads()
+    scraper.finish()
+    report_duplicates(deduplicator, save_directory)
+    listener.set_status('Done.')
+
+    return scraper
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from storage import write_atomic
+
+PREFIX = 'patent_scraper_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# counters of Metrics exported as Prometheus counters, everything else in Metrics.counters is a gauge
+COUNTERS = {'pages_scraped': 'Patent pages scraped',
+            'pages_failed': 'Failed attempts to scrape a patent page',
+            'retries': 'Failed links scraped again',
+            'bytes_downloaded': 'Bytes of PDF and figures downloaded'}
+GAUGES = {'renders_in_flight': 'Pages being rendered by Chrome'}
+
+
+def resident_memory():
+    """Returns the resident memory of this process in bytes, its peak if the current one is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _metric(lines, name, kind, text, samples):
+    """Adds a metric in the text format: its HELP and TYPE lines followed by its samples [(labels, value)]"""
+    lines.append('# HELP {}{} {}'.format(PREFIX, name, text))
+    lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+    for labels, value in samples:
+        label_text = ','.join('{}="{}"'.format(key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, label in labels)
+        lines.append('{}{}{} {}'.format(PREFIX, name, '{' + label_text + '}' if label_text else '', value))
+
+
+def render_metrics(scraper):
+    """
+    Returns the metrics of a Scraper in the Prometheus text format
+    :param scraper: Scraper object
+    """
+    metrics = scraper.metrics
+    with metrics.lock:
+        counters = dict(metrics.counters)
+    histograms = metrics.snapshot()
+
+    lines = []
+    for name, text in COUNTERS.items():
+        _metric(lines, name + '_total', 'counter', text, [((), counters.get(name, 0))])
+    for name, text in GAUGES.items():
+        _metric(lines, name, 'gauge', text, [((), counters.get(name, 0))])
+
+    # queues: links left to scrape, patents waiting to be written, downloads waiting
+    depths = [((('queue', 'links'),), max(0, scraper.interface.MAX_LEN - scraper.interface.nb_scraped + 1))]
+    if scraper.writer is not None:
+        depths.append(((('queue', 'writer'),), scraper.writer.queue.qsize()))
+    if scraper.downloads is not None:
+        depths.append(((('queue', 'downloads'),), scraper.downloads.pending()))
+    _metric(lines, 'queue_depth', 'gauge', 'Items waiting in a queue', depths)
+    _metric(lines, 'dead_letters', 'gauge', 'Links still failing', [((), len(scraper.dead_letters.entries))])
+
+    # the buckets of Metrics, so Prometheus computes the quantiles with histogram_quantile
+    lines.append('# HELP {}stage_seconds Time spent in a scraping stage'.format(PREFIX))
+    lines.append('# TYPE {}stage_seconds histogram'.format(PREFIX))
+    for stage, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append('{}stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(
+                PREFIX, stage, '+Inf' if bound == float('inf') else repr(bound), count))
+        lines.append('{}stage_seconds_sum{{stage="{}"}} {}'.format(PREFIX, stage, histogram.total))
+        lines.append('{}stage_seconds_count{{stage="{}"}} {}'.format(PREFIX, stage, histogram.count))
+
+    _metric(lines, 'browser_sessions', 'gauge', 'Browser sessions of this scraper, ready, in use or being launched',
+            [((), scraper.browsers.nb_sessions)])
+    memory = resident_memory()
+    if memory is not None:
+        _metric(lines, 'resident_memory_bytes', 'gauge', 'Resident memory of the scraper', [((), memory)])
+
+    return '\n'.join(lines) + '\n'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsExporter:
+    """
+    Publishes the metrics of a Scraper while it runs, for Prometheus:
+        - on http://<host>:<port>/metrics if a port is given
+        - and/or into a file read by the textfile collector of node_exporter, rewritten every 'interval' seconds
+    Both are optional and run on daemon threads
+    """
+
+    def __init__(self, scraper, port=None, textfile=None, interval=15, host='127.0.0.1'):
+        """
+        :param scraper: Scraper object
+        :param port: port of the HTTP endpoint, None for no endpoint
+        :param textfile: path of the .prom file, None for no file
+        :param interval: seconds between two writes of the file
+        :param host: address the endpoint listens on, only the local machine by default
+        """
+        self.scraper = scraper
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.host = host
+        self.server = None
+        self.stopped = threading.Event()
+        self.writer = None
+
+    def start(self):
+        if self.port:
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = render_metrics(exporter.scraper).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', CONTENT_TYPE)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass  # one line per scrape would flood the output
+
+            self.server = _ThreadingHTTPServer((self.host, self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+
+        if self.textfile:
+            self.writer = threading.Thread(target=self._write_loop, name='metrics-textfile', daemon=True)
+            self.writer.start()
+
+        return self
+
+    def write_textfile(self):
+        """
+        Writes the metrics into the textfile, atomically so the collector never reads half a file
+        The file is readable by every user: node_exporter usually runs as its own user
+        """
+        write_atomic(self.textfile, render_metrics(self.scraper), mode=0o644)
+
+    def _write_loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.write_textfile()
+            except OSError as msg:
+                self.scraper.logger.warning('Cannot write the metrics: %s', msg)
+
+    def stop(self):
+        """Writes the final metrics and stops the endpoint"""
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.write_textfile()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import os
+import random
+import struct
+import zlib
+
+from storage import write_atomic
+
+# columns of the csv file exported by Google Patents, after its first 'search URL' line
+CSV_COLUMNS = ['id', 'title', 'assignee', 'inventor/author', 'priority date', 'filing/creation date',
+               'publication date', 'grant date', 'result link', 'representative figure link']
+
+FIRST_NUMBER = 9000000  # number of the first synthetic patent
+PATENTS_BASE = 'https://patents.google.com/'
+PDF_BASE = 'https://patentimages.storage.googleapis.com/'
+MANIFEST = 'manifest.json'
+
+# size of a synthetic page: paragraphs of description, claims, citations, citing patents,
+# similar documents, non-patent citations and legal events
+PROFILES = {
+    'tiny': {'paragraphs': 2, 'claims': 2, 'citations': 3, 'cited_by': 2, 'similar': 3, 'npl': 1, 'events': 2},
+    'typical': {'paragraphs': 60, 'claims': 20, 'citations': 40, 'cited_by': 30, 'similar': 20, 'npl': 10,
+                'events': 15},
+    'huge': {'paragraphs': 3000, 'claims': 200, 'citations': 1500, 'cited_by': 1200, 'similar': 100, 'npl': 300,
+             'events': 80}
+}
+
+_WORDS = ('device', 'method', 'system', 'layer', 'signal', 'circuit', 'surface', 'module', 'wherein', 'first',
+          'second', 'configured', 'plurality', 'substrate', 'member', 'control', 'data', 'unit', 'portion', 'the',
+          'a', 'of', 'and', 'to', 'in', 'is', 'for', 'with', 'said', 'least', 'one', 'at', 'by', 'an')
+
+
+def patent_id(index):
+    """Returns the id of the synthetic patent number 'index': US9000000B2, US9000001B2..."""
+    return 'US{}B2'.format(FIRST_NUMBER + index)
+
+
+def patent_index(fixture_id):
+    """Returns the index of a synthetic patent from its id, see patent_id"""
+    return int(''.join(c for c in fixture_id if c.isdigit()) or FIRST_NUMBER) - FIRST_NUMBER
+
+
+def patent_link(fixture_id, base=PATENTS_BASE):
+    """Returns the link to a patent page, as in the 'result link' column"""
+    return '{}patent/{}/en'.format(base, fixture_id)
+
+
+def _sentence(rng, nb_words):
+    words = [rng.choice(_WORDS) for i in range(nb_words)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def _paragraph(rng, nb_sentences):
+    return ' '.join(_sentence(rng, rng.randint(8, 25)) for i in range(nb_sentences))
+
+
+def _date(rng):
+    return '{}-{:02d}-{:02d}'.format(rng.randint(1990, 2020), rng.randint(1, 12), rng.randint(1, 28))
+
+
+def _text_section(rng, name, paragraphs, translated):
+    """A text section as Google renders it, with the original text hidden next to the translation"""
+    parts = ['<section><div class="{} style-scope patent-text">'.format(name)]
+
+    for paragraph in paragraphs:
+        if translated:
+            parts.append('<div class="notranslate style-scope patent-text">'
+                         '<span class="google-src-text style-scope patent-text">{}</span>{}</div>'
+                         .format(_paragraph(rng, 1), paragraph))
+        else:
+            parts.append('<div class="style-scope patent-text">{}</div>'.format(paragraph))
+
+    parts.append('</div></section>')
+    return '\n'.join(parts)
+
+
+def _citation_table(rng, section_id, nb_rows, first_index):
+    """Table of patents (given or received citations): id, priority date, publication date, assignee, title"""
+    rows = []
+    for i in range(nb_rows):
+        cited = patent_id(first_index + i)
+        rows.append('<div class="tr style-scope patent-result">'
+                    '<span class="td nowrap style-scope patent-result">'
+                    '<state-modifier data-result="patent/{0}/en" class="style-scope patent-result">'
+                    '<a href="/patent/{0}/en" class="style-scope state-modifier">{0}</a></state-modifier></span>'
+                    '<span class="td style-scope patent-result">{1}</span>'
+                    '<span class="td style-scope patent-result">{2}</span>'
+                    '<span class="td style-scope patent-result">{3}</span>'
+                    '<span class="td style-scope patent-result">{4}</span></div>'
+                    .format(cited, _date(rng), _date(rng), 'Assignee {}'.format(rng.randint(1, 500)),
+                            _sentence(rng, 6)))
+
+    return ('<h3 id="{}" class="style-scope patent-result">Citations ({})</h3>\n'
+            '<div class="responsive-table style-scope patent-result">{}</div>'
+            .format(section_id, nb_rows, '\n'.join(rows)))
+
+
+def patent_page(fixture_id, profile='typical', translated=False, seed=0, pdf_base=PDF_BASE):
+    """
+    Returns a synthetic patent page with the structure of a page rendered from Google Patents,
+    so every extractor of Scraper finds its data
+    :param fixture_id: id of the patent, see patent_id
+    :param profile: size of the page, a key of PROFILES
+    :param translated: True for a page translated by Google, with the original text next to the translation
+    :param seed: the same seed always gives the same page
+    :param pdf_base: beginning of the link to the PDF file, it must contain 'https://patentimages.'
+    """
+    size = PROFILES[profile]
+    rng = random.Random('{}-{}-{}'.format(fixture_id, profile, seed))
+    index = patent_index(fixture_id)
+
+    claims = ['{}. {}'.format(i + 1, _paragraph(rng, 2)) for i in range(size['claims'])]
+    description = [_paragraph(rng, rng.randint(3, 8)) for i in range(size['paragraphs'])]
+    similar = []
+    for i in range(size['similar']):
+        similar_id = patent_id(index + 100000 + i)
+        similar.append('<div class="tr style-scope patent-result">'
+                       '<span class="td style-scope patent-result">'
+                       '<state-modifier data-result="patent/{0}/en" class="style-scope patent-result">{0}'
+                       '</state-modifier></span>'
+                       '<span class="td style-scope patent-result">{1}</span>'
+                       '<span class="td style-scope patent-result">{2}</span></div>'
+                       .format(similar_id, _date(rng), _sentence(rng, 6)))
+    npl = ['<div class="tr style-scope patent-result">{}, {}</div>'.format(_sentence(rng, 10), rng.randint(1990, 2020))
+           for i in range(size['npl'])]
+    events = ['<div class="tr style-scope patent-result">'
+              '<span class="td style-scope patent-result">{}</span>'
+              '<span class="td style-scope patent-result">{}</span></div>'.format(_date(rng), _sentence(rng, 5))
+              for i in range(size['events'])]
+
+    return '\n'.join([
+        '<html><head><title>{} - Google Patents</title></head><body>'.format(fixture_id),
+        '<a href="{}{}.pdf" class="style-scope patent-result">Download PDF</a>'.format(pdf_base, fixture_id),
+        '<div class="tagline style-scope patent-result">Patent</div>',
+        '<dd data-inventor="Inventor {}" class="style-scope patent-result">Inventor</dd>'.format(rng.randint(1, 999)),
+        '<dd data-assignee="Assignee {}" class="style-scope patent-result">Assignee</dd>'.format(rng.randint(1, 500)),
+        '<span id="" class="appstatus style-scope family-viewer">{}</span>'.format(rng.choice(['Active', 'Expired'])),
+        '<span class="style-scope classification-viewer">H01L{}/{}</span>'.format(rng.randint(1, 99),
+                                                                                   rng.randint(1, 999)),
+        _text_section(rng, 'abstract', [_paragraph(rng, 3)], translated),
+        _text_section(rng, 'description', description, translated),
+        _text_section(rng, 'claims', claims, translated),
+        _citation_table(rng, 'patentCitations', size['citations'], index + 1),
+        _citation_table(rng, 'citedBy', size['cited_by'], index + 10000),
+        '<h3 id="nplCitations" class="style-scope patent-result">Non-Patent Citations</h3>\n'
+        '<div class="responsive-table style-scope patent-result">{}</div>'.format('\n'.join(npl)),
+        '<h3 id="similarDocuments" class="style-scope patent-result">Similar Documents</h3>\n'
+        '<div class="responsive-table style-scope patent-result">{}</div>'.format('\n'.join(similar)),
+        '<h3 id="legalEvents" class="style-scope patent-result">Legal Events</h3>\n'
+        '<div class="responsive-table style-scope patent-result">{}</div>'.format('\n'.join(events)),
+        '</body></html>'])
+
+
+def csv_file(ids, link_base=PATENTS_BASE, figure_base=PDF_BASE, seed=0):
+    """
+    Returns the content of a Google Patents csv file listing some patents
+    :param ids: list of patent ids
+    :param link_base: beginning of the 'result link' column, a local server for example
+    :param figure_base: beginning of the 'representative figure link' column
+    """
+    rng = random.Random(seed)
+    content = io.StringIO(newline='')
+    content.write('search URL:,{}?q=fixtures\r\n'.format(link_base))
+    writer = csv.writer(content)
+    writer.writerow(CSV_COLUMNS)
+
+    for fixture_id in ids:
+        dashed = '{}-{}-{}'.format(fixture_id[:2], fixture_id[2:-2], fixture_id[-2:])
+        writer.writerow([dashed, _sentence(rng, 6), 'Assignee {}'.format(rng.randint(1, 500)),
+                         'Inventor {}'.format(rng.randint(1, 999)), _date(rng), _date(rng), _date(rng), _date(rng),
+                         patent_link(fixture_id, link_base), '{}{}.png'.format(figure_base, fixture_id)])
+
+    return content.getvalue()
+
+
+def pdf_file(fixture_id, size=200000):
+    """Returns the bytes of a minimal PDF file of about 'size' bytes"""
+    header = '%PDF-1.4\n% {}\n'.format(fixture_id).encode('ascii')
+    padding = b'%' + b'0' * 78 + b'\n'
+    return header + padding * max(0, (size - len(header)) // len(padding)) + b'%%EOF\n'
+
+
+def png_file(width=64, height=64):
+    """Returns the bytes of a grey PNG image"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    raw = b''.join(b'\x00' + b'\x80' * width for i in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def write_corpus(directory, counts=None, translated_every=4, seed=0, pdf_base=PDF_BASE):
+    """
+    Writes a corpus of synthetic pages: <directory>/<id>.html and a manifest listing them
+    :param counts: dictionary {profile: number of pages}, a few tiny, typical and huge pages by default
+    :param translated_every: one page in translated_every is a translated page, 0 for none
+    :return: the manifest, list of {'id', 'profile', 'translated', 'file'}
+    """
+    counts = counts or {'tiny': 5, 'typical': 20, 'huge': 2}
+    manifest = []
+    index = 0
+
+    for profile in sorted(counts):
+        for i in range(counts[profile]):
+            fixture_id = patent_id(index)
+            translated = bool(translated_every) and index % translated_every == translated_every - 1
+            name = fixture_id + '.html'
+            write_atomic(os.path.join(directory, name),
+                         patent_page(fixture_id, profile, translated, seed, pdf_base))
+            manifest.append({'id': fixture_id, 'profile': profile, 'translated': translated, 'file': name})
+            index += 1
+
+    write_atomic(os.path.join(directory, MANIFEST), json.dumps(manifest, indent=1))
+    return manifest
+
+
+def load_corpus(directory):
+    """
+    Reads a corpus of pages: the synthetic ones of write_corpus or pages saved from Google Patents
+    Without a manifest, every .html file of the directory is a page named after its patent id
+    :return: list of (manifest entry, html)
+    """
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    else:
+        manifest = [{'id': os.path.splitext(name)[0], 'profile': 'recorded', 'translated': None, 'file': name}
+                    for name in sorted(os.listdir(directory)) if name.endswith('.html')]
+
+    pages = []
+    for entry in manifest:
+        with open(os.path.join(directory, entry['file']), encoding='utf-8') as f:
+            pages.append((entry, f.read()))
+
+    return pages
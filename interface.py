@@ -1,16 +1,84 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from multiprocessing import cpu_count
-from multiprocessing.dummy import Pool as ThreadPool
 from os import path
 from time import time
 
-import pandas as pd
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 
 import gui
-from Scraper import Scraper
+from engine import ProgressListener, ScrapingJob, auto_nb_threads, load_while_launching
+from reader import ReadFile
+
+
+class ScrapingWorker(QtCore.QObject, ProgressListener):
+    """
+    Runs a ScrapingJob in its own QThread so the window keeps responding
+    The Scraper threads never touch the widgets: the progress is sent through queued signals,
+    at most every UPDATE_INTERVAL seconds
+    """
+
+    UPDATE_INTERVAL = 0.2  # seconds between two progress signals
+
+    progress = QtCore.pyqtSignal(int, int, str)  # value, maximum, status text
+    finished = QtCore.pyqtSignal(int)  # number of seconds the job took
+    failed = QtCore.pyqtSignal(str)  # error message
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        ProgressListener.__init__(self)
+        self.job = None
+        self.value = 0
+        self.maximum = 0
+        self.text = ''
+        self.last_update = 0
+
+    def add_increment(self, text):
+        with self.lock:
+            self.value += 1
+        ProgressListener.add_increment(self, text)
+
+    def set_status(self, text):
+        self._update(text, force=True)
+
+    def set_maximum(self, maximum, value=0):
+        with self.lock:
+            self.maximum = maximum
+            self.value = value
+        self._update(self.text, force=True)
+
+    def on_progress(self, text):
+        self._update(text)
+
+    def _update(self, text, force=False):
+        """Emits the progress, unless the last signal is too recent"""
+        with self.lock:
+            self.text = text
+            now = time()
+            if not force and now - self.last_update < self.UPDATE_INTERVAL:
+                return
+            self.last_update = now
+            value, maximum = self.value, self.maximum
+
+        self.progress.emit(value, maximum, text)
+
+    @QtCore.pyqtSlot()
+    def run(self):
+        """Runs the job, called in the worker thread"""
+        try:
+            done = self.job.run()
+        except Exception as msg:
+            print(msg)
+            print("Scraper process terminated, please try again")
+            self.failed.emit(str(msg))
+        else:
+            self.progress.emit(self.value, self.maximum, self.text)  # the last progress may have been skipped
+            self.finished.emit(done)
+
+    def stop(self):
+        """Asks the job to stop, called from the GUI thread"""
+        if self.job is not None:
+            self.job.stop()
 
 
 class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
@@ -27,12 +95,18 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         self.radio_concatenate_all.toggled.connect(self.check_concatenate_all)
         self.radio_threads_no.toggled.connect(self.radio_check_nbthreads)
         self.radio_scrape_all.toggled.connect(self.check_scrape_items)
-        self.nb_scraped = 1
-        self.nb_pdf = 1
-        self.nb_figures = 1
-        self.MAX_LEN = 0
-        self.pdf_list = []
-        self.figures_list = []
+
+        # gui.py is generated, the stop button is added here
+        self.stopButton = QtWidgets.QPushButton('Stop', self.layoutWidget_4)
+        self.stopButton.setSizePolicy(self.startButton.sizePolicy())
+        self.stopButton.setMaximumSize(QtCore.QSize(100, 16777215))
+        self.stopButton.setObjectName("stopButton")
+        self.stopButton.setEnabled(False)
+        self.horizontalLayout_7.insertWidget(self.horizontalLayout_7.indexOf(self.startButton) + 1, self.stopButton)
+        self.stopButton.clicked.connect(self.stop)
+        self.job = None
+        self.scraping_thread = None
+        self.worker = None
 
     def open_file(self):
         """Creates a window to select a file in the explorer"""
@@ -131,10 +205,7 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         if self.radio_threads_no.isChecked():
             return 1
         elif self.txt_nb_cores.text() == 'auto':
-            nb_threads = cpu_count() * 2
-            nb_threads = 8 if nb_threads > 8 else int(nb_threads)
-
-            return nb_threads
+            return auto_nb_threads()
         else:
             return int(self.txt_nb_cores.text())
 
@@ -169,23 +240,26 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         options.update({'download_pdf': self.check_PDF.isChecked()})
         options.update({'download_figures': self.check_figures.isChecked()})
         options.update({'csv_delimiter': self.txt_char.text()})
+        options.update({'background_writer': True, 'writer_fsync': 'batch'})
+        # downloads run alongside the scraping, with their own threads
+        nb_threads = self.get_nb_threads()
+        options.update({'download_threads': 1 if nb_threads == 1 else nb_threads * 10})
+        options.update({'download_connections': options.get('download_threads')})  # one per download thread
 
         return options
 
-    def add_increment(self, text):
-        """Increases the progress on our progress bar"""
-        self.progressBar.setValue(self.progressBar.value() + 1)
-        self.nb_scraped += 1
+    def set_status(self, text):
+        """Displays the current step of the scraping"""
         self.label_status.setText(text)
         self.label_status.setMinimumWidth(len(self.label_status.text()) * 10)
 
     def start_scraping(self):
         """Start the process of scraping
-        First it reads the csv file
-        Second, it reads all the options the user selected
-        Third it instances a Scraper object and gets the number of threads
-        Then it starts the scraping process by calling the 'scrape' method on a ThreadPool
-        Finally it saves and displays a message
+        First it reads all the options the user selected
+        Second, it reads the csv file while the browsers start in the background
+        Third it instances a ScrapingJob with the number of threads
+        Then it runs the job in a QThread, which scrapes on a ThreadPool, saves and waits for the downloads
+        Finally, when the job emits its finished signal, it displays a message
         :exception: FileNotFound: if the input csv is not found
                        Exception: if the nb_threads or csv_delimiter text inputs are empty
               NotADirectoryError: if the save path doesnt lead to a directory
@@ -193,9 +267,7 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
                         KeyError: if the inpu csv file is not compatible
         """
 
-        start_time = time()  # monitors the time it takes to scrape our links
         filepath = self.filePath.text()
-        self.nb_scraped = 1
         try:
             if not self.directoryPath.text():
                 raise FileNotFoundError
@@ -204,98 +276,27 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             if path.isfile(self.directoryPath.text()):
                 raise NotADirectoryError
 
-            file = ReadFile(filepath).data_frame
-
             options = self.get_all_options()
-
-            scraper = Scraper(file, self.directoryPath.text(), self, options)
-            self.MAX_LEN = len(scraper.links)
-
-            self.progressBar.setMaximum(self.MAX_LEN)
             thread_count = self.get_nb_threads()
 
-            self.progressBar.setValue(0)
-            self.pool = ThreadPool(thread_count)
-
-            self.label_status.setText('Scraping... ({}/{})'.format(self.nb_scraped, self.MAX_LEN))
-            self.label_status.setMinimumWidth(len(self.label_status.text()) * 10)
-
-            self.progressBar.setValue(len(scraper.links))
-            self.progressBar.setValue(0)
-
-            try:
-                self.pool.map(scraper.scrape, scraper.links)
-                self.pool.close()
-                self.pool.join()
-                for link in scraper.failed_url:
-                    scraper.scrape(link)
-
-                for tries in range(20):
-                    try:
-                        scraper.save()
-
-                    except Exception as msg:
-                        scraper.logger.exception(msg)
-                        print('Saving of files failed :\n {} \n\n Trying again...'.format(msg))
-                        scraper.save()
-                    else:
-                        break
-                else:
-                    print("Cannot save files. \n " + str(msg))
-
-                self.pdf_list = []
-                for patent in scraper.patent_list:
-                    if patent.pdf_link is not None:
-                        self.pdf_list.append(patent.pdf_link)
-
-                if self.get_all_options().get('download_pdf'):
-                    if thread_count == 1:
-                        self.pool = ThreadPool(1)
-                    else:
-                        self.pool = ThreadPool(thread_count * 10)
-
-                    self.nb_pdf = 1
-                    self.label_status.setText('Downloading PDF... ({}/{})'.format(self.nb_pdf, len(self.pdf_list)))
-                    self.label_status.setMinimumWidth(len(self.label_status.text()) * 10)
-                    self.progressBar.setValue(0)
-                    self.progressBar.setMaximum(len(self.pdf_list))
-                    self.pool.map(scraper.download_pdf, self.pdf_list)
-                    self.pool.close()
-
-                self.figures_list = []
-                for patent in scraper.patent_list:
-                    if patent.figure_link is not None and patent.figure_link is not '':
-                        self.figures_list.append(patent.patent_id + '#' + patent.figure_link)
-
-                if self.get_all_options().get('download_figures'):
-                    if thread_count == 1:
-                        self.pool = ThreadPool(1)
-                    else:
-                        self.pool = ThreadPool(thread_count * 10)
-
-                    self.nb_pdf = 1
-                    self.label_status.setText(
-                        'Downloading figures... ({}/{})'.format(self.nb_pdf, len(self.figures_list)))
-                    self.label_status.setMinimumWidth(len(self.label_status.text()) * 10)
-                    self.progressBar.setValue(0)
-                    self.progressBar.setMaximum(len(self.figures_list))
-                    self.pool.map(scraper.download_figures, self.figures_list)
-                    self.pool.close()
-
-                self.progressBar.update()
-                scraper.logger.info('DONE')
-                self.label_status.setText('Done.')
-                self.label_status.setMinimumWidth(len(self.label_status.text()) * 10)
-
-                done = round(time() - start_time)
-                print("Process finished in {} seconds".format(done))
-                self.job_done(done)
-
-            except (ConnectionError, Exception) as msg:
-                self.pool.close()
-                print(msg)
-                print("Scraper process terminated, please try again")
-                self.err_render(msg)
+            file, browsers = load_while_launching(lambda: ReadFile(filepath).data_frame, thread_count, options)
+
+            # the job runs in a QThread, its progress comes back through signals
+            self.worker = ScrapingWorker()
+            self.job = ScrapingJob(file, self.directoryPath.text(), options, thread_count, self.worker, browsers)
+            self.worker.job = self.job
+            self.scraping_thread = QtCore.QThread(self)
+            self.worker.moveToThread(self.scraping_thread)
+            self.scraping_thread.started.connect(self.worker.run)
+            self.worker.progress.connect(self.show_progress)
+            self.worker.finished.connect(self.scraping_finished)
+            self.worker.failed.connect(self.scraping_failed)
+            self.worker.finished.connect(self.scraping_thread.quit)
+            self.worker.failed.connect(self.scraping_thread.quit)
+
+            self.startButton.setEnabled(False)
+            self.stopButton.setEnabled(True)
+            self.scraping_thread.start()
 
         except IsADirectoryError as e:
             print(e)
@@ -323,8 +324,32 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
             elif not self.txt_nb_cores.text():
                 self.empty_nb_cores()
 
+    def show_progress(self, value, maximum, text):
+        """Updates the progress bar, connected to the worker's progress signal"""
+        self.progressBar.setMaximum(maximum)
+        self.progressBar.setValue(value)
+        self.set_status(text)
+
+    def scraping_finished(self, done):
+        """Called in the GUI thread when the job is over"""
+        self.startButton.setEnabled(True)
+        self.stopButton.setEnabled(False)
+        self.progressBar.update()
+        print("Process finished in {} seconds".format(done))
+        self.job_done(done)
+
+    def scraping_failed(self, msg):
+        """Called in the GUI thread when the job raised an exception"""
+        self.startButton.setEnabled(True)
+        self.stopButton.setEnabled(False)
+        self.err_render(msg)
+
     def stop(self):
-        self.pool.terminate()
+        """Stops the running job, connected to the stop button"""
+        if self.worker is not None:
+            self.stopButton.setEnabled(False)
+            self.set_status('Stopping...')
+            self.worker.stop()
 
     def _empty_path_err(self):
         """Creates an error window if the Path is empty"""
@@ -399,20 +424,6 @@ class ScraperApplication(QtWidgets.QMainWindow, gui.Ui_MainWindow):
         msg.exec_()
 
 
-class ReadFile:
-    """
-    Object representing our original csv file, stored into a Pandas DataFrame
-    """
-
-    def __init__(self, file_name):
-        self.f = open(file_name, encoding='utf-8', newline='')
-        self.data_frame = pd.read_csv(self.f, skiprows=[0], encoding='utf-8', na_filter=False)
-        self.f.close()
-
-    def dataframe(self):
-        return self.data_frame
-
-
 def main():
     app = QtWidgets.QApplication(sys.argv)
     form = ScraperApplication()
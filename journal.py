@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+from datetime import datetime
+
+
+class Journal:
+    """
+    Append-only journal of the patents completely written to the disk
+    Every line is a json object: {'id', 'url', 'outputs', 'row', 'time'}
+        outputs: files written for the patent, relative to the output path
+        row: the patent's line of dataFrame.csv, so it can be written again when resuming
+    A run that crashed can be resumed by scraping only the links missing from the journal
+    """
+
+    FILE_NAME = 'journal.jsonl'
+
+    def __init__(self, path, resume=False, fsync=False):
+        """
+        :param path: output path chosen by the user
+        :param resume: True to keep the entries of the previous run, False to start a new journal
+        :param fsync: True to flush every entry to the disk
+        """
+        self.path = path
+        self.file_path = os.path.join(path, self.FILE_NAME)
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.entries = {}  # {url: entry}
+
+        os.makedirs(path, exist_ok=True)
+
+        if resume:
+            self.entries = self.load(self.file_path)
+
+        self.file = open(self.file_path, 'at' if resume else 'wt', encoding='utf-8')
+
+    @staticmethod
+    def load(file_path):
+        """
+        Reads a journal file
+        :return: dictionary {url: entry}, the last entry of a url wins
+        """
+        entries = {}
+
+        if not os.path.isfile(file_path):
+            return entries
+
+        with open(file_path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line cut by a crash
+                entries[entry.get('url')] = entry
+
+        return entries
+
+    def completed_urls(self):
+        """Returns the set of the urls already done"""
+        return set(self.entries.keys())
+
+    def record(self, patent_id, url, outputs, row):
+        """
+        Adds a completed patent to the journal
+        :param patent_id: id of the patent
+        :param url: link scraped
+        :param outputs: list of the files written for this patent
+        :param row: dictionary, the patent's line in dataFrame.csv
+        """
+        entry = {'id': patent_id,
+                 'url': url,
+                 'outputs': [os.path.relpath(output, self.path) for output in outputs],
+                 'row': row,
+                 'time': datetime.now().isoformat()}
+
+        with self.lock:
+            self.entries[url] = entry
+            self.file.write(json.dumps(entry, default=str) + '\n')
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.lock:
+            self.file.close()
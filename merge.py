@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import os
+
+from deadletter import DeadLetterStore
+from journal import Journal
+from neardup import NearDuplicates, find_near_duplicates
+from search import SearchIndex, build_index
+from storage import CITATION_FILES, DATAFRAME_COLUMNS, link_or_copy, write_atomic
+
+ASSET_FOLDERS = ('PDF', 'FIGURES')
+
+
+def merge_outputs(sources, destination, links=None, owners=None, delimiter=',', logger=None):
+    """
+    Merges the outputs of several runs (workers, shards) into a single output folder
+    The result only depends on the inputs, not on the order the runs finished:
+        - every patent is taken from a single source: its owner if given, otherwise the first source having it
+        - the patents are written in the order of 'links', the input csv file
+    :param sources: list of output folders, each with its journal
+    :param destination: output folder of the merged result
+    :param links: list of links in the order of the input file, None to sort them
+    :param owners: dictionary {link: source folder}, None to take the first source having the link
+    :param delimiter: delimiter of dataFrame.csv
+    :param logger: Logger object
+    :return: number of patents merged
+    """
+    sources = sorted(sources)
+    journals = {source: Journal.load(os.path.join(source, Journal.FILE_NAME)) for source in sources}
+
+    # chooses the source of every patent
+    chosen = {}  # {link: (source, entry)}
+    for source in sources:
+        for link, entry in journals[source].items():
+            owner = owners.get(link) if owners else None
+            if (owner is None and link not in chosen) or owner == source:
+                chosen[link] = (source, entry)
+
+    order = [link for link in (links or sorted(chosen)) if link in chosen]
+    positions = {}  # {patent id: position}
+    for position, link in enumerate(order):
+        positions.setdefault(str(chosen[link][1].get('id')), position)
+
+    # text files
+    for link in order:
+        source, entry = chosen[link]
+        for output in entry.get('outputs', []):
+            if not output.startswith('CSV'):
+                link_or_copy(os.path.join(source, output), os.path.join(destination, output))
+
+    _merge_dataframe(destination, [chosen[link][1].get('row') for link in order], delimiter)
+    _merge_citations(sources, destination, chosen, positions)
+    _merge_assets(sources, destination)
+
+    # merged journal, so the result can be resumed or refreshed like any other run
+    journal = ''.join(json.dumps(chosen[link][1], default=str) + '\n' for link in order)
+    write_atomic(os.path.join(destination, Journal.FILE_NAME), journal)
+
+    # links which failed everywhere, so they can be retried on the merged result
+    failed = {}
+    for source in sources:
+        for link, entry in DeadLetterStore.load(os.path.join(source, DeadLetterStore.FILE_NAME)).items():
+            if link not in chosen:
+                failed.setdefault(link, entry)
+    write_atomic(os.path.join(destination, DeadLetterStore.FILE_NAME),
+                 ''.join(json.dumps(failed[link], default=str) + '\n' for link in sorted(failed)))
+
+    # full-text index of the merged patents, read from the merged text files
+    if any(os.path.isfile(os.path.join(source, SearchIndex.FILE_NAME)) for source in sources):
+        build_index(destination, logger)
+    if any(os.path.isfile(os.path.join(source, 'CSV', NearDuplicates.REPORT_NAME)) for source in sources):
+        find_near_duplicates(destination, logger=logger)
+
+    if logger is not None:
+        logger.info('Merged %d patents from %d folders', len(order), len(sources))
+
+    return len(order)
+
+
+def _merge_dataframe(destination, rows, delimiter):
+    content = io.StringIO(newline='')
+    data_frame = csv.DictWriter(content, DATAFRAME_COLUMNS, extrasaction='ignore', delimiter=delimiter or ',')
+    data_frame.writeheader()
+    for row in rows:
+        if row:
+            data_frame.writerow(row)
+
+    write_atomic(os.path.join(destination, 'CSV', 'dataFrame.csv'), content.getvalue())
+
+
+def _merge_citations(sources, destination, chosen, positions):
+    """
+    Concatenates the citation files, keeping for every patent the rows of the source it was taken from
+    Rows are sorted by the position of the patent, then by their order in the source
+    """
+    owner_of = {}  # {patent id: source}
+    for source, entry in chosen.values():
+        owner_of[str(entry.get('id'))] = source
+
+    for name, column in CITATION_FILES.items():
+        header = None
+        rows = []
+
+        for source in sources:
+            file_path = os.path.join(source, 'CSV', name)
+            if not os.path.isfile(file_path):
+                continue
+
+            with open(file_path, encoding='utf-8', newline='') as citation_file:
+                reader = csv.reader(citation_file)
+                source_header = next(reader, None)
+                if source_header is None:
+                    continue
+                header = header or source_header
+                index = source_header.index(column)
+
+                for line, row in enumerate(reader):
+                    patent_id = row[index] if len(row) > index else ''
+                    if owner_of.get(patent_id) == source:
+                        rows.append((positions.get(patent_id, len(positions)), line, row))
+
+        if header is not None:
+            rows.sort(key=lambda item: (item[0], item[1]))
+            content = io.StringIO(newline='')
+            citation_writer = csv.writer(content)
+            citation_writer.writerow(header)
+            citation_writer.writerows(row for position, line, row in rows)
+            write_atomic(os.path.join(destination, 'CSV', name), content.getvalue())
+
+
+def _merge_assets(sources, destination):
+    """Links the PDF and figures of every source, the first source wins when two have the same file"""
+    for folder in ASSET_FOLDERS:
+        seen = set()
+
+        for source in sources:
+            directory = os.path.join(source, folder)
+            if not os.path.isdir(directory):
+                continue
+
+            for name in sorted(os.listdir(directory)):
+                if name not in seen and not name.endswith('.link'):
+                    seen.add(name)
+                    link_or_copy(os.path.join(directory, name), os.path.join(destination, folder, name))
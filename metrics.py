@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import csv
+import io
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from storage import write_atomic
+
+REPORT_COLUMNS = ['stage', 'count', 'total_seconds', 'mean', 'p50', 'p95', 'p99', 'max', 'items_per_second']
+
+# upper bounds of the histogram buckets in seconds, 6 per decade from 1 ms to 1000 s, see Histogram
+BUCKETS = tuple(float(round(base * 10 ** exponent, 4))
+                for exponent in range(-3, 3) for base in (1, 1.5, 2, 3, 5, 7.5)) + (1000.0,)
+
+
+class Histogram:
+    """
+    Durations of a stage counted into fixed buckets, so its memory does not grow with the number of patents
+    The count, sum, minimum and maximum are exact, the percentiles are interpolated inside their bucket
+    The buckets are the ones of the Prometheus histogram, see exporter.render_metrics
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket holds the durations above BUCKETS[-1]
+        self.count = 0
+        self.total = 0.0
+        self.min = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        if not self.count or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.count += 1
+        self.total += seconds
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.count, histogram.total, histogram.min, histogram.max = self.count, self.total, self.min, self.max
+        return histogram
+
+    def percentile(self, rank):
+        """
+        Estimates a percentile: the nearest-rank duration is looked for in its bucket,
+        assuming the durations of a bucket are evenly spread between its bounds
+        :param rank: percentile wanted, between 0 and 100
+        """
+        if not self.count:
+            return 0.0
+
+        target = max(1, min(self.count, int(round(rank / 100.0 * self.count))))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= target:
+                lower = max(BUCKETS[index - 1] if index else 0.0, self.min)
+                upper = min(BUCKETS[index] if index < len(BUCKETS) else self.max, self.max)
+                return lower + (upper - lower) * (target - seen) / float(count)
+            seen += count
+
+        return self.max
+
+    def cumulative(self):
+        """Returns [(upper bound, number of durations up to it)] for every bucket, the last bound being inf"""
+        bounds = BUCKETS + (float('inf'),)
+        total = 0
+        result = []
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+
+class Metrics:
+    """
+    Timings and counters of the scraping stages, shared by every thread
+    The durations of a stage go into a Histogram: its memory is the same after ten or a million patents
+    Stages: render, parse, extract.<item>, write.<file>, download.pdf, download.figure...
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = perf_counter()
+        self.histograms = {}  # {stage: Histogram}
+        self.counters = {}  # {name: number}
+        self.profiler = None  # profiling.Profiler of the stages, if profiling is enabled
+
+    def observe(self, stage, seconds):
+        """Records one duration of a stage"""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """
+        Context manager recording the time spent in its block, even if it raises
+        The block is also profiled if the profiler wants this stage
+        """
+        profile = self.profiler is not None and self.profiler.wants(stage)
+        start = perf_counter()
+        try:
+            if profile:
+                with self.profiler.profile(stage):
+                    yield
+            else:
+                yield
+        finally:
+            self.observe(stage, perf_counter() - start)
+
+    def time(self, stage, function, *args):
+        """Calls function(*args), records its duration and returns its result"""
+        with self.timer(stage):
+            return function(*args)
+
+    def increment(self, name, value=1):
+        """Adds value to a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """Returns a copy of the histograms, {stage: Histogram}, which can be read without the lock"""
+        with self.lock:
+            return {stage: histogram.copy() for stage, histogram in self.histograms.items()}
+
+    def summary(self):
+        """
+        Returns the statistics of every stage, in seconds
+        items_per_second is the number of items of the stage divided by the time elapsed since the start
+        :return: list of dictionaries, one per stage, see REPORT_COLUMNS
+        """
+        histograms = self.snapshot()
+        elapsed = max(perf_counter() - self.start, 1e-9)
+
+        rows = []
+        for stage in sorted(histograms):
+            histogram = histograms[stage]
+            rows.append({'stage': stage,
+                         'count': histogram.count,
+                         'total_seconds': round(histogram.total, 3),
+                         'mean': round(histogram.total / histogram.count, 4),
+                         'p50': round(histogram.percentile(50), 4),
+                         'p95': round(histogram.percentile(95), 4),
+                         'p99': round(histogram.percentile(99), 4),
+                         'max': round(histogram.max, 4),
+                         'items_per_second': round(histogram.count / elapsed, 3)})
+
+        return rows
+
+    def write_report(self, file_path):
+        """
+        Writes the summary as a csv file, the counters follow the stages with only a 'count'
+        :return: the summary, see summary
+        """
+        rows = self.summary()
+        with self.lock:
+            counters = [{'stage': name, 'count': value} for name, value in sorted(self.counters.items())]
+
+        content = io.StringIO(newline='')
+        report = csv.DictWriter(content, REPORT_COLUMNS)
+        report.writeheader()
+        report.writerows(rows + counters)
+
+        write_atomic(file_path, content.getvalue())
+
+        return rows
+
+    def format_summary(self):
+        """Returns the summary as a text table, for the log"""
+        lines = ['{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}'.format('stage', 'count', 'p50', 'p95', 'p99', 'items/s')]
+        for row in self.summary():
+            lines.append('{:<28}{:>8}{:>10.3f}{:>10.3f}{:>10.3f}{:>10.2f}'.format(
+                row['stage'], row['count'], row['p50'], row['p95'], row['p99'], row['items_per_second']))
+
+        return '\n'.join(lines)
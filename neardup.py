@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Near-duplicate patents: family members and continuations with almost the same abstract and claims
+Every patent gets a MinHash signature of the shingles of its text, and locality-sensitive hashing
+only compares the patents sharing a band of their signatures, instead of every pair of patents
+The clusters are written into CSV/near_duplicates.csv, next to similar_documents.csv:
+    python neardup.py output_folder --threshold 0.8
+"""
+
+import argparse
+import csv
+import io
+import os
+import re
+import sys
+import threading
+
+from journal import Journal
+from search import read_text_files
+from storage import write_atomic
+
+ITEMS = ('ABSTRACT', 'CLAIMS')  # items of Patent.all_text compared
+NUM_HASHES = 128  # values of a signature
+BANDS = 16  # bands of 8 values: two patents 80% similar share a band with a probability of 0.9
+SHINGLE_SIZE = 5  # words of a shingle
+THRESHOLD = 0.8  # estimated Jaccard similarity from which two patents are near-duplicates
+MAX_BUCKET = 100  # patents of a bucket compared pairwise, the bigger buckets are compared to their first patent
+
+_EMPTY = 1 << 64
+_MASK = _EMPTY - 1
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """
+    Returns the set of the 64-bit hashes of every 'size' consecutive words of the text, lower-cased
+    Python's hash is salted for every process: the signatures are only compared within a run, never stored
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < size:
+        words = words and [' '.join(words)]
+        size = 1
+
+    return set(hash(shingle) & _MASK for shingle in zip(*(words[i:] for i in range(size))))
+
+
+def signature(hashes, num_hashes=NUM_HASHES):
+    """
+    Returns the MinHash signature of a set of shingle hashes, None if it is empty
+    One permutation hashing: every hash goes into one of num_hashes bins, which keeps its minimum,
+    so a signature costs a single hash per shingle; the empty bins borrow the value of the next bin
+    :param num_hashes: number of bins, a power of 2
+    """
+    if not hashes:
+        return None
+
+    bits = num_hashes.bit_length() - 1
+    values = [_EMPTY] * num_hashes
+    for value in hashes:
+        index = value & (num_hashes - 1)
+        value >>= bits
+        if value < values[index]:
+            values[index] = value
+
+    # densification: an empty bin takes the value of the next filled one, marked with its distance
+    filled = [value != _EMPTY for value in values]
+    dense = list(values)
+    for index in range(num_hashes):
+        if not filled[index]:
+            distance = 1
+            while not filled[(index + distance) % num_hashes]:
+                distance += 1
+            dense[index] = values[(index + distance) % num_hashes] + distance * _EMPTY
+
+    return tuple(dense)
+
+
+def similarity(first, second):
+    """Estimates the Jaccard similarity of two patents from their signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / float(len(first))
+
+
+class NearDuplicates:
+    """
+    Finds the clusters of near-duplicate patents
+    add computes the signature of a patent, at the time it is written so its text can then be freed;
+    clusters puts every signature into BANDS buckets and compares only the patents sharing a bucket
+    """
+
+    REPORT_NAME = 'near_duplicates.csv'
+
+    def __init__(self, threshold=THRESHOLD, num_hashes=NUM_HASHES, bands=BANDS, items=ITEMS):
+        """
+        :param threshold: estimated Jaccard similarity from which two patents are near-duplicates
+        :param num_hashes: values of a signature, a power of 2
+        :param bands: number of LSH bands, dividing num_hashes: more bands find less similar pairs
+        :param items: items of Patent.all_text compared
+        """
+        self.threshold = threshold
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.items = items
+        self.lock = threading.Lock()
+        self.signatures = {}  # {patent id: signature}
+
+    def add(self, patent_id, texts):
+        """
+        Computes the signature of a patent, the patents without text are ignored
+        :param texts: dictionary {item: text}, see Patent.all_text
+        """
+        hashes = set()
+        for item in self.items:
+            hashes |= shingles(texts.get(item) or '')
+
+        value = signature(hashes, self.num_hashes)
+        if value is not None:
+            with self.lock:
+                self.signatures[patent_id] = value
+
+    def add_patent(self, patent):
+        """Computes the signature of a Patent object, called by Scraper.persist"""
+        self.add(patent.patent_id, patent.all_text())
+
+    def add_outputs(self, path, entries):
+        """
+        Computes the signatures of patents already written, from their text files
+        :param entries: journal entries, see Journal.load; the patents with a signature are skipped
+        """
+        for entry in entries:
+            patent_id = str(entry.get('id'))
+            if patent_id not in self.signatures:
+                self.add(patent_id, read_text_files(path, entry.get('outputs', [])))
+
+    def clusters(self):
+        """
+        Groups the near-duplicate patents
+        :return: list of clusters, each a list of (patent id, similarity with the first patent of the cluster),
+                 the first patent being the smallest id; patents without near-duplicate are left out
+        """
+        with self.lock:
+            signatures = dict(self.signatures)
+
+        rows = self.num_hashes // self.bands
+        parents = {}
+
+        def find(patent_id):
+            root = patent_id
+            while parents.get(root, root) != root:
+                root = parents[root]
+            while patent_id != root:  # path compression
+                parents[patent_id], patent_id = root, parents.get(patent_id, patent_id)
+            return root
+
+        def union(first, second):
+            first, second = find(first), find(second)
+            if first != second:
+                parents[max(first, second)] = min(first, second)
+
+        compared = set()
+        for band in range(self.bands):
+            buckets = {}
+            for patent_id, value in signatures.items():
+                buckets.setdefault(value[band * rows:(band + 1) * rows], []).append(patent_id)
+
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                if len(members) > MAX_BUCKET:
+                    pairs = ((members[0], other) for other in members[1:])
+                else:
+                    pairs = ((first, second) for i, first in enumerate(members) for second in members[i + 1:])
+
+                for first, second in pairs:
+                    pair = (first, second) if first < second else (second, first)
+                    if pair in compared:
+                        continue
+                    compared.add(pair)
+                    if similarity(signatures[first], signatures[second]) >= self.threshold:
+                        union(first, second)
+
+        groups = {}
+        for patent_id in parents:
+            groups.setdefault(find(patent_id), []).append(patent_id)
+
+        clusters = []
+        for root, members in groups.items():
+            members = sorted(set(members) | {root})
+            if len(members) > 1:
+                clusters.append([(patent_id, similarity(signatures[members[0]], signatures[patent_id]))
+                                 for patent_id in members])
+
+        return sorted(clusters, key=lambda cluster: (-len(cluster), cluster[0][0]))
+
+    def write_report(self, path):
+        """
+        Writes the clusters into path/CSV/near_duplicates.csv: cluster, id, representative, similarity
+        :return: number of patents in a cluster
+        """
+        content = io.StringIO(newline='')
+        report = csv.writer(content)
+        report.writerow(['cluster', 'id', 'representative', 'similarity'])
+        nb_patents = 0
+
+        for number, cluster in enumerate(self.clusters(), 1):
+            for patent_id, value in cluster:
+                report.writerow([number, patent_id, cluster[0][0], round(value, 3)])
+                nb_patents += 1
+
+        write_atomic(os.path.join(path, 'CSV', self.REPORT_NAME), content.getvalue())
+        return nb_patents
+
+
+def find_near_duplicates(path, threshold=THRESHOLD, logger=None):
+    """
+    Finds the near-duplicates of an output folder from its journal and text files, without scraping
+    :return: number of patents in a cluster
+    """
+    finder = NearDuplicates(threshold)
+    finder.add_outputs(path, Journal.load(os.path.join(path, Journal.FILE_NAME)).values())
+    nb_patents = finder.write_report(path)
+
+    if logger is not None:
+        logger.info('%d near-duplicate patents, see CSV/%s', nb_patents, NearDuplicates.REPORT_NAME)
+
+    return nb_patents
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Finds the near-duplicate patents of an output folder')
+    parser.add_argument('save_directory', help='output folder of the scraper')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='similarity of the abstract and claims from which two patents are near-duplicates, '
+                             '{} by default'.format(THRESHOLD))
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    nb_patents = find_near_duplicates(args.save_directory, args.threshold)
+    print('{} near-duplicate patents written to {}'.format(
+        nb_patents, os.path.join(args.save_directory, 'CSV', NearDuplicates.REPORT_NAME)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
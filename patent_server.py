@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for Google Patents, to load-test the scraper end to end on an offline machine
+It serves patent pages, PDF files and figures from fixtures, with a configurable latency,
+error rate and throttling:
+    python patent_server.py serve --port 8765 --latency 0.3 --error-rate 0.02 --max-rps 50
+    python patent_server.py csv --count 1000 --port 8765 --output links.csv
+    python cli.py links.csv output_folder
+
+The pages are read from a corpus folder (--corpus, see fixtures.load_corpus) or generated on the fly
+Every PDF link of a page keeps an https://patentimages. link in its query string,
+which is how the scraper recognizes PDF links
+"""
+
+import argparse
+import functools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import fixtures
+
+DEFAULT_PORT = 8765
+
+_PAGE = re.compile(r'^/patent/([^/?#]+)')
+_PDF = re.compile(r'^/pdf/([^/?#]+)\.pdf')
+_FIGURE = re.compile(r'^/figures/([^/?#]+)\.png')
+
+
+@functools.lru_cache(maxsize=128)
+def _generated_page(patent_id, profile, seed, base_url):
+    """Generates a page once, so the server does not compete with the scraper for the processor"""
+    page = fixtures.patent_page(patent_id, profile, seed=seed, pdf_base=base_url + 'pdf/')
+    # the scraper only keeps the links containing https://patentimages.
+    return page.replace('.pdf"', '.pdf?mirror={}{}.pdf"'.format(fixtures.PDF_BASE, patent_id))
+
+
+class ServerSettings:
+    """Behaviour of the server, can be changed while it runs"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, max_rps=0, profile=None, pdf_size=200000, seed=0):
+        """
+        :param latency: seconds waited before every answer
+        :param jitter: random seconds added to the latency, between 0 and jitter
+        :param error_rate: part of the requests answered with a 503 error
+        :param max_rps: requests per second above which the server answers 429 Too Many Requests, 0 for no limit
+        :param profile: size of the generated pages (see fixtures.PROFILES), None to mix them
+        :param pdf_size: size of the PDF files in bytes
+        :param seed: seed of the generated pages and of the errors
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_rps = max_rps
+        self.profile = profile
+        self.pdf_size = pdf_size
+        self.seed = seed
+
+
+class PatentServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering like Google Patents, every request on its own thread"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, settings=None, corpus=None):
+        """
+        :param settings: ServerSettings object
+        :param corpus: folder of pages, None to generate them
+        """
+        super(PatentServer, self).__init__((host, port), _Handler)
+        self.settings = settings or ServerSettings()
+        self.pages = {}  # {patent id: html}
+        if corpus is not None:
+            self.pages = {entry['id']: html for entry, html in fixtures.load_corpus(corpus)}
+        self.random = random.Random(self.settings.seed)
+        self.lock = threading.Lock()
+        self.window = []  # times of the requests of the last second, for max_rps
+        self.stats = {'pages': 0, 'pdf': 0, 'figures': 0, 'errors': 0, 'throttled': 0, 'not_found': 0,
+                      'bytes': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def page(self, patent_id):
+        """Returns the page of a patent, None if the corpus does not have it"""
+        if self.pages:
+            return self.pages.get(patent_id)
+
+        profile = self.settings.profile
+        if profile is None:
+            # mostly typical pages, with some tiny and a few huge ones
+            index = fixtures.patent_index(patent_id)
+            profile = 'huge' if index % 50 == 49 else 'tiny' if index % 5 == 4 else 'typical'
+
+        return _generated_page(patent_id, profile, self.settings.seed, self.base_url)
+
+    def admit(self):
+        """
+        Decides the fate of a request
+        :return: None to answer it, or the HTTP status of the error to send
+        """
+        with self.lock:
+            now = time.time()
+            if self.settings.max_rps:
+                self.window = [moment for moment in self.window if now - moment < 1.0]
+                if len(self.window) >= self.settings.max_rps:
+                    self.stats['throttled'] += 1
+                    return 429
+                self.window.append(now)
+
+            if self.settings.error_rate and self.random.random() < self.settings.error_rate:
+                self.stats['errors'] += 1
+                return 503
+
+        return None
+
+    def count(self, kind, nb_bytes):
+        with self.lock:
+            self.stats[kind] += 1
+            self.stats['bytes'] += nb_bytes
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        settings = server.settings
+
+        if self.path == '/stats':
+            with server.lock:
+                self._send(200, 'application/json', json.dumps(server.stats).encode('utf-8'))
+            return
+
+        delay = settings.latency + (random.uniform(0, settings.jitter) if settings.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        error = server.admit()
+        if error is not None:
+            headers = {'Retry-After': '1'} if error == 429 else {}
+            self._send(error, 'text/plain', b'Error', headers)
+            return
+
+        match = _PAGE.match(self.path)
+        if match:
+            html = server.page(match.group(1))
+            if html is not None:
+                body = html.encode('utf-8')
+                server.count('pages', len(body))
+                self._send(200, 'text/html; charset=utf-8', body)
+                return
+
+        match = _PDF.match(self.path)
+        if match:
+            body = fixtures.pdf_file(match.group(1), settings.pdf_size)
+            server.count('pdf', len(body))
+            self._send(200, 'application/pdf', body, {'ETag': '"{}-{}"'.format(match.group(1), len(body))})
+            return
+
+        match = _FIGURE.match(self.path)
+        if match:
+            body = fixtures.png_file()
+            server.count('figures', len(body))
+            self._send(200, 'image/png', body, {'ETag': '"{}-png"'.format(match.group(1))})
+            return
+
+        server.count('not_found', 0)
+        self._send(404, 'text/plain', b'Not found')
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # thousands of requests per run
+
+
+def write_csv(file_path, count, base_url, corpus=None, seed=0):
+    """
+    Writes a Google Patents csv file whose 'result link' and 'representative figure link' point at the server
+    :param count: number of patents, ignored when a corpus is given: every page of the corpus is listed
+    :param base_url: address of the server, http://127.0.0.1:8765/
+    :return: number of patents listed
+    """
+    if corpus is not None:
+        ids = [entry['id'] for entry, html in fixtures.load_corpus(corpus)]
+    else:
+        ids = [fixtures.patent_id(index) for index in range(count)]
+
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(fixtures.csv_file(ids, base_url, base_url + 'figures/', seed))
+
+    return len(ids)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for Google Patents, for load tests')
+    commands = parser.add_subparsers(dest='command')
+
+    serve = commands.add_parser('serve', help='serves patent pages, PDF files and figures')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--corpus', help='folder of pages to serve, generated pages by default')
+    serve.add_argument('--latency', type=float, default=0.0, help='seconds waited before every answer')
+    serve.add_argument('--jitter', type=float, default=0.0, help='random seconds added to the latency')
+    serve.add_argument('--error-rate', type=float, default=0.0, help='part of the requests answered with 503')
+    serve.add_argument('--max-rps', type=int, default=0,
+                       help='requests per second above which the server answers 429, 0 for no limit')
+    serve.add_argument('--profile', choices=sorted(fixtures.PROFILES),
+                       help='size of every generated page, a mix by default')
+    serve.add_argument('--pdf-size', type=int, default=200000, help='size of the PDF files in bytes')
+    serve.add_argument('--seed', type=int, default=0)
+
+    csv_command = commands.add_parser('csv', help='writes a csv file of links to the server')
+    csv_command.add_argument('--count', type=int, default=100, help='number of patents')
+    csv_command.add_argument('--host', default='127.0.0.1')
+    csv_command.add_argument('--port', type=int, default=DEFAULT_PORT)
+    csv_command.add_argument('--corpus', help='lists the pages of this corpus instead')
+    csv_command.add_argument('--output', default='links.csv')
+    csv_command.add_argument('--seed', type=int, default=0)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == 'csv':
+        base_url = 'http://{}:{}/'.format(args.host, args.port)
+        count = write_csv(args.output, args.count, base_url, args.corpus, args.seed)
+        print('{} links to {} written to {}'.format(count, base_url, args.output))
+        return 0
+
+    if args.command != 'serve':
+        parse_args(['--help'])
+        return 2
+
+    settings = ServerSettings(args.latency, args.jitter, args.error_rate, args.max_rps, args.profile,
+                              args.pdf_size, args.seed)
+    server = PatentServer(args.host, args.port, settings, args.corpus)
+    print('Serving patents on {} (statistics on {}stats), Ctrl+C to stop'.format(server.base_url, server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
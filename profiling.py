@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import cProfile
+import io
+import os
+import random
+import threading
+import tracemalloc
+from datetime import datetime
+
+from storage import write_atomic
+
+
+class Profiler:
+    """
+    Opt-in profiling of the scraping, enabled by the 'profile_*' options
+        - stages: every run of the chosen stages (render, parse, extract.abstract...) is profiled with cProfile,
+          through Metrics.timer, see Metrics.profiler
+        - sampled patents: a random part of the patents is profiled from the rendering to the extraction
+        - memory: tracemalloc snapshots are taken at checkpoints and compared with the first one
+    The profiles are written into the log folder by write: a .pstats file per stage (for pstats, snakeviz...)
+    and a .txt summary of its top hotspots
+
+    Every thread has its own profile of a stage, merged by write: the threads never wait for each other
+    From Python 3.12, a single profiler can be active at a time: a block starting while another thread
+    is profiled runs without profile, and is counted in 'skipped'
+    """
+
+    def __init__(self, directory, stages=(), sample_rate=0.0, top=30, memory=False):
+        """
+        :param directory: folder where the profiles are written, the log folder of the run
+        :param stages: names of the stages profiled, a name ending with '.' profiles every stage starting with it,
+                       'all' profiles every stage
+        :param sample_rate: part of the patents profiled, between 0 and 1
+        :param top: number of functions in the summaries
+        :param memory: True to trace the memory allocations
+        """
+        self.directory = directory
+        self.stages = set(stages)
+        self.sample_rate = sample_rate
+        self.top = top
+        self.memory = memory
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiles = []  # [(stage, cProfile.Profile)], a profile per stage and thread
+        self.skipped = 0  # blocks not profiled because another profiler was active
+        self.snapshots = []  # [(checkpoint, tracemalloc.Snapshot)]
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+
+    @classmethod
+    def from_options(cls, directory, options):
+        """Returns the Profiler of the 'profile_*' options, None if profiling is not wanted"""
+        stages = options.get('profile_stages') or ()
+        if isinstance(stages, str):
+            stages = [stage.strip() for stage in stages.split(',') if stage.strip()]
+        sample_rate = options.get('profile_sample_rate') or 0.0
+        memory = options.get('profile_memory', False)
+
+        if not stages and not sample_rate and not memory:
+            return None
+
+        return cls(directory, stages, sample_rate, options.get('profile_top', 30), memory)
+
+    def wants(self, stage):
+        """Returns True if the stage has to be profiled"""
+        if 'all' in self.stages or stage in self.stages:
+            return True
+
+        return any(name.endswith('.') and stage.startswith(name) for name in self.stages)
+
+    def sample(self):
+        """Returns True if the next patent has to be profiled, see sample_rate"""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextlib.contextmanager
+    def profile(self, stage):
+        """
+        Context manager profiling its block as a run of a stage
+        Inside a block already profiled by this thread, the block is simply part of the outer profile
+        """
+        if getattr(self.local, 'active', False):
+            yield
+            return
+
+        profiles = getattr(self.local, 'profiles', None)
+        if profiles is None:
+            profiles = self.local.profiles = {}  # {stage: cProfile.Profile} of this thread
+        profile = profiles.get(stage)
+        if profile is None:
+            profile = profiles[stage] = cProfile.Profile()
+            with self.lock:
+                self.profiles.append((stage, profile))
+
+        try:
+            profile.enable()
+        except ValueError:  # Python 3.12+: another thread is being profiled
+            with self.lock:
+                self.skipped += 1
+            yield
+            return
+
+        self.local.active = True
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.local.active = False
+
+    def checkpoint(self, name):
+        """Takes a snapshot of the memory, if it is traced"""
+        if self.memory and tracemalloc.is_tracing():
+            self.snapshots.append((name, tracemalloc.take_snapshot()))
+
+    def write(self):
+        """
+        Writes the profiles and the memory report into the directory
+        :return: list of the files written
+        """
+        import pstats  # only needed once, at the end of a profiled run
+
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = datetime.now().strftime('profile_%H_%M_%S_%d_%m_%Y_')
+        written = []
+
+        with self.lock:
+            profiles = list(self.profiles)
+
+        # the profiles of every thread are merged into one per stage
+        merged = {}
+        for stage, profile in profiles:
+            try:
+                if stage in merged:
+                    merged[stage].add(profile)
+                else:
+                    merged[stage] = pstats.Stats(profile, stream=io.StringIO())
+            except TypeError:
+                pass  # this thread never ran the stage with the profiler active
+
+        for stage, stats in sorted(merged.items()):
+            name = os.path.join(self.directory, prefix + stage.replace('.', '_'))
+            stats.dump_stats(name + '.pstats')
+
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.strip_dirs().sort_stats('cumulative').print_stats(self.top)
+            stats.sort_stats('tottime').print_stats(self.top)
+            write_atomic(name + '.txt', summary.getvalue())
+            written += [name + '.pstats', name + '.txt']
+
+        if self.snapshots:
+            name = os.path.join(self.directory, prefix + 'memory.txt')
+            write_atomic(name, self._memory_report())
+            written.append(name)
+
+        return written
+
+    def _memory_report(self):
+        """Top allocations at every checkpoint, and what grew since the first one"""
+        first_name, first = self.snapshots[0]
+        lines = []
+        if tracemalloc.is_tracing():
+            lines += ['Peak of the traced memory: {:.1f} MB'.format(tracemalloc.get_traced_memory()[1] / 1e6), '']
+
+        for name, snapshot in self.snapshots:
+            total = sum(stat.size for stat in snapshot.statistics('filename'))
+            lines.append('=== {}: {:.1f} MB traced'.format(name, total / 1e6))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                lines.append(str(stat))
+
+            if snapshot is not first:
+                lines.append('--- growth since {}'.format(first_name))
+                for stat in snapshot.compare_to(first, 'lineno')[:self.top]:
+                    lines.append(str(stat))
+            lines.append('')
+
+        return '\n'.join(lines)
+
+    def stop(self):
+        """Stops tracing the memory"""
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
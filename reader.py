@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import glob
+
+
+class ReadFile:
+    """
+    Object representing our original csv file, stored into a Pandas DataFrame
+    """
+
+    def __init__(self, file_name):
+        import pandas as pd
+
+        self.f = open(file_name, encoding='utf-8', newline='')
+        self.data_frame = pd.read_csv(self.f, skiprows=[0], encoding='utf-8', na_filter=False)
+        self.f.close()
+
+    def dataframe(self):
+        return self.data_frame
+
+
+def expand_paths(patterns):
+    """
+    Returns the files matching a list of paths or glob patterns, in the given order, without duplicates
+    A path matching no file is kept as is, so opening it raises FileNotFoundError
+    """
+    paths = []
+
+    for pattern in patterns:
+        for file_path in sorted(glob.glob(pattern)) or [pattern]:
+            if file_path not in paths:
+                paths.append(file_path)
+
+    return paths
+
+
+class StreamReader:
+    """
+    Reads one or several Google Patents csv files by chunks, so the memory does not depend on their size
+    Iterating over it gives (link, {column: value}) for every line
+    """
+
+    def __init__(self, patterns, chunk_size=10000):
+        """
+        :param patterns: list of csv files or glob patterns ('exports/*.csv')
+        :param chunk_size: number of lines read at once
+        """
+        self.paths = expand_paths(patterns)
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        """Yields DataFrame objects of at most chunk_size lines"""
+        import pandas as pd
+
+        for file_path in self.paths:
+            with open(file_path, encoding='utf-8', newline='') as f:
+                for chunk in pd.read_csv(f, skiprows=[0], encoding='utf-8', na_filter=False,
+                                         chunksize=self.chunk_size):
+                    yield chunk
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for row in chunk.to_dict('records'):
+                yield row['result link'], row
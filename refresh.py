@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import os
+from datetime import datetime, timedelta
+
+from journal import Journal
+
+
+class RefreshPolicy:
+    """
+    Decides, for every patent of a previous run, if it has to be scraped again
+
+    - patents missing from the previous run are always scraped
+    - when only fixed data is wanted (texts, classifications, given citations...), the others are kept
+    - when data changing over time is wanted (received citations, legal events, status),
+      patents are scraped again once older than max_age_days,
+      or final_max_age_days for the patents which reached a final status (expired, abandoned...)
+    """
+
+    DYNAMIC_OPTIONS = ('scrape_cited', 'scrape_legal')  # data which keeps changing after the publication
+    FINAL_STATUSES = ('expired', 'abandoned', 'withdrawn', 'ceased', 'revoked', 'lapsed')
+
+    def __init__(self, max_age_days=7, final_max_age_days=90):
+        self.max_age = timedelta(days=max_age_days)
+        self.final_max_age = timedelta(days=final_max_age_days)
+
+    def needs_refresh(self, row, scraped_at, options, now=None):
+        """
+        :param row: dictionary, line of the patent in the previous dataFrame.csv, None if not scraped yet
+        :param scraped_at: datetime of the previous scraping of the patent
+        :param options: dictionary of scraping options
+        :param now: datetime used as the current date
+        :return: True if the patent has to be scraped again
+        """
+        if row is None or scraped_at is None:
+            return True
+
+        if not any(options.get(option) for option in self.DYNAMIC_OPTIONS):
+            return False
+
+        age = (now or datetime.now()) - scraped_at
+        status = str(row.get('status', '')).lower()
+
+        if any(final in status for final in self.FINAL_STATUSES):
+            return age > self.final_max_age
+
+        return age > self.max_age
+
+
+def parse_time(text):
+    """Reads the time of a journal entry, None if it cannot be read"""
+    for time_format in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(text, time_format)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def load_previous_run(path, delimiter=','):
+    """
+    Reads what a previous run wrote in the output path
+    The journal gives the date of every patent, otherwise dataFrame.csv is used with its modification date
+    :return: dictionary {url: (row, datetime)}
+    """
+    previous = {}
+    data_frame_path = os.path.join(path, 'CSV', 'dataFrame.csv')
+
+    if os.path.isfile(data_frame_path):
+        modified = datetime.fromtimestamp(os.path.getmtime(data_frame_path))
+
+        with open(data_frame_path, encoding='utf-8', newline='') as data_frame:
+            for row in csv.DictReader(data_frame, delimiter=delimiter or ','):
+                previous[row.get('link')] = (row, modified)
+
+    for url, entry in Journal.load(os.path.join(path, Journal.FILE_NAME)).items():
+        if entry.get('row'):
+            previous[url] = (entry.get('row'), parse_time(entry.get('time')))
+
+    return previous
+
+
+def plan_refresh(path, links, options, policy=None, logger=None):
+    """
+    Splits the links between the ones to scrape again and the ones kept from the previous run
+    :param path: output path of the previous run
+    :param links: list of links of the input csv file
+    :param options: dictionary of scraping options
+    :param policy: RefreshPolicy, None for the default one
+    :param logger: Logger object
+    :return: (links to scrape, lines of dataFrame.csv of the previous run)
+    """
+    policy = policy or RefreshPolicy(options.get('refresh_max_age_days', 7),
+                                     options.get('refresh_final_max_age_days', 90))
+    previous = load_previous_run(path, options.get('csv_delimiter'))
+    now = datetime.now()
+    to_scrape = []
+
+    for link in links:
+        row, scraped_at = previous.get(link, (None, None))
+        if policy.needs_refresh(row, scraped_at, options, now):
+            to_scrape.append(link)
+
+    if logger is not None:
+        logger.info('Refresh: %d patents to scrape again, %d kept from the previous run',
+                    len(to_scrape), len(links) - len(to_scrape))
+
+    return to_scrape, [row for row, scraped_at in previous.values()]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOGGER_NAME = 'patent_scraper'
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# attributes of every LogRecord, the other ones have been given with 'extra' and are written as fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single json line: {'time', 'level', 'thread', 'message', ...}
+    The values given with 'extra' (url, patent_id...) become fields of their own
+    """
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(),
+                 'level': record.levelname,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    Puts the records into the queue as they are: the message is only formatted by the listener thread,
+    so the scraping threads never pay for it
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class RunLog:
+    """
+    Log of a run, written by a background thread
+    The scraping threads only put records into a queue, a QueueListener formats and writes them
+    into a rotating file of the log folder, and warnings go to the console
+
+    Only one RunLog is attached at a time: starting a new one detaches the previous one,
+    so the lines of a run are never written twice in the same session
+    """
+
+    active = None
+
+    def __init__(self, directory, level=logging.INFO, json_format=True, max_bytes=MAX_BYTES,
+                 backup_count=BACKUP_COUNT, console_level=logging.WARNING):
+        """
+        :param directory: folder of the log files, created if needed
+        :param level: minimum level written, the calls below it cost almost nothing
+        :param json_format: True for json lines, False for plain text
+        :param max_bytes: size of a file before it rotates
+        :param backup_count: number of rotated files kept
+        :param console_level: minimum level printed on the console, None for no console
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.file_path = os.path.join(directory, datetime.now().strftime('scraper_%H_%M_%S_%d_%m_%Y.log'))
+        self.level = level
+        self.logger = logging.getLogger(LOGGER_NAME)
+
+        file_handler = RotatingFileHandler(self.file_path, maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding='utf-8')
+        if json_format:
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s :: %(levelname)s :: %(message)s'))
+        handlers = [file_handler]
+
+        if console_level is not None:
+            console = logging.StreamHandler(sys.stderr)
+            console.setLevel(console_level)
+            console.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+            handlers.append(console)
+
+        self.queue = queue.Queue(-1)
+        self.handler = _LazyQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+
+    @classmethod
+    def from_options(cls, directory, options):
+        """Creates the log of a run from the scraping options 'log_level', 'log_format' and 'log_max_bytes'"""
+        level = options.get('log_level', 'INFO')
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())
+
+        return cls(directory, level, options.get('log_format', 'json') == 'json',
+                   options.get('log_max_bytes', MAX_BYTES))
+
+    def start(self):
+        """Attaches the log to the scraper's logger, detaching the one of the previous run"""
+        if RunLog.active is not None:
+            RunLog.active.stop()
+
+        self.logger.setLevel(self.level)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        RunLog.active = self
+
+        return self
+
+    def stop(self):
+        """Writes the remaining records and detaches the log"""
+        if RunLog.active is not self:
+            return
+
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        RunLog.active = None
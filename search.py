@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+Full-text search over the scraped patents, instead of going through the TXT/ folder
+The index is a SQLite FTS5 table in the output folder (search.sqlite), written while scraping
+with the 'search_index' option (--index) and updated by every following run:
+    python search.py output_folder "solar cell electrode"
+    python search.py output_folder "claims: lithium NOT cobalt" --raw --limit 50
+An output folder scraped without the option is indexed from its journal and text files:
+    python search.py output_folder --build
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from time import perf_counter
+
+from journal import Journal
+
+# columns of the index, the items of Patent.all_text
+COLUMNS = ('title', 'abstract', 'claims', 'description')
+# weight of a match in every column for bm25, a word of the title counts more than a word of the description
+WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def to_match_query(text):
+    """
+    Turns plain words into an FTS5 query matching the patents containing all of them
+    The words are quoted, so '-', ':' or '*' in the text are not read as FTS5 operators
+    """
+    return ' '.join('"{}"'.format(word) for word in _WORD.findall(text))
+
+
+class SearchIndex:
+    """
+    Inverted index of the text of the patents, stored in path/search.sqlite
+    Every patent is a row of an FTS5 table (porter stemming), ranked with bm25;
+    a patent scraped again replaces its previous row, so the index is updated incrementally
+    The rows are committed by batches of batch_size patents and when the index is closed
+    """
+
+    FILE_NAME = 'search.sqlite'
+
+    def __init__(self, path, keep=True, batch_size=200):
+        """
+        :param path: output path chosen by the user
+        :param keep: True to update the index of the previous runs, False to start a new one
+        :param batch_size: number of patents added in a single transaction
+        """
+        self.file_path = os.path.join(path, self.FILE_NAME)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = 0  # patents added since the last commit
+
+        os.makedirs(path, exist_ok=True)
+        if not keep:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.file_path + suffix):
+                    os.remove(self.file_path + suffix)
+
+        # used by the background writer thread and by the thread saving the files, never at the same time
+        self.connection = sqlite3.connect(self.file_path, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS documents ('
+                                'rowid INTEGER PRIMARY KEY, '
+                                'patent_id TEXT UNIQUE, '
+                                'link TEXT, '
+                                'indexed TEXT)')
+        self.connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS patents USING fts5({}, '
+                                "tokenize='porter unicode61')".format(', '.join(COLUMNS)))
+        self.connection.commit()
+
+    def add(self, patent_id, link, texts, indexed=''):
+        """
+        Indexes the text of a patent, replacing the one indexed before if any
+        :param texts: dictionary {item: text}, see Patent.all_text
+        :param indexed: time of the version indexed, the time of its journal entry
+        """
+        values = [texts.get(column.upper()) or '' for column in COLUMNS]
+
+        with self.lock:
+            cursor = self.connection.cursor()
+            row = cursor.execute('SELECT rowid FROM documents WHERE patent_id = ?', (patent_id,)).fetchone()
+            if row is not None:
+                cursor.execute('DELETE FROM patents WHERE rowid = ?', row)
+                cursor.execute('UPDATE documents SET link = ?, indexed = ? WHERE rowid = ?', (link, indexed, row[0]))
+                rowid = row[0]
+            else:
+                rowid = cursor.execute('INSERT INTO documents (patent_id, link, indexed) VALUES (?, ?, ?)',
+                                       (patent_id, link, indexed)).lastrowid
+            cursor.execute('INSERT INTO patents (rowid, {}) VALUES (?, {})'.format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), [rowid] + values)
+
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.connection.commit()
+                self.pending = 0
+
+    def add_patent(self, patent):
+        """Indexes a Patent object, called by Scraper.persist once it is in the journal, before its text is freed"""
+        self.add(patent.patent_id, patent.link, patent.all_text(), datetime.now().isoformat())
+
+    def indexed(self):
+        """Returns {patent id: time of the version indexed}"""
+        with self.lock:
+            return dict(self.connection.execute('SELECT patent_id, indexed FROM documents').fetchall())
+
+    def search(self, query, limit=20, raw=False):
+        """
+        Finds the patents matching a query, the best ones first
+        :param query: words which must all be in the patent, or an FTS5 query if raw
+                      ('title: battery', 'solar NEAR(cell panel)', 'electrode*'...)
+        :param limit: maximum number of patents returned
+        :return: list of (patent id, bm25 score, link), the lower the score the better the match
+        """
+        match = query if raw else to_match_query(query)
+        if not match:
+            return []
+
+        with self.lock:
+            return self.connection.execute(
+                'SELECT documents.patent_id, bm25(patents, {}) AS score, documents.link '
+                'FROM patents JOIN documents ON documents.rowid = patents.rowid '
+                'WHERE patents MATCH ? ORDER BY score LIMIT ?'.format(', '.join(str(w) for w in WEIGHTS)),
+                (match, limit)).fetchall()
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def optimize(self):
+        """Merges the segments of the index into one, for faster queries after many updates"""
+        with self.lock:
+            self.connection.execute("INSERT INTO patents (patents) VALUES ('optimize')")
+            self.connection.commit()
+
+    def close(self):
+        """Commits the patents added and closes the index"""
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def read_text_files(path, outputs):
+    """
+    Reads the text of a patent from the files written by Patent.write_txt_files
+    Every file is made of sections: an empty line, the name of the item, its text
+    :param outputs: paths of the files of the patent, relative to path, from its journal entry
+    :return: dictionary {item: text}
+    """
+    texts = {}
+    names = set(column.upper() for column in COLUMNS)
+
+    for output in outputs:
+        if not output.endswith('.txt'):
+            continue
+        try:
+            with open(os.path.join(path, output), encoding='utf-8') as text_file:
+                content = text_file.read()
+        except OSError:
+            continue
+
+        name, lines = None, []
+        for line in content.split('\n') + ['']:
+            if line in names or line in ('CLASSIFICATIONS', 'LEGAL_EVENTS'):
+                if name is not None:
+                    texts.setdefault(name, '\n'.join(lines).strip())
+                name, lines = line, []
+            elif name is not None:
+                lines.append(line)
+        if name is not None:
+            texts.setdefault(name, '\n'.join(lines).strip())
+
+    return texts
+
+
+def build_index(path, logger=None):
+    """
+    Indexes an output folder from its journal and text files, without scraping
+    Only the patents scraped since they were last indexed are read, so it can run after every scrape
+    :return: number of patents indexed
+    """
+    index = SearchIndex(path)
+    try:
+        indexed = index.indexed()
+        nb_indexed = 0
+
+        for url, entry in Journal.load(os.path.join(path, Journal.FILE_NAME)).items():
+            patent_id = str(entry.get('id'))
+            if indexed.get(patent_id) and indexed[patent_id] >= entry.get('time', ''):
+                continue
+
+            texts = read_text_files(path, entry.get('outputs', []))
+            texts['TITLE'] = (entry.get('row') or {}).get('title') or texts.get('TITLE', '')
+            index.add(patent_id, url, texts, entry.get('time', ''))
+            nb_indexed += 1
+    finally:
+        index.close()
+
+    if logger is not None:
+        logger.info('%d patents indexed into %s', nb_indexed, index.file_path)
+
+    return nb_indexed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Searches the patents of an output folder, ranked with bm25')
+    parser.add_argument('save_directory', help='output folder of the scraper')
+    parser.add_argument('query', nargs='?', help='words which must all be in the patent')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='number of patents shown, 20 by default')
+    parser.add_argument('--raw', action='store_true',
+                        help="query in the FTS5 syntax: columns ('title: battery'), OR, NOT, NEAR, prefixes (cell*)")
+    parser.add_argument('--json', action='store_true', help='prints the results as json lines')
+    parser.add_argument('--build', action='store_true',
+                        help='indexes the patents scraped since the last update, from the journal and text files')
+    parser.add_argument('--optimize', action='store_true', help='merges the index into a single segment')
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.build:
+        print('{} patents indexed'.format(build_index(args.save_directory)))
+    if not os.path.isfile(os.path.join(args.save_directory, SearchIndex.FILE_NAME)):
+        print('No index in {}, scrape with --index or run with --build'.format(args.save_directory))
+        return 1
+
+    index = SearchIndex(args.save_directory)
+    try:
+        if args.optimize:
+            index.optimize()
+        if not args.query:
+            print('{} patents in the index'.format(index.count()))
+            return 0
+
+        start = perf_counter()
+        try:
+            results = index.search(args.query, args.limit, args.raw)
+        except sqlite3.OperationalError as e:
+            print('Invalid query: {}'.format(e))
+            return 2
+        elapsed = perf_counter() - start
+    finally:
+        index.close()
+
+    for patent_id, score, link in results:
+        if args.json:
+            print(json.dumps({'id': patent_id, 'score': round(score, 4), 'link': link}))
+        else:
+            print('{:<20}{:>10.3f}  {}'.format(patent_id, score, link or ''))
+    if not args.json:
+        print('{} patents in {:.1f} ms'.format(len(results), elapsed * 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import hashlib
+import io
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+# columns of CSV/dataFrame.csv, in their order
+DATAFRAME_COLUMNS = ["id", "title", "assignee", "inventor/author", "priority date", "filing/creation date",
+                     "publication date", "grant date", "link", "patent office", "type", "status",
+                     "nb_received_citations", "nb_given_citations", 'nb_non_patent_citations', "abstract",
+                     "description", "claims"]
+
+# citation files of the CSV folder and the column holding the id of the scraped patent
+CITATION_FILES = {'given_citations.csv': 'SOURCE',
+                  'received_citations.csv': 'TARGET',
+                  'similar_documents.csv': 'SOURCE',
+                  'nonpatent_citations.csv': 'SOURCE'}
+
+
+def content_hash(data):
+    """
+    Returns the sha256 hex digest of a string or bytes object
+    :param data: String or bytes
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    return hashlib.sha256(data).hexdigest()
+
+
+_UMASK = None  # umask of the process, read once: os.umask can only be read by changing it
+
+
+def set_file_mode(temp_path, file_path, mode=None):
+    """
+    Gives a temporary file the permissions of the file it replaces
+    tempfile.mkstemp creates owner-only files (0600): a new file takes the mode
+    a plain open() would have given it, 0666 minus the umask
+    :param temp_path: temporary file, about to be renamed
+    :param file_path: destination of the rename
+    :param mode: permissions forced on the file, None to keep the ones described above
+    """
+    global _UMASK
+
+    if mode is None:
+        try:
+            mode = os.stat(file_path).st_mode & 0o7777
+        except OSError:
+            if _UMASK is None:
+                _UMASK = os.umask(0o022)
+                os.umask(_UMASK)
+            mode = 0o666 & ~_UMASK
+
+    os.chmod(temp_path, mode)
+
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    Returns the sha256 hex digest of a file, reading it by chunks
+    :param file_path: path to the file
+    :param chunk_size: number of bytes read at once
+    """
+    digest = hashlib.sha256()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_atomic(file_path, content, encoding='utf-8', fsync=False, mode=None):
+    """
+    Writes a whole file at once: the content goes into a temporary file of the same folder
+    which is then renamed into place, so a crash never leaves a half written file behind
+    If the file already exists with the same content, nothing is written
+    :param file_path: destination of the file
+    :param content: String or bytes, the complete content of the file
+    :param fsync: if True, the data is flushed to the disk before the rename
+    :param mode: permissions of the file, None for the ones of the file replaced, see set_file_mode
+    :return: True if the file has been written, False if it was already up to date
+    """
+    data = content.encode(encoding) if isinstance(content, str) else content
+
+    # the size is checked first so we only hash files that may be identical
+    if os.path.isfile(file_path) and os.path.getsize(file_path) == len(data):
+        if file_hash(file_path) == content_hash(data):
+            return False
+
+    directory = os.path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+            if fsync:
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+        set_file_mode(temp_path, file_path, mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return True
+
+
+def link_or_copy(source, file_path):
+    """
+    Hard-links a file to a new place, copies it if the filesystem cannot link
+    The destination is replaced if it already exists
+    """
+    if os.path.isfile(file_path) and os.path.samefile(source, file_path):
+        return
+
+    directory = os.path.dirname(file_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # a name of its own, two threads linking the same asset to the same place never share it
+    temp_path = os.path.join(directory, '.{}.{}.{}.link'.format(os.path.basename(file_path), os.getpid(),
+                                                               threading.get_ident()))
+
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def count_citations(csv_path):
+    """
+    Counts the lines of every citation csv file, before a run appends the new citations
+    :param csv_path: CSV folder of the output path
+    :return: dictionary {file name: number of lines without the header}
+    """
+    counts = {}
+
+    for name in CITATION_FILES:
+        file_path = os.path.join(csv_path, name)
+        if os.path.isfile(file_path):
+            with open(file_path, encoding='utf-8', newline='') as citation_file:
+                counts[name] = max(0, sum(1 for row in csv.reader(citation_file)) - 1)
+
+    return counts
+
+
+def remove_citations(csv_path, patent_ids, previous_counts=None):
+    """
+    Removes the citations of some patents from the citation csv files, which are only appended to,
+    so scraping them again replaces their citations instead of adding them twice
+    :param csv_path: CSV folder of the output path
+    :param patent_ids: set of the ids of the patents scraped again
+    :param previous_counts: lines of every file written by the previous run, see count_citations:
+                            only these lines are removed, the citations appended since are kept.
+                            None to look at every line
+    """
+    if not patent_ids:
+        return
+
+    for name, column in CITATION_FILES.items():
+        file_path = os.path.join(csv_path, name)
+        if not os.path.isfile(file_path):
+            continue
+
+        with open(file_path, encoding='utf-8', newline='') as citation_file:
+            rows = list(csv.reader(citation_file))
+
+        if not rows:
+            continue
+
+        end = len(rows) if previous_counts is None else previous_counts.get(name, 0) + 1
+        index = rows[0].index(column)
+        kept = [rows[0]] + [row for row in rows[1:end] if len(row) <= index or row[index] not in patent_ids]
+        kept += rows[end:]
+
+        if len(kept) != len(rows):
+            content = io.StringIO(newline='')
+            csv.writer(content).writerows(kept)
+            write_atomic(file_path, content.getvalue())
+
+
+class CsvAppender(object):
+    """
+    CSV file written line by line, so the lines do not have to be kept in memory until the end of the run
+    The file is rewritten from scratch: its header, the given lines, then the lines added by 'write'
+    """
+
+    def __init__(self, file_path, columns, delimiter=None, rows=()):
+        """
+        :param file_path: path to the CSV file
+        :param columns: list of the columns, the other keys of the lines are ignored
+        :param delimiter: delimiter of the CSV file, a comma by default
+        :param rows: iterable of lines {column: value} written first
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.file = open(file_path, 'wt', encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.file, columns, delimiter=delimiter or ',', extrasaction='ignore')
+        self.writer.writeheader()
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def write(self, row):
+        """
+        Appends a line to the file
+        :param row: dictionary {column: value}
+        """
+        with self.lock:
+            self.writer.writerow(row)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def sync_files(paths):
+    """
+    Flushes already written files to the disk
+    Missing files are ignored
+    :param paths: iterable of file paths
+    """
+    for file_path in paths:
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass  # some platforms cannot fsync a read-only descriptor
+        finally:
+            os.close(fd)
+
+
+class BackgroundWriter(threading.Thread):
+    """
+    Thread persisting items as soon as they are produced
+    Items are put into a bounded queue: when the disk is slower than the scraping,
+    the producers wait instead of keeping everything in memory
+    The items are written by batches, and the 'sync' function is called after every batch
+    """
+
+    def __init__(self, write, sync=None, queue_size=100, batch_size=10, logger=None):
+        """
+        :param write: function called with every item
+        :param sync: function called after each batch has been written, None to never sync
+        :param queue_size: maximum number of items waiting to be written
+        :param batch_size: maximum number of items written between two calls of 'sync'
+        :param logger: Logger object
+        """
+        super(BackgroundWriter, self).__init__(name='BackgroundWriter', daemon=True)
+        self.write = write
+        self.sync = sync
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = max(1, int(batch_size))
+        self.logger = logger or logging.getLogger()
+        self.nb_written = 0
+        self.failed = []  # [(item, exception)]
+
+    def put(self, item):
+        """Adds an item to write, waits if the queue is full"""
+        if not self.is_alive():
+            raise RuntimeError('The background writer is not running')
+        self.queue.put(item)
+
+    def flush(self):
+        """Waits for every item already queued to be written"""
+        if self.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """Waits for every queued item to be written and stops the thread"""
+        if self.is_alive():
+            self.queue.put(_STOP)
+            self.join()
+
+    def run(self):
+        running = True
+
+        while running:
+            batch = [self.queue.get()]
+
+            # takes whatever is already waiting, without blocking, to fill the batch
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if _STOP in batch:
+                running = False
+                batch = [item for item in batch if item is not _STOP]
+
+            for item in batch:
+                try:
+                    self.write(item)
+                    self.nb_written += 1
+                except Exception as msg:
+                    self.logger.exception('Background writer failed: %s', msg)
+                    self.failed.append((item, msg))
+
+            if batch and self.sync is not None:
+                try:
+                    self.sync()
+                except OSError as msg:
+                    self.logger.exception('Background writer cannot sync: %s', msg)
+
+            for i in range(len(batch) + (0 if running else 1)):
+                self.queue.task_done()
+
+
+_STOP = object()  # sentinel stopping the BackgroundWriter
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import sqlite3
+from time import time
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_worker_id():
+    """Returns an id unique to this process: hostname-pid"""
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue:
+    """
+    Queue of links shared by several worker processes, possibly on several machines
+    It is stored in a SQLite file, which can be on a shared volume
+
+    A worker leases a batch of links for lease_seconds and extends its lease with heartbeats
+    When a worker dies, its lease expires and the links are given to another worker
+    Every link keeps its position in the input csv file, so results can be merged in a fixed order
+    """
+
+    def __init__(self, db_path, lease_seconds=300, max_attempts=3):
+        """
+        :param db_path: path to the SQLite file, created if needed
+        :param lease_seconds: time a worker can keep links without a heartbeat
+        :param max_attempts: number of leases of a link before it is marked as failed
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                               'url TEXT PRIMARY KEY, '
+                               'position INTEGER, '
+                               'state TEXT, '
+                               'worker TEXT, '
+                               'lease_until REAL, '
+                               'attempts INTEGER DEFAULT 0, '
+                               'error TEXT)')
+            connection.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, position)')
+
+    def _connect(self):
+        """
+        Opens a new connection, so every thread and process has its own
+        The busy timeout makes concurrent workers wait for each other instead of failing
+        """
+        connection = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return _Transaction(connection)
+
+    def add(self, links):
+        """
+        Adds links to the queue, the links already in it are ignored
+        Every worker can call it with the same input file
+        :param links: list of links, in the order of the input csv file
+        """
+        with self._connect() as connection:
+            connection.executemany('INSERT OR IGNORE INTO tasks (url, position, state) VALUES (?, ?, ?)',
+                                   ((link, position, PENDING) for position, link in enumerate(links)))
+
+    def lease(self, worker_id, batch_size=10):
+        """
+        Gives a batch of links to a worker: pending links, or leased links whose lease expired
+        A link whose lease expired after its last attempt is marked as failed instead
+        :return: list of links, empty when there is nothing left to lease
+        """
+        now = time()
+
+        with self._connect() as connection:
+            # a link whose lease expired max_attempts times keeps killing or hanging its workers
+            connection.execute('UPDATE tasks SET state = ?, lease_until = NULL, error = ? '
+                               'WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                               (FAILED, 'lease expired', LEASED, now, self.max_attempts))
+            rows = connection.execute('SELECT url FROM tasks '
+                                      'WHERE state = ? OR (state = ? AND lease_until < ?) '
+                                      'ORDER BY position LIMIT ?',
+                                      (PENDING, LEASED, now, batch_size)).fetchall()
+            links = [row[0] for row in rows]
+            connection.executemany('UPDATE tasks SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 '
+                                   'WHERE url = ?',
+                                   ((LEASED, worker_id, now + self.lease_seconds, link) for link in links))
+
+        return links
+
+    def heartbeat(self, worker_id):
+        """Extends the lease of every link held by a worker"""
+        with self._connect() as connection:
+            connection.execute('UPDATE tasks SET lease_until = ? WHERE worker = ? AND state = ?',
+                               (time() + self.lease_seconds, worker_id, LEASED))
+
+    def complete(self, link, worker_id):
+        """
+        Marks a link as done by a worker
+        :return: False if the worker does not hold the lease anymore: the link was given to another worker
+        """
+        with self._connect() as connection:
+            cursor = connection.execute('UPDATE tasks SET state = ?, error = NULL '
+                                        'WHERE url = ? AND worker = ? AND state = ?',
+                                        (DONE, link, worker_id, LEASED))
+            return cursor.rowcount > 0
+
+    def fail(self, link, worker_id, error=''):
+        """
+        Gives back a link which could not be scraped
+        It will be leased again, unless it already failed max_attempts times
+        :return: False if the worker does not hold the lease anymore, the link is left to its new worker
+        """
+        with self._connect() as connection:
+            cursor = connection.execute('UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, '
+                                        'lease_until = NULL, error = ? '
+                                        'WHERE url = ? AND worker = ? AND state = ?',
+                                        (self.max_attempts, FAILED, PENDING, str(error), link, worker_id, LEASED))
+            return cursor.rowcount > 0
+
+    def counts(self):
+        """Returns the number of links in every state: {state: number}"""
+        with self._connect() as connection:
+            return dict(connection.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def is_finished(self):
+        """Returns True when no link is pending or leased anymore"""
+        counts = self.counts()
+        return not counts.get(PENDING) and not counts.get(LEASED)
+
+    def done_links(self):
+        """
+        Returns the links done and the worker which did them, in the order of the input file
+        :return: list of (link, worker id)
+        """
+        with self._connect() as connection:
+            return connection.execute('SELECT url, worker FROM tasks WHERE state = ? ORDER BY position',
+                                      (DONE,)).fetchall()
+
+
+class _Transaction:
+    """
+    Context manager running a block in a single write transaction and closing the connection
+    BEGIN IMMEDIATE takes the write lock first, so two workers can never lease the same links
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.connection.close()